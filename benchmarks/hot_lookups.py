@@ -0,0 +1,103 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Hot Lookup Benchmark
+
+Calls the model lookups that serve most requests many times and prints the
+time of a call and the part of it spent in Python, that is outside of the
+database driver's execute(). The database in DATABASE_URI gets a few
+orders to look up, and the session is emptied after every call so that
+each one goes to the database.
+
+Usage:
+    python benchmarks/hot_lookups.py [--calls 2000]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wsgi import app  # noqa: E402 pylint: disable=wrong-import-position
+from service.models import OrderItems, Orders, db  # noqa: E402 pylint: disable=wrong-import-position
+
+driver_seconds = [0.0]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,R0913
+    """Notes when the driver starts a statement"""
+    conn.info["benchmark_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,R0913
+    """Adds the time the driver took to run a statement"""
+    driver_seconds[0] += time.perf_counter() - conn.info.pop("benchmark_started")
+
+
+def measure(lookup, calls: int) -> tuple:
+    """Returns the microseconds of a call and of its Python part"""
+    lookup()
+    db.session.expunge_all()
+    driver_seconds[0] = 0.0
+    started = time.perf_counter()
+    for _ in range(calls):
+        lookup()
+        db.session.expunge_all()
+    total = time.perf_counter() - started
+    return total / calls * 1e6, (total - driver_seconds[0]) / calls * 1e6
+
+
+def main():
+    """Benchmarks each lookup and prints a table"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    # The INFO messages of the lookups would be most of what is measured
+    logging.getLogger("flask.app.models").setLevel(logging.WARNING)
+    with app.app_context():
+        order = Orders(customer_id=1, status="shipped", tracking_number="BENCH-1")
+        order.create()
+        order_id = order.order_id
+        item_id = OrderItems.create_item(order_id, {"product_id": 1, "quantity": 1, "price": "1.00"}).order_item_id
+        lookups = {
+            "Orders.find": lambda: Orders.find(order_id),
+            "Orders.find_by_customer_id": lambda: Orders.find_by_customer_id(1),
+            "Orders.find_by_status": lambda: Orders.find_by_status("shipped"),
+            "Orders.find_by_tracking_number": lambda: Orders.find_by_tracking_number("BENCH-1"),
+            "OrderItems.find_by_order": lambda: OrderItems.find_by_order(order_id),
+            "OrderItems.find_item_in_order": lambda: OrderItems.find_item_in_order(order_id, item_id),
+        }
+        print(f"{'lookup':<32}{'us/call':>10}{'python us':>10}")
+        try:
+            for name, lookup in lookups.items():
+                per_call, python = measure(lookup, args.calls)
+                print(f"{name:<32}{per_call:>10.1f}{python:>10.1f}")
+        finally:
+            db.session.rollback()
+            db.session.delete(db.session.get(Orders, order_id))
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
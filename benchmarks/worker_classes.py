@@ -0,0 +1,150 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Worker Class Benchmark
+
+Starts gunicorn with gunicorn.conf.py once per worker class and sends the
+same mix of order requests from a number of concurrent clients, then
+prints the throughput and latency percentiles of each class. The database
+in DATABASE_URI gets a few orders to read.
+
+Usage:
+    python benchmarks/worker_classes.py [--classes sync gthread gevent] [--clients 16] [--seconds 20]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+PORT = 8099
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+# Endpoint mix of (weight, method, path), {order_id} is one of the seeded orders
+REQUESTS = (
+    (6, "GET", "/orders/{order_id}"),
+    (3, "GET", "/orders?customer_id=1"),
+    (1, "POST", "/orders"),
+)
+
+
+def call(method: str, path: str, body: dict | None = None) -> int:
+    """Sends a request and returns its status code"""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(BASE_URL + path, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def start_server(worker_class: str) -> subprocess.Popen:
+    """Starts gunicorn with a worker class and waits until it answers"""
+    env = {**os.environ, "GUNICORN_WORKER_CLASS": worker_class, "GUNICORN_LOG_LEVEL": "warning"}
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        ["gunicorn", "--bind", f"127.0.0.1:{PORT}", "wsgi:app"], env=env
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            if call("GET", "/health") == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn with {worker_class} workers did not start")
+
+
+def run_clients(clients: int, seconds: float, order_ids: list) -> tuple:
+    """Sends the request mix from concurrent clients, returns latencies and errors"""
+    schedule = [(method, path) for weight, method, path in REQUESTS for _ in range(weight)]
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client(number: int):
+        count = number
+        while time.monotonic() < deadline:
+            method, path = schedule[count % len(schedule)]
+            path = path.format(order_id=order_ids[count % len(order_ids)])
+            started = time.perf_counter()
+            try:
+                code = call(method, path, {"customer_id": 1} if method == "POST" else None)
+            except OSError:
+                code = 0
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if code >= 500 or code == 0:
+                    errors.append(code)
+            count += 1
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns a percentile of sorted values"""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    """Benchmarks each worker class and prints a table"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--classes", nargs="+", default=["sync", "gthread", "gevent"])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=20)
+    args = parser.parse_args()
+
+    print(f"{'class':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>10}")
+    for worker_class in args.classes:
+        try:
+            server = start_server(worker_class)
+        except RuntimeError as error:
+            print(f"{worker_class:<10}{error}", file=sys.stderr)
+            continue
+        try:
+            order_ids = []
+            for _ in range(20):
+                req = urllib.request.Request(
+                    BASE_URL + "/orders", data=b'{"customer_id": 1}', headers={"Content-Type": "application/json"}
+                )
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    order_ids.append(json.loads(resp.read())["order_id"])
+            latencies, errors = run_clients(args.clients, args.seconds, order_ids)
+        finally:
+            server.terminate()
+            server.wait()
+        latencies.sort()
+        print(
+            f"{worker_class:<10}{len(latencies) / args.seconds:>10.1f}"
+            f"{percentile(latencies, 0.5) * 1000:>10.1f}{percentile(latencies, 0.99) * 1000:>10.1f}{len(errors):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Gunicorn Configuration
+
+gunicorn reads this file from the working folder. The number of workers
+follows the CPU limit of the container, not the CPUs of the node, and
+every setting can be changed with a GUNICORN_* environment variable.
+"""
+import os
+import math
+import signal
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cpu_limit(root: str = CGROUP_ROOT) -> float:
+    """Returns the CPUs the container may use
+
+    The cgroup v2 or v1 CPU quota wins over the CPUs the process can run on
+    """
+    cpus = float(len(os.sched_getaffinity(0)))
+    try:
+        with open(os.path.join(root, "cpu.max"), encoding="ascii") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            return min(cpus, int(quota) / int(period))
+        return cpus
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us"), encoding="ascii") as cfs_quota:
+            quota = int(cfs_quota.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us"), encoding="ascii") as cfs_period:
+            period = int(cfs_period.read())
+        if quota > 0:
+            return min(cpus, quota / period)
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def default_workers(cpus: float) -> int:
+    """Returns two workers per CPU, the threads of each wait on the database"""
+    return max(1, math.ceil(cpus * 2))
+
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# "gthread" or "gevent", gevent must be installed and needs no threads.
+# A gthread worker keeps threads free of event streams with SSE_MAX_STREAMS,
+# gevent workers serve any number of streams with SSE_MAX_STREAMS=0.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", str(default_workers(cpu_limit()))))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+
+# Workers are replaced after a number of requests, the jitter keeps them
+# from restarting all at once, which bounds the growth of their memory
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Longer than the idle timeout of the router in front of the pods
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+
+# Loads the app once in the master, which verifies the schema once, but
+# the master then takes as much memory as a worker
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+
+def post_fork(server, worker):
+    """Gives a worker forked from a preloading master its own connection pool"""
+    if not server.cfg.preload_app:
+        return
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+
+    app = worker.app.wsgi()
+    with app.app_context():
+        # The connections stay open for the master, close=False leaves them be
+        db.engine.dispose(close=False)
+    server.log.info("Worker %s has a new database connection pool", worker.pid)
+
+
+def post_worker_init(worker):  # pylint: disable=unused-argument
+    """Fails /readyz as soon as the worker gets SIGTERM"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.lifecycle import lifecycle
+
+    lifecycle.handle_signal(signal.SIGTERM)
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """Closes the database connections of a worker that stopped serving"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.lifecycle import lifecycle
+
+    if lifecycle.app is not None:
+        lifecycle.shutdown()
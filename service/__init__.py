@@ -19,6 +19,7 @@ This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
 import sys
+import click
 from flask import Flask
 from service import config
 from service.common import log_handlers
@@ -27,7 +28,7 @@ from service.common import log_handlers
 ############################################################
 # Initialize the Flask instance
 ############################################################
-def create_app():
+def create_app():  # pylint: disable=too-many-locals
     """Initialize the core application."""
     # Create Flask application
     app = Flask(__name__)
@@ -36,16 +37,43 @@ def create_app():
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
     from service.models import db
+    from service.common.archive import order_archive
+    from service.common.cache import order_cache
+    from service.common.compression import compressor
+    from service.common.lifecycle import lifecycle
+    from service.common.query_budget import query_budget
+    from service.common.rate_limit import rate_limiter
+    from service.common.sales import product_sales
+    from service.common.single_flight import single_flight
+    from service.common.tracing import tracer
     db.init_app(app)
+    # Registered first so that it runs after the other after_request hooks
+    compressor.init_app(app)
+    order_archive.init_app(app)
+    order_cache.init_app(app)
+    lifecycle.init_app(app)
+    query_budget.init_app(app)
+    tracer.init_app(app)
+    rate_limiter.init_app(app)
+    product_sales.init_app(app)
+    single_flight.init_app(app)
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
         # pylint: disable=wrong-import-position, wrong-import-order, unused-import
         from service import routes, models  # noqa: F401 E402
-        from service.common import error_handlers, cli_commands  # noqa: F401, E402
+        from service.common import error_handlers, migrations, profiler  # noqa: F401, E402
+
+        # Only the flask command needs the CLI commands and the modules they use
+        if click.get_current_context(silent=True) is not None:
+            from service.common import cli_commands
+            cli_commands.init_app(app)
 
         try:
-            db.create_all()
+            if app.config["DB_SCHEMA_MODE"] == "upgrade":
+                migrations.upgrade(db.engine)
+            elif app.config["DB_SCHEMA_MODE"] == "verify":
+                migrations.verify(db.engine)
         except Exception as error:  # pylint: disable=broad-except
             app.logger.critical("%s: Cannot continue", error)
             # gunicorn requires exit code 4 to stop spawning workers when they die
@@ -53,11 +81,13 @@ def create_app():
 
         # Set up logging for production
         log_handlers.init_logging(app, "gunicorn.error")
+        log_handlers.init_request_logging(app)
 
         app.logger.info(70 * "*")
         app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
         app.logger.info(70 * "*")
 
-        app.logger.info("Service initialized!")
+        rss = profiler.resident_memory()
+        app.logger.info("Service initialized! Resident memory: %s MiB", rss and round(rss / 2**20, 1))
 
         return app
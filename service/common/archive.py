@@ -0,0 +1,114 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order Archive
+
+Cold storage for orders that are no longer changing. Each batch of orders
+is written to a gzip compressed file with one JSON document per line, and
+an SQLite index in the same folder maps every order id to its file and line.
+"""
+import os
+import gzip
+import json
+import logging
+import threading
+from functools import lru_cache
+
+logger = logging.getLogger("flask.app")
+
+INDEX_FILE = "index.sqlite"
+
+
+@lru_cache(maxsize=8)
+def read_batch(path: str, mtime: float) -> list:  # pylint: disable=unused-argument
+    """Returns the lines of a batch file, recently used files stay in memory"""
+    with gzip.open(path, "rt", encoding="utf-8") as batch:
+        return batch.readlines()
+
+
+class OrderArchive:
+    """A folder of compressed batches of orders with an index"""
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """Uses the folder in ARCHIVE_PATH, archiving is off without one"""
+        self.path = app.config.get("ARCHIVE_PATH")
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        """True if an archive folder is configured"""
+        return bool(self.path)
+
+    def _index(self):
+        """Returns the sqlite3 index connection of the current thread"""
+        index = getattr(self._local, "index", None)
+        if index is None or self._local.path != self.path:
+            # Most workers never read the archive
+            import sqlite3  # pylint: disable=import-outside-toplevel
+
+            os.makedirs(self.path, exist_ok=True)
+            index = sqlite3.connect(os.path.join(self.path, INDEX_FILE))
+            index.execute("PRAGMA journal_mode=WAL")
+            index.execute(
+                "CREATE TABLE IF NOT EXISTS archived_orders "
+                "(order_id INTEGER PRIMARY KEY, file TEXT NOT NULL, line INTEGER NOT NULL)"
+            )
+            self._local.index = index
+            self._local.path = self.path
+        return index
+
+    def write_batch(self, orders: list) -> str:
+        """Writes serialized orders to a new batch file and indexes them
+
+        Returns the name of the batch file
+        """
+        name = f"orders-{orders[0]['order_id']:010d}-{orders[-1]['order_id']:010d}.ndjson.gz"
+        path = os.path.join(self.path, name)
+        os.makedirs(self.path, exist_ok=True)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as batch:
+            for order in orders:
+                batch.write(json.dumps(order, separators=(",", ":")) + "\n")
+        # Only complete files are ever visible under their final name
+        os.replace(path + ".tmp", path)
+
+        index = self._index()
+        with index:
+            index.executemany(
+                "INSERT OR REPLACE INTO archived_orders (order_id, file, line) VALUES (?, ?, ?)",
+                [(order["order_id"], name, line) for line, order in enumerate(orders)],
+            )
+        logger.info("Archived %s orders to %s", len(orders), name)
+        return name
+
+    def find(self, order_id: int) -> dict | None:
+        """Returns a serialized archived order, or None if it is not archived"""
+        if not self.enabled or not os.path.exists(os.path.join(self.path, INDEX_FILE)):
+            return None
+        entry = self._index().execute(
+            "SELECT file, line FROM archived_orders WHERE order_id = ?", (order_id,)
+        ).fetchone()
+        if entry is None:
+            return None
+        path = os.path.join(self.path, entry[0])
+        return json.loads(read_batch(path, os.path.getmtime(path))[entry[1]])
+
+
+order_archive = OrderArchive()
@@ -0,0 +1,250 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Versioned Cache
+
+Two level cache of values that belong to a scope, such as the orders of a
+customer. Every scope has a version in the shared cache that is bumped
+after a transaction that changes the scope commits, and the version is
+part of the key of every value, so a change makes the old values
+unreachable in every process at once. Values are kept in a small LRU of
+the process in front of the shared cache. A value older than
+ORDER_CACHE_TTL is still returned for ORDER_CACHE_STALE more seconds while
+a background thread loads a fresh one.
+
+The shared cache is the Redis server of CACHE_URL, which needs the redis
+package. Without one, versions and values stay in each process: a change
+is seen at once by the process that made it, while the other workers
+keep serving their copy for up to ORDER_CACHE_TTL + ORDER_CACHE_STALE.
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger("flask.app")
+
+# Scopes changed by the current transaction of a session
+CHANGED_SCOPES = "cache_changed_scopes"
+
+
+class LocalCache:
+    """An in-process store with the interface of a shared cache
+
+    A shared cache needs get(), set() with an expiry and an atomic incr()
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Returns the value of a key, or None if it is missing or expired"""
+        with self._lock:
+            value, expires = self._values.get(key, (None, None))
+            if expires is not None and expires <= time.time():
+                return None
+            return value
+
+    def set(self, key: str, value, ttl: float | None = None):
+        """Sets the value of a key that expires after ttl seconds, or never"""
+        with self._lock:
+            if len(self._values) >= self.max_keys:
+                now = time.time()
+                self._values = {
+                    name: entry for name, entry in self._values.items() if entry[1] is None or entry[1] > now
+                }
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    def incr(self, key: str) -> int:
+        """Adds one to the number in a key and returns it"""
+        with self._lock:
+            value = (self._values.get(key, (0, None))[0] or 0) + 1
+            self._values[key] = (value, None)
+            return value
+
+
+class RedisCache:
+    """The shared cache of CACHE_URL, with values stored as JSON
+
+    A cache that fails is skipped, an outage of Redis must not take the
+    service down with it.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str):
+        """Returns the value of a key, or None if it is missing or Redis failed"""
+        try:
+            data = self.client.get(key)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Shared cache failed to get %s: %s", key, error)
+            return None
+        return None if data is None else json.loads(data)
+
+    def set(self, key: str, value, ttl: float | None = None):
+        """Sets the value of a key that expires after ttl seconds, or never"""
+        try:
+            self.client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Shared cache failed to set %s: %s", key, error)
+
+    def incr(self, key: str) -> int | None:
+        """Adds one to the number in a key and returns it"""
+        try:
+            return self.client.incr(key)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Shared cache failed to bump %s, its values stay until they expire: %s", key, error)
+            return None
+
+
+class VersionedCache:
+    """A process LRU in front of a shared cache, with versioned scopes"""
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        # The versions of the scopes when there is no shared cache
+        self._versions = LocalCache()
+        self.app = None
+        self.ttl = 0.0
+        self.stale = 0.0
+        self.size = 0
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = {}
+
+    def init_app(self, app, shared=None):
+        """Caches for ORDER_CACHE_TTL seconds, 0 turns the cache off, shared by the workers with CACHE_URL"""
+        url = app.config.get("CACHE_URL")
+        if shared is not None:
+            self.shared = shared
+        elif url and redis is None:
+            logger.error("CACHE_URL needs the redis package, orders are only cached in each process")
+        elif url:
+            self.shared = RedisCache(redis.Redis.from_url(url))
+        self.app = app
+        self.ttl = app.config.get("ORDER_CACHE_TTL", 0)
+        self.stale = app.config.get("ORDER_CACHE_STALE", 0)
+        self.size = app.config.get("ORDER_CACHE_SIZE", 1000)
+        with self._lock:
+            self._local.clear()
+
+    @property
+    def enabled(self) -> bool:
+        """True if values are cached"""
+        return self.ttl > 0
+
+    def get(self, scope: str, name: str, loader):
+        """Returns a value of a scope, calling loader() to load it if needed"""
+        if not self.enabled:
+            return loader()
+        key = f"{scope}:v{self.versions.get(scope + ':version') or 0}:{name}"
+        entry = self._get_local(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self._set_local(key, entry)
+        if entry is not None:
+            stored, value = entry
+            age = time.time() - stored
+            if age <= self.ttl:
+                return value
+            if age <= self.ttl + self.stale:
+                self._revalidate(key, loader)
+                return value
+        return self._load(key, loader)
+
+    @property
+    def versions(self):
+        """The cache that holds the versions of the scopes"""
+        return self.shared if self.shared is not None else self._versions
+
+    def bump(self, scopes):
+        """Makes the cached values of scopes unreachable"""
+        for scope in scopes:
+            self.versions.incr(scope + ":version")
+
+    def changed(self, session, scopes):
+        """Notes scopes changed by the session's transaction, bumped when it commits"""
+        if self.enabled:
+            session.info.setdefault(CHANGED_SCOPES, set()).update(scopes)
+
+    def after_commit(self, session):
+        """Bumps the scopes changed by a transaction that committed"""
+        self.bump(session.info.pop(CHANGED_SCOPES, ()))
+
+    @staticmethod
+    def after_rollback(session):
+        """Forgets the scopes changed by a transaction that was rolled back"""
+        session.info.pop(CHANGED_SCOPES, None)
+
+    def _load(self, key: str, loader):
+        value = loader()
+        entry = (time.time(), value)
+        if self.shared is not None:
+            self.shared.set(key, entry, self.ttl + self.stale)
+        self._set_local(key, entry)
+        return value
+
+    def _revalidate(self, key: str, loader):
+        """Loads a fresh value in the background, once per key at a time"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            thread = threading.Thread(target=self._refresh, args=(key, loader), name="cache-refresh", daemon=True)
+            self._refreshing[key] = thread
+        thread.start()
+
+    def _refresh(self, key: str, loader):
+        try:
+            with self.app.app_context():
+                self._load(key, loader)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Cannot refresh cached %s: %s", key, error)
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def _get_local(self, key: str):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                self._local.move_to_end(key)
+            return entry
+
+    def _set_local(self, key: str, entry):
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.size:
+                self._local.popitem(last=False)
+
+
+order_cache = VersionedCache()
+
+event.listen(Session, "after_commit", order_cache.after_commit)
+event.listen(Session, "after_rollback", order_cache.after_rollback)
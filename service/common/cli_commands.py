@@ -15,9 +15,16 @@
 ######################################################################
 """
 Flask CLI Command Extensions
+
+Only the flask command loads this module, see init_app()
 """
-from flask import current_app as app  # Import Flask application
-from service.models import db
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from service.models import Orders, db
+from service.common import migrations, partitions
+from service.common.archive import order_archive
+from service.common.sales import product_sales
 
 
 ######################################################################
@@ -25,7 +32,8 @@ from service.models import db
 # Usage:
 #   flask db-create
 ######################################################################
-@app.cli.command("db-create")
+@click.command("db-create")
+@with_appcontext
 def db_create():
     """
     Recreates a local database. You probably should not use this on
@@ -34,3 +42,118 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to maintain the monthly partitions of orders
+# Usage:
+#   flask db-partition [--init] [--months-ahead 3] [--retain-months 24]
+######################################################################
+@click.command("db-partition")
+@with_appcontext
+@click.option("--init", is_flag=True, help="Convert orders and order_items to partitioned tables first.")
+@click.option("--months-back", default=12, show_default=True, help="Past months given a partition by --init.")
+@click.option("--months-ahead", default=3, show_default=True, help="Upcoming months to create partitions for.")
+@click.option("--retain-months", default=0, show_default=True, help="Detach older months, 0 keeps them all.")
+def db_partition(init, months_back, months_ahead, retain_months):
+    """
+    Creates upcoming monthly partitions of orders and order items and
+    detaches old ones. Requires PostgreSQL 15 or later.
+    """
+    this_month = partitions.month_start(datetime.utcnow())
+    with db.engine.begin() as conn:
+        try:
+            if init:
+                partitions.partition_tables(conn, partitions.add_months(this_month, -months_back), this_month)
+            elif not partitions.is_partitioned(conn):
+                raise partitions.PartitionError("The orders table is not partitioned, use --init")
+        except partitions.PartitionError as error:
+            raise click.ClickException(str(error)) from error
+
+        created = partitions.create_partitions(conn, this_month, partitions.add_months(this_month, months_ahead))
+        detached = []
+        if retain_months > 0:
+            detached = partitions.detach_partitions(conn, partitions.add_months(this_month, -retain_months))
+    for name in created:
+        click.echo(f"Created partition {name}")
+    for name in detached:
+        click.echo(f"Detached partition {name}")
+
+
+######################################################################
+# Command to apply pending schema migrations
+# Usage:
+#   flask db-upgrade
+######################################################################
+@click.command("db-upgrade")
+@with_appcontext
+def db_upgrade():
+    """
+    Brings the database schema up to date with the models. Safe to run
+    on every deployment.
+    """
+    applied = migrations.upgrade(db.engine)
+    for version, description in applied:
+        click.echo(f"Applied schema version {version}: {description}")
+    click.echo(f"Database is at schema version {migrations.latest_version()}")
+
+
+######################################################################
+# Command to move finished orders to the archive
+# Usage:
+#   flask orders-archive [--days 365] [--batch-size 1000]
+######################################################################
+@click.command("orders-archive")
+@with_appcontext
+@click.option("--days", default=365, show_default=True, help="Archive orders placed more than this many days ago.")
+@click.option("--batch-size", default=1000, show_default=True, help="Orders in each archive file.")
+def orders_archive(days, batch_size):
+    """
+    Moves delivered, cancelled and refunded orders and their items to
+    compressed files in ARCHIVE_PATH. They can still be read by id.
+    """
+    if not order_archive.enabled:
+        raise click.ClickException("Set ARCHIVE_PATH to the folder of the archive")
+    archived = Orders.archive(datetime.utcnow() - timedelta(days=days), batch_size)
+    click.echo(f"Archived {archived} orders to {order_archive.path}")
+
+
+######################################################################
+# Command to repair the item counts and totals of orders
+# Usage:
+#   flask orders-recompute-totals [--batch-size 1000]
+######################################################################
+@click.command("orders-recompute-totals")
+@with_appcontext
+@click.option("--batch-size", default=1000, show_default=True, help="Orders recomputed in each transaction.")
+def orders_recompute_totals(batch_size):
+    """
+    Counts the items of every order again and repairs the item_count and
+    total_amount of the orders that drifted. Safe to run while serving.
+    """
+    repaired = Orders.recompute_totals(batch_size)
+    click.echo(f"Repaired the totals of {repaired} orders")
+
+
+######################################################################
+# Command to roll up the daily sales of products
+# Usage:
+#   flask sales-rollup [--days 3]
+######################################################################
+@click.command("sales-rollup")
+@with_appcontext
+@click.option("--days", default=3, show_default=True, help="Past days summed again on every run.")
+def sales_rollup(days):
+    """
+    Sums the sales of every product and day into product_daily_sales, the
+    first time for all days and then for the new days, the last few days
+    and the days that item and order writes changed. Run it daily.
+    """
+    refreshed = product_sales.refresh(days)
+    click.echo(f"Rolled up the sales of {refreshed} days")
+
+
+def init_app(app):
+    """Adds the commands to the flask command of the app"""
+    for command in (db_create, db_partition, db_upgrade, orders_archive, orders_recompute_totals, sales_rollup):
+        app.cli.add_command(command)
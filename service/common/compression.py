@@ -0,0 +1,122 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Response Compression
+
+Compresses responses with the best encoding the client accepts. gzip is
+always available, brotli and zstd are used when the brotli and zstandard
+packages are installed. Small responses are sent as they are, streamed
+responses are compressed chunk by chunk, except event streams, which must
+reach the client as soon as they are written.
+"""
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/merge-patch+json",
+    "text/css",
+    "text/html",
+    "text/plain",
+}
+
+
+class BrotliEncoder:  # pragma: no cover
+    """Gives brotli.Compressor the compress and flush methods of zlib"""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a chunk of data"""
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        """Returns the end of the compressed data"""
+        return self._compressor.finish()
+
+
+def available_encoders() -> dict:
+    """Returns the encoders that can be used, best first, by name"""
+    encoders = {}
+    if zstandard is not None:  # pragma: no cover
+        encoders["zstd"] = ("COMPRESSION_ZSTD_LEVEL", lambda level: zstandard.ZstdCompressor(level=level).compressobj())
+    if brotli is not None:  # pragma: no cover
+        encoders["br"] = ("COMPRESSION_BROTLI_LEVEL", BrotliEncoder)
+    encoders["gzip"] = ("COMPRESSION_GZIP_LEVEL", lambda level: zlib.compressobj(level, zlib.DEFLATED, 31))
+    return encoders
+
+
+def compress_stream(chunks, encoder):
+    """Compresses a streamed response chunk by chunk"""
+    for chunk in chunks:
+        data = encoder.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield encoder.flush()
+
+
+class Compressor:
+    """Compresses the responses of an app"""
+
+    def __init__(self):
+        self.encoders = available_encoders()
+
+    def init_app(self, app):
+        """Compresses responses of COMPRESSION_MIN_SIZE bytes or more"""
+        app.after_request(self.compress)
+
+    def compress(self, response):
+        """Compresses a response if the client accepts an available encoding"""
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        if not response.is_streamed and len(response.get_data()) < current_app.config["COMPRESSION_MIN_SIZE"]:
+            return response
+        encoding = request.accept_encodings.best_match(list(self.encoders))
+        if encoding is None:
+            return response
+
+        setting, create = self.encoders[encoding]
+        encoder = create(current_app.config[setting])
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoder)
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(encoder.compress(response.get_data()) + encoder.flush())
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+compressor = Compressor()
@@ -18,7 +18,7 @@ Module: error_handlers
 """
 from flask import jsonify
 from flask import current_app as app  # Import Flask application
-from service.models import DataValidationError
+from service.models import DataValidationError, StatusTransitionError
 from . import status
 
 
@@ -31,6 +31,12 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@app.errorhandler(StatusTransitionError)
+def status_transition_error(error):
+    """Handles status changes the order cannot make"""
+    return resource_conflict(error)
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
@@ -44,6 +50,17 @@ def bad_request(error):
     )
 
 
+@app.errorhandler(status.HTTP_401_UNAUTHORIZED)
+def unauthorized(error):
+    """Handles requests without valid credentials with 401_UNAUTHORIZED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_401_UNAUTHORIZED, error="Unauthorized", message=message),
+        status.HTTP_401_UNAUTHORIZED,
+    )
+
+
 @app.errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
@@ -70,6 +87,17 @@ def method_not_supported(error):
     )
 
 
+@app.errorhandler(status.HTTP_409_CONFLICT)
+def resource_conflict(error):
+    """Handles conflicts with the current state of a resource with 409_CONFLICT"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_409_CONFLICT, error="Conflict", message=message),
+        status.HTTP_409_CONFLICT,
+    )
+
+
 @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
@@ -85,6 +113,18 @@ def mediatype_not_supported(error):
     )
 
 
+@app.errorhandler(status.HTTP_429_TOO_MANY_REQUESTS)
+def too_many_requests(error):
+    """Handles clients over their rate limit with 429_TOO_MANY_REQUESTS"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_429_TOO_MANY_REQUESTS, error="Too Many Requests", message=message),
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        retry_after(error),
+    )
+
+
 @app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
@@ -98,3 +138,21 @@ def internal_server_error(error):
         ),
         status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
+
+
+@app.errorhandler(status.HTTP_503_SERVICE_UNAVAILABLE)
+def service_unavailable(error):
+    """Handles requests shed under load with 503_SERVICE_UNAVAILABLE"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_503_SERVICE_UNAVAILABLE, error="Service Unavailable", message=message),
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        retry_after(error),
+    )
+
+
+def retry_after(error) -> dict:
+    """Returns the Retry-After header of an error that has one"""
+    seconds = getattr(error, "retry_after", None)
+    return {"Retry-After": str(seconds)} if seconds is not None else {}
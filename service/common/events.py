@@ -0,0 +1,174 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order Events
+
+This module fans out order status transitions to Server-Sent Events
+subscribers. On PostgreSQL the transitions are sent with NOTIFY inside the
+transaction that writes them and are received by a single LISTEN connection
+per worker process. On any other database they are dispatched in-process
+once the transaction commits.
+"""
+import json
+import queue
+import select
+import logging
+import threading
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("flask.app")
+
+CHANNEL = "order_events"
+PENDING_EVENTS = "pending_order_events"
+
+
+class Subscription:
+    """A bounded queue of events for one client, optionally for one order"""
+
+    def __init__(self, order_id: int | None = None, maxsize: int = 100):
+        self.order_id = order_id
+        self.events = queue.Queue(maxsize)
+
+    def deliver(self, payload: dict):
+        """Queues the event if this subscription is interested in it"""
+        if self.order_id is not None and payload["order_id"] != self.order_id:
+            return
+        try:
+            self.events.put_nowait(payload)
+        except queue.Full:
+            logger.warning("Dropping event for slow subscriber: %s", payload)
+
+    def get(self, timeout: float) -> dict | None:
+        """Waits up to timeout seconds for the next event"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """Publishes order events and dispatches them to subscriptions"""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._listener = None
+
+    ##################################################
+    # Publishing
+    ##################################################
+
+    def publish(self, session, payloads: list):
+        """Sends events as part of the session's current transaction"""
+        if not payloads:
+            return
+        if session.get_bind().dialect.name == "postgresql":
+            session.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                [{"channel": CHANNEL, "payload": json.dumps(payload)} for payload in payloads],
+            )
+        else:
+            session.info.setdefault(PENDING_EVENTS, []).extend(payloads)
+
+    def after_commit(self, session):
+        """Dispatches events that were held back until commit"""
+        for payload in session.info.pop(PENDING_EVENTS, []):
+            self.dispatch(payload)
+
+    @staticmethod
+    def after_rollback(session):
+        """Discards events of a transaction that was rolled back"""
+        session.info.pop(PENDING_EVENTS, None)
+
+    def dispatch(self, payload: dict):
+        """Delivers an event to every subscription"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.deliver(payload)
+
+    ##################################################
+    # Subscribing
+    ##################################################
+
+    def subscribe(self, engine, order_id: int | None = None, limit: int = 0) -> Subscription | None:
+        """Registers a new subscription, starting the listener if needed
+
+        Returns None if there are limit subscriptions already, 0 is no limit
+        """
+        subscription = Subscription(order_id)
+        with self._lock:
+            if limit and len(self._subscriptions) >= limit:
+                return None
+            self._subscriptions.add(subscription)
+        if engine.dialect.name == "postgresql":
+            self._start_listener(engine.url)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Removes a subscription"""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def close(self):
+        """Stops the listener thread"""
+        self._stop.set()
+        if self._listener:
+            self._listener.join(timeout=5)
+        self._listener = None
+
+    def _start_listener(self, url, timeout: float = 5.0):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                conninfo = url.set(drivername="postgresql").render_as_string(hide_password=False)
+                self._stop.clear()
+                self._ready.clear()
+                self._listener = threading.Thread(
+                    target=self._listen, args=(conninfo,), name="order-events", daemon=True
+                )
+                self._listener.start()
+        if not self._ready.wait(timeout):
+            logger.error("Order event listener is not ready after %s seconds", timeout)
+
+    def _listen(self, conninfo: str):
+        """Holds one LISTEN connection for the whole process"""
+        import psycopg  # pylint: disable=import-outside-toplevel
+
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as conn:
+                    conn.add_notify_handler(lambda notify: self.dispatch(json.loads(notify.payload)))
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    self._ready.set()
+                    while not self._stop.is_set():
+                        readable, _, _ = select.select([conn.fileno()], [], [], 1.0)
+                        if readable:
+                            # Notifications are handed to the handler while a command runs
+                            conn.execute("SELECT 1")
+            except psycopg.Error as error:  # pragma: no cover
+                self._ready.clear()
+                logger.error("Order event listener lost its connection: %s", error)
+                self._stop.wait(1.0)
+
+
+broker = EventBroker()
+
+event.listen(Session, "after_commit", broker.after_commit)
+event.listen(Session, "after_rollback", broker.after_rollback)
@@ -0,0 +1,136 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Keyset Pagination
+
+Sorting by a list of columns such as "order_date,-discount_amount", where
+a leading - sorts in descending order, and pages that start after the
+sort values of the last row of the previous page. Unlike an offset, a
+page token lets the database seek straight to the next page along an
+index. The primary key is always the last sort column, so the order is
+total and no row is skipped or repeated between pages. NULLs sort after
+every value, last in ascending and first in descending order, as the
+indexes of PostgreSQL keep them.
+"""
+import json
+import base64
+from datetime import datetime
+from sqlalchemy import and_, bindparam, or_, tuple_
+
+
+def parse_sort(value: str, columns: dict, key: str) -> list:
+    """Returns the (name, column, descending) to sort by, ending with the key
+
+    Raises ValueError for a column that is not in columns
+    """
+    order = []
+    for name in (value or key).split(","):
+        name = name.strip()
+        descending = name.startswith("-")
+        name = name.lstrip("-")
+        if name not in columns:
+            raise ValueError(f"Cannot sort by {name!r}, sort by one of {', '.join(sorted(columns))}")
+        if name not in [entry[0] for entry in order]:
+            order.append((name, columns[name], descending))
+    if key not in [entry[0] for entry in order]:
+        # The key follows the direction of the last column, so that a single
+        # index on (column, key) serves both directions
+        order.append((key, columns[key], order[-1][2]))
+    return order
+
+
+def sort_string(order: list) -> str:
+    """Returns the canonical sort value of an order"""
+    return ",".join(("-" if descending else "") + name for name, _, descending in order)
+
+
+def order_by(order: list) -> list:
+    """Returns the ORDER BY clauses of an order"""
+    clauses = []
+    for _, column, descending in order:
+        if not column.nullable:
+            clauses.append(column.desc() if descending else column.asc())
+        else:
+            clauses.append(column.desc().nulls_first() if descending else column.asc().nulls_last())
+    return clauses
+
+
+def after(order: list, values: list):
+    """Returns the condition of the rows that come after values in an order"""
+    params = [bindparam(None, value, type_=column.type) for (_, column, _), value in zip(order, values)]
+    descending = {entry[2] for entry in order}
+    # Rows with a NULL compare as NULL and are left out, which is only right
+    # when NULLs come before the values, in descending order
+    nulls_left_out = descending == {True} or not any(column.nullable for _, column, _ in order)
+    if len(descending) == 1 and None not in values and nulls_left_out:
+        # A row comparison the database matches against a multi-column index
+        columns = tuple_(*[column for _, column, _ in order])
+        return columns < tuple_(*params) if descending.pop() else columns > tuple_(*params)
+    clauses = []
+    for position, (_, column, is_descending) in enumerate(order):
+        beyond = _beyond(column, values[position], params[position], is_descending)
+        if beyond is not None:
+            equal = [
+                entry[1].is_(None) if value is None else entry[1] == param
+                for entry, value, param in zip(order[:position], values, params)
+            ]
+            clauses.append(and_(*equal, beyond))
+    return or_(*clauses)
+
+
+def _beyond(column, value, param, descending: bool):
+    """Returns the condition of the values of a column after value, None if there are none"""
+    if descending:
+        return column.is_not(None) if value is None else column < param
+    if value is None:
+        return None
+    return or_(column > param, column.is_(None)) if column.nullable else column > param
+
+
+def encode_token(order: list, values: list) -> str:
+    """Returns the page token of the rows after values"""
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    data = json.dumps({"sort": sort_string(order), "after": values}, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_token(token: str, order: list) -> list:
+    """Returns the sort values in a page token
+
+    Raises ValueError if the token is invalid or was made for another sort
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        sort, values = data["sort"], list(data["after"])
+    except (ValueError, TypeError, KeyError) as error:
+        raise ValueError("Invalid page token") from error
+    if sort != sort_string(order) or len(values) != len(order):
+        raise ValueError("The page token is for another sort")
+    try:
+        return [_load(column, value) for (_, column, _), value in zip(order, values)]
+    except (ValueError, TypeError, ArithmeticError) as error:
+        raise ValueError("Invalid page token") from error
+
+
+def _load(column, value):
+    """Converts a value of a token back to the type of its column"""
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    return python_type(value)
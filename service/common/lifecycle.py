@@ -0,0 +1,115 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Worker Lifecycle
+
+Graceful shutdown of a worker. Once a worker is told to stop, by SIGTERM
+or by the DRAIN_FILE that the preStop hook of the pod creates, /readyz
+fails so that no new requests are routed to it. The requests in flight
+get until DRAIN_TIMEOUT to finish, then the event listener is stopped and
+the connection pool is closed, so the database does not see connections
+that just disappear.
+"""
+import os
+import signal
+import logging
+import threading
+from flask import g
+
+logger = logging.getLogger("flask.app")
+
+
+class Lifecycle:
+    """Tracks the requests in flight of a worker and drains them on shutdown"""
+
+    def __init__(self):
+        self.app = None
+        self.in_flight = 0
+        self._draining = threading.Event()
+        self._idle = threading.Condition()
+        self._previous_handlers = {}
+
+    def init_app(self, app):
+        """Counts the app's requests in flight"""
+        self.app = app
+        self._draining.clear()
+        app.before_request(self.start_request)
+        app.teardown_request(self.end_request)
+
+    @property
+    def draining(self) -> bool:
+        """True once the worker has been told to stop"""
+        if self._draining.is_set():
+            return True
+        drain_file = self.app.config.get("DRAIN_FILE") if self.app else None
+        return bool(drain_file) and os.path.exists(drain_file)
+
+    def start_request(self):
+        """Counts a request as in flight"""
+        with self._idle:
+            self.in_flight += 1
+        g.lifecycle_in_flight = True
+
+    def end_request(self, error=None):  # pylint: disable=unused-argument
+        """Counts a request as done"""
+        if g.pop("lifecycle_in_flight", False):
+            with self._idle:
+                self.in_flight -= 1
+                self._idle.notify_all()
+
+    def start_draining(self, signum=None, frame=None):
+        """Fails the readiness probe, then calls the handler it replaced for a signal"""
+        self._draining.set()
+        previous = self._previous_handlers.get(signum)
+        if callable(previous):
+            previous(signum, frame)
+
+    def handle_signal(self, signum=signal.SIGTERM):
+        """Starts draining on a signal, the server still handles it afterwards
+
+        Must be called from the main thread, after the server has set its
+        own handlers
+        """
+        self._previous_handlers[signum] = signal.signal(signum, self.start_draining)
+
+    def wait_for_requests(self, timeout: float) -> bool:
+        """Waits until no request is in flight, returns False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.in_flight <= 0, timeout)
+
+    def shutdown(self, timeout: float | None = None):
+        """Drains the requests in flight and closes the database connections"""
+        # pylint: disable=import-outside-toplevel
+        from service.models import db
+        from service.common.events import broker
+
+        self._draining.set()
+        timeout = self.app.config["DRAIN_TIMEOUT"] if timeout is None else timeout
+        if not self.wait_for_requests(timeout):
+            # Their transactions are rolled back by the server when the
+            # worker exits and their connections close
+            logger.warning("Shutting down with %s requests still in flight", self.in_flight)
+        broker.close()
+        with self.app.app_context():
+            db.session.remove()
+            checked_out = db.engine.pool.checkedout()
+            # Returned connections were rolled back, close them properly
+            db.engine.dispose()
+        logger.info("Worker shut down, %s database connections were still in use", checked_out)
+
+
+lifecycle = Lifecycle()
@@ -18,19 +18,156 @@
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. Records are formatted as JSON lines and written by a
+background thread, so log I/O does not hold up requests.
 """
+import os
+import json
+import time
+import uuid
+import atexit
+import random
 import logging
+from queue import SimpleQueue
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Fields added to records with extra= or by RequestContextFilter
+EXTRA_FIELDS = ("request_id", "method", "route", "status", "latency_ms", "rows", "queries")
+
+# One structured record per request
+request_logger = logging.getLogger("flask.app.requests")
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the request id and route to the records logged by a request"""
+
+    def filter(self, record):
+        if has_request_context() and not hasattr(record, "request_id"):
+            record.request_id = g.get("request_id")
+            record.route = request.url_rule.rule if request.url_rule else request.path
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the INFO and DEBUG records of some loggers"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+
+def parse_sample_rates(value: str) -> dict:
+    """Parses "logger=rate,logger=rate" into a dictionary of sampling rates"""
+    rates = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = entry.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
-    app.logger.propagate = False
+    global _listener  # pylint: disable=global-statement
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
+    for handler in gunicorn_logger.handlers:
         handler.setFormatter(formatter)
+
+    # The app only queues its records, a background thread writes them
+    stop_logging()
+    log_queue = SimpleQueue()
+    _listener = QueueListener(log_queue, *gunicorn_logger.handlers, respect_handler_level=True)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(app.config.get("LOG_SAMPLE_RATES", ""))))
+    # The modules log to "flask.app", which is not app.logger since Flask 2
+    for logger in (app.logger, logging.getLogger("flask.app")):
+        logger.propagate = False
+        logger.handlers = [queue_handler]
+        logger.setLevel(gunicorn_logger.level)
+    _listener.start()
     app.logger.info("Logging handler established")
+
+
+@atexit.register
+def stop_logging():
+    """Writes the queued log records and stops the background thread"""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def restart_logging():
+    """Starts a background thread in a forked worker, threads are not inherited"""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener = QueueListener(_listener.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+os.register_at_fork(after_in_child=restart_logging)
+
+
+def init_request_logging(app):
+    """Logs every request as one structured record with its request id"""
+
+    @app.before_request
+    def start_request():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER, "")[:128] or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+        queries = g.get("sql_queries")
+        request_logger.info(
+            "%s %s %s",
+            request.method,
+            request.path,
+            response.status_code,
+            extra={
+                "method": request.method,
+                "status": response.status_code,
+                "latency_ms": round((time.perf_counter() - g.request_started) * 1000, 1),
+                "rows": queries.rows if queries else None,
+                "queries": queries.count if queries else None,
+            },
+        )
+        return response
@@ -0,0 +1,231 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Schema Migrations
+
+Versioned changes that bring an existing database up to the schema of the
+models. A new database is built by db.create_all() and stamped with the
+latest version. The versions applied are kept in the schema_version table.
+Migrations must be safe to run on a database that already has the change.
+Workers only verify the version, the upgrade runs once before a rollout.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.exc import DBAPIError
+from service.models import APPEND_ONLY_DDL, STATUS_HISTORY_DDL, TRIGRAM_INDEX_DDL, db, order_status_history
+from service.common.sales import SALES_CHANGES_DDL, product_daily_sales, sales_changed_days, sales_rollup_state
+
+logger = logging.getLogger("flask.app")
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# Serializes migrations when several processes start at once
+ADVISORY_LOCK_ID = 2820
+
+MIGRATIONS = []
+
+
+class SchemaVersionError(Exception):
+    """Used when the database is older than the schema of the models"""
+
+
+def migration(version: int, description: str):
+    """Registers a function as the migration to a schema version"""
+
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return function
+
+    return register
+
+
+def latest_version() -> int:
+    """Returns the version of the schema described by the models"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn) -> int:
+    """Returns the version of the schema in the database, 0 if unversioned"""
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(text("SELECT max(version) FROM schema_version")).scalar() or 0
+
+
+def verify(engine) -> int:
+    """Checks with a single query that the database schema is up to date
+
+    A newer schema is accepted, migrations keep the previous release working.
+    Returns the version of the database
+    """
+    try:
+        with engine.connect() as conn:
+            version = conn.execute(text("SELECT max(version) FROM schema_version")).scalar() or 0
+    except DBAPIError as error:
+        raise SchemaVersionError(f"Cannot read the schema version, run 'flask db-upgrade': {error.orig}") from error
+    if version < latest_version():
+        raise SchemaVersionError(
+            f"Database is at schema version {version} and the service needs {latest_version()}, "
+            "run 'flask db-upgrade'"
+        )
+    return version
+
+
+def upgrade(engine) -> list:
+    """Applies all pending migrations in one transaction
+
+    Returns the (version, description) of the migrations that were applied
+    """
+    applied = []
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        schema_version.create(conn, checkfirst=True)
+        version = current_version(conn)
+
+        created = not inspect(conn).has_table("orders")
+        if created:
+            logger.info("Creating a new database schema")
+            db.metadata.create_all(conn)
+
+        for number, description, function in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info("Migrating to schema version %s: %s", number, description)
+            if not created:
+                function(conn)
+            conn.execute(schema_version.insert().values(version=number, description=description))
+            applied.append((number, description))
+    return applied
+
+
+######################################################################
+# M I G R A T I O N S
+######################################################################
+
+
+@migration(1, "Index tracking numbers for prefix and fuzzy search")
+def index_tracking_numbers(conn):
+    """Adds the tracking number indexes of existing tables"""
+    if conn.dialect.name != "postgresql":
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_tracking_number ON orders (tracking_number)"))
+        return
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_orders_tracking_number "
+            "ON orders (tracking_number text_pattern_ops)"
+        )
+    )
+    conn.execute(text(TRIGRAM_INDEX_DDL))
+
+
+@migration(2, "Store money as NUMERIC(12, 2)")
+def numeric_money(conn):
+    """Converts the float money columns and indexes discount amounts"""
+    if conn.dialect.name == "postgresql":
+        for table, column in (("orders", "discount_amount"), ("order_items", "price")):
+            column_type = conn.execute(
+                text(
+                    "SELECT data_type FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+                ),
+                {"table": table, "column": column},
+            ).scalar()
+            if column_type != "numeric":
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table} ALTER COLUMN {column} TYPE NUMERIC(12, 2) "
+                        f"USING round({column}::numeric, 2)"
+                    )
+                )
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_discount_amount ON orders (discount_amount)"))
+
+
+@migration(3, "Copy order_date onto order items")
+def order_item_dates(conn):
+    """Adds the partition key of order items and indexes their order"""
+    if "order_date" not in [column["name"] for column in inspect(conn).get_columns("order_items")]:
+        conn.execute(text("ALTER TABLE order_items ADD COLUMN order_date TIMESTAMP"))
+    conn.execute(
+        text(
+            "UPDATE order_items SET order_date = "
+            "(SELECT orders.order_date FROM orders WHERE orders.order_id = order_items.order_id) "
+            "WHERE order_date IS NULL"
+        )
+    )
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)"))
+
+
+@migration(4, "Enforce status transitions and log them")
+def status_history(conn):
+    """Adds the status history table and the trigger that fills it"""
+    order_status_history.create(conn, checkfirst=True)
+    if conn.dialect.name == "postgresql":
+        for statement in STATUS_HISTORY_DDL + APPEND_ONLY_DDL:
+            conn.execute(text(statement))
+
+
+@migration(5, "Index orders for sorted lists")
+def sort_indexes(conn):
+    """Adds the indexes that serve lists sorted by order_date and customer_id"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_order_date ON orders (order_date, order_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_customer_id ON orders (customer_id, order_id)"))
+
+
+@migration(6, "Keep item counts and totals on orders")
+def order_totals(conn):
+    """Adds the item count and total of orders and counts them from their items"""
+    columns = [column["name"] for column in inspect(conn).get_columns("orders")]
+    if "item_count" not in columns:
+        conn.execute(text("ALTER TABLE orders ADD COLUMN item_count INTEGER NOT NULL DEFAULT 0"))
+    if "total_amount" not in columns:
+        conn.execute(text("ALTER TABLE orders ADD COLUMN total_amount NUMERIC(12, 2) NOT NULL DEFAULT 0"))
+    conn.execute(
+        text(
+            "UPDATE orders SET item_count = items.item_count, total_amount = items.total_amount "
+            "FROM (SELECT order_id, count(*) AS item_count, sum(quantity * price) AS total_amount "
+            "FROM order_items GROUP BY order_id) AS items "
+            "WHERE orders.order_id = items.order_id"
+        )
+    )
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_total_amount ON orders (total_amount, order_id)"))
+
+
+@migration(7, "Index order items by product and keep daily sales")
+def product_sales(conn):
+    """Adds the product index of order items and the tables of the daily sales rollups"""
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_order_items_product_id ON order_items (product_id, order_date)")
+    )
+    product_daily_sales.create(conn, checkfirst=True)
+    sales_rollup_state.create(conn, checkfirst=True)
+
+
+@migration(8, "Note the days of changed sales")
+def sales_changes(conn):
+    """Adds the table of changed days and the triggers that fill it"""
+    sales_changed_days.create(conn, checkfirst=True)
+    if conn.dialect.name == "postgresql":
+        for statement in SALES_CHANGES_DDL:
+            conn.execute(text(statement))
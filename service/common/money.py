@@ -0,0 +1,68 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Money
+
+Helpers to handle amounts of money exactly. Amounts are stored as
+NUMERIC(12, 2) and handled as Decimal, so sums and products in Python
+and in the database are exact.
+"""
+from decimal import Decimal, InvalidOperation
+
+PRECISION = 12
+SCALE = 2
+CENT = Decimal(1).scaleb(-SCALE)
+MAX_AMOUNT = Decimal(10**PRECISION - 1).scaleb(-SCALE)
+
+
+def parse(value) -> Decimal:
+    """Converts a number or numeric string into an exact amount of money
+
+    Raises ValueError if the value is not a finite amount with at most
+    two decimal places that fits in the database column.
+    """
+    if isinstance(value, Decimal):
+        amount = value
+    elif isinstance(value, int) and not isinstance(value, bool):
+        amount = Decimal(value)
+    elif isinstance(value, float):
+        # repr() is the shortest string that round-trips, so 0.1 is 0.1
+        amount = Decimal(repr(value))
+    elif isinstance(value, str):
+        try:
+            amount = Decimal(value.strip())
+        except InvalidOperation as error:
+            raise ValueError(f"Invalid amount of money: {value!r}") from error
+    else:
+        raise ValueError(f"Invalid amount of money: {value!r}")
+
+    if not amount.is_finite() or abs(amount) > MAX_AMOUNT:
+        raise ValueError(f"Invalid amount of money: {value!r}")
+    if amount != amount.quantize(CENT):
+        raise ValueError(f"Amount of money has more than {SCALE} decimal places: {value!r}")
+    return amount.quantize(CENT)
+
+
+def serialize(amount: Decimal | None) -> float | None:
+    """Converts an amount for JSON
+
+    NUMERIC(12, 2) amounts have at most 12 significant digits and a float
+    round-trips 15, so the JSON number is exactly the stored decimal.
+    """
+    if amount is None:
+        return None
+    return float(amount)
@@ -0,0 +1,205 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order Partitions
+
+Optional monthly range partitioning of orders and order_items by
+order_date on PostgreSQL 15 or later. Every order item keeps a copy of the
+order_date of its order, so a month of orders and its items live in
+partitions with the same bounds and can be detached together.
+"""
+import re
+import logging
+from datetime import date
+from sqlalchemy import inspect, text
+from service.models import STATUS_HISTORY_DDL, TRIGRAM_INDEX_DDL, OrderItems, Orders
+from service.common.sales import SALES_CHANGES_DDL
+
+logger = logging.getLogger("flask.app")
+
+# Referenced tables come first, detaching goes the other way round
+TABLES = (Orders.__table__, OrderItems.__table__)
+
+# Before 15 moving an order to another partition deletes its items
+MIN_SERVER_VERSION = 150000
+
+
+class PartitionError(Exception):
+    """Used when the tables cannot be partitioned"""
+
+
+def month_start(value) -> date:
+    """Returns the first day of the month of a date or datetime"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    """Returns the first day of the month a number of months away"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    """Returns the name of the partition of a table for a month"""
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(conn) -> bool:
+    """Returns True if the orders table is partitioned"""
+    return bool(
+        conn.execute(
+            text("SELECT count(*) FROM pg_partitioned_table WHERE partrelid = to_regclass('orders')")
+        ).scalar()
+    )
+
+
+def monthly_partitions(conn, table: str) -> dict:
+    """Returns the monthly partitions attached to a table by month"""
+    names = conn.execute(
+        text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:table)"),
+        {"table": table},
+    ).scalars()
+    pattern = re.compile(rf"^{table}_p(\d{{4}})_(\d{{2}})$")
+    partitions = {}
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def create_partitions(conn, first_month: date, last_month: date) -> list:
+    """Creates the missing partitions for a range of months
+
+    Returns the names of the partitions that were created
+    """
+    created = []
+    existing = {table.name: monthly_partitions(conn, table.name) for table in TABLES}
+    month = first_month
+    while month <= last_month:
+        for table in TABLES:
+            if month in existing[table.name]:
+                continue
+            name = partition_name(table.name, month)
+            try:
+                # A savepoint keeps the rest going if the default partition
+                # already holds rows for this month
+                with conn.begin_nested():
+                    conn.execute(
+                        text(
+                            f"CREATE TABLE {name} PARTITION OF {table.name} "
+                            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+                        )
+                    )
+                created.append(name)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Cannot create partition %s: %s", name, error)
+        month = add_months(month, 1)
+    return created
+
+
+def detach_partitions(conn, before_month: date) -> list:
+    """Detaches the partitions of months before a month
+
+    The detached tables keep their rows and can be archived or dropped.
+    Returns the names of the partitions that were detached
+    """
+    detached = []
+    for table in reversed(TABLES):
+        for month, name in sorted(monthly_partitions(conn, table.name).items()):
+            if month < before_month:
+                conn.execute(text(f"ALTER TABLE {table.name} DETACH PARTITION {name}"))
+                detached.append(name)
+    return detached
+
+
+def partition_tables(conn, first_month: date, last_month: date):
+    """Converts orders and order_items to tables partitioned by month
+
+    Rows of months without a partition go to a default partition. This
+    rewrites both tables under an exclusive lock, so run it in a quiet time
+    """
+    version = conn.execute(text("SHOW server_version_num")).scalar()
+    if int(version) < MIN_SERVER_VERSION:
+        raise PartitionError("Partitioning orders requires PostgreSQL 15 or later")
+    if is_partitioned(conn):
+        raise PartitionError("The orders table is already partitioned")
+
+    conn.execute(text("LOCK TABLE orders, order_items IN ACCESS EXCLUSIVE MODE"))
+    columns = {table.name: [c["name"] for c in inspect(conn).get_columns(table.name)] for table in TABLES}
+    if "order_date" not in columns["order_items"]:
+        raise PartitionError("order_items has no order_date, run 'flask db-upgrade' first")
+    for table in TABLES:
+        conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_unpartitioned"))
+        conn.execute(
+            text(
+                f"CREATE TABLE {table.name} (LIKE {table.name}_unpartitioned INCLUDING DEFAULTS) "
+                "PARTITION BY RANGE (order_date)"
+            )
+        )
+        conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN order_date SET NOT NULL"))
+        conn.execute(text(f"CREATE TABLE {table.name}_default PARTITION OF {table.name} DEFAULT"))
+    create_partitions(conn, first_month, last_month)
+
+    # Orders without a date go to the current month and the copy of
+    # order_date on the items is taken from their order
+    selected = [
+        "COALESCE(order_date, now())" if column == "order_date" else column for column in columns["orders"]
+    ]
+    conn.execute(
+        text(
+            f"INSERT INTO orders ({', '.join(columns['orders'])}) "
+            f"SELECT {', '.join(selected)} FROM orders_unpartitioned"
+        )
+    )
+    selected = [
+        "orders.order_date" if column == "order_date" else f"items.{column}" for column in columns["order_items"]
+    ]
+    conn.execute(
+        text(
+            f"INSERT INTO order_items ({', '.join(columns['order_items'])}) SELECT {', '.join(selected)} "
+            "FROM order_items_unpartitioned AS items JOIN orders USING (order_id)"
+        )
+    )
+
+    for table in reversed(TABLES):
+        for column in table.primary_key.columns:
+            # Keep the id sequences when the old tables are dropped
+            conn.execute(
+                text(
+                    f"ALTER SEQUENCE IF EXISTS {table.name}_{column.name}_seq "
+                    f"OWNED BY {table.name}.{column.name}"
+                )
+            )
+        conn.execute(text(f"DROP TABLE {table.name}_unpartitioned"))
+
+    # Unique constraints on a partitioned table must include order_date
+    conn.execute(text("ALTER TABLE orders ADD PRIMARY KEY (order_id, order_date)"))
+    conn.execute(text("ALTER TABLE order_items ADD PRIMARY KEY (order_item_id, order_date)"))
+    conn.execute(
+        text(
+            "ALTER TABLE order_items ADD FOREIGN KEY (order_id, order_date) "
+            "REFERENCES orders (order_id, order_date) ON UPDATE CASCADE ON DELETE CASCADE"
+        )
+    )
+    for table in TABLES:
+        for index in table.indexes:
+            index.create(conn)
+    conn.execute(text(TRIGRAM_INDEX_DDL))
+    # The status and sales triggers went with the old tables
+    for statement in STATUS_HISTORY_DDL + SALES_CHANGES_DDL:
+        conn.execute(text(statement))
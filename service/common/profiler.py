@@ -0,0 +1,123 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Profiler
+
+Profiling of a running worker without outside tools. The sampling
+profiler walks the stacks of the other threads of the process at a fixed
+interval and returns them in the collapsed format of flamegraph.pl and
+speedscope. Single requests can be profiled with cProfile. Both need the
+ADMIN_TOKEN of the app.
+"""
+import io
+import os
+import sys
+import hmac
+import time
+import threading
+from collections import Counter
+from functools import wraps
+from flask import Response, abort, current_app, request
+
+MAX_SECONDS = 60
+SAMPLE_INTERVAL = 0.01
+
+_sampling = threading.Lock()
+
+
+def authorized() -> bool | None:
+    """Checks the admin token of a request
+
+    Returns None if profiling is off because no ADMIN_TOKEN is set
+    """
+    token = current_app.config.get("ADMIN_TOKEN")
+    if not token:
+        return None
+    given = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return hmac.compare_digest(given.encode(), token.encode())
+
+
+def resident_memory() -> int | None:
+    """Returns the resident set size of the process in bytes, None if unknown"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):  # pragma: no cover
+        return None
+
+
+def frame_names(frame) -> list:
+    """Returns the names of the frames of a stack, outermost first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL) -> Counter:
+    """Counts the stacks of the other threads of the process for a number of seconds"""
+    stacks = Counter()
+    own_thread = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if thread_id != own_thread:
+                stack = [names.get(thread_id, str(thread_id))] + frame_names(frame)
+                stacks[";".join(stack)] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapse(stacks: Counter) -> str:
+    """Returns stacks in the collapsed format, one "frame;frame count" line each"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def profile_worker(seconds: float) -> str | None:
+    """Samples the worker for a number of seconds, None if it is already sampled"""
+    if not _sampling.acquire(blocking=False):  # pylint: disable=consider-using-with
+        return None
+    try:
+        return collapse(sample_stacks(min(seconds, MAX_SECONDS)))
+    finally:
+        _sampling.release()
+
+
+def profiled(view):
+    """Returns cProfile stats instead of the response for ?profile=1 requests"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.args.get("profile") != "1" or authorized() is None:
+            return view(*args, **kwargs)
+        if not authorized():
+            abort(401, "A valid admin token is required to profile requests")
+        # Only loaded by the requests that are profiled
+        import pstats  # pylint: disable=import-outside-toplevel
+        import cProfile  # pylint: disable=import-outside-toplevel
+
+        profile = cProfile.Profile()
+        profile.runcall(view, *args, **kwargs)
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(50)
+        return Response(output.getvalue(), mimetype="text/plain")
+
+    return wrapper
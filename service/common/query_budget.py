@@ -0,0 +1,138 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+SQL Query Budget
+
+Counts the SQL statements of every request and the time spent in them,
+reports both in a Server-Timing header and warns about requests that run
+more statements than their budget or repeat the same statement, which is
+what a lazy load inside a loop (N+1 queries) looks like.
+"""
+import re
+import time
+import logging
+from collections import Counter
+from functools import lru_cache
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app")
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+
+class QueryBudgetExceeded(Exception):
+    """Used in strict mode when a request goes over its SQL budget"""
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """Returns a statement with its literals and whitespace normalized
+
+    The statements of the app repeat, so the results are cached
+    """
+    statement = _NUMBERS.sub("?", _STRINGS.sub("?", statement))
+    return " ".join(_LISTS.sub("(...)", statement).split())
+
+
+class RequestQueries:
+    """The SQL statements run by one request"""
+
+    __slots__ = ("count", "seconds", "rows", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements = Counter()
+
+    def record(self, statement: str, seconds: float, rows: int = 0):
+        """Counts a statement that ran for a number of seconds and its rows"""
+        self.count += 1
+        self.seconds += seconds
+        self.rows += max(rows, 0)
+        self.statements[fingerprint(statement)] += 1
+
+    def most_repeated(self) -> tuple:
+        """Returns the fingerprint of the most repeated statement and its count"""
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=R0913
+    """Notes when a statement of a request starts"""
+    if has_request_context() and "sql_queries" in g and context is not None:
+        context.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=R0913
+    """Counts a statement of a request and its duration"""
+    started = getattr(context, "query_started", None)
+    if started is not None and has_request_context() and "sql_queries" in g:
+        g.sql_queries.record(statement, time.perf_counter() - started, cursor.rowcount)
+
+
+class QueryBudget:
+    """Checks the SQL statements of each request against the app's budget"""
+
+    def init_app(self, app):
+        """Counts the statements of the app's requests
+
+        SQL_QUERY_BUDGET is the most statements a request should run and
+        SQL_REPEAT_LIMIT how often it may repeat one, 0 turns either off.
+        With SQL_BUDGET_STRICT a request over budget raises
+        QueryBudgetExceeded, which fails the tests that regress.
+        """
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    @staticmethod
+    def start():
+        """Starts counting the statements of a request"""
+        g.sql_queries = RequestQueries()
+
+    @staticmethod
+    def finish(response):
+        """Reports the statements of a request"""
+        queries = g.get("sql_queries")
+        if queries is None:
+            return response
+        response.headers.add(
+            "Server-Timing", f'db;dur={queries.seconds * 1000:.1f};desc="{queries.count} queries"'
+        )
+
+        config = current_app.config
+        problems = []
+        if config["SQL_QUERY_BUDGET"] and queries.count > config["SQL_QUERY_BUDGET"]:
+            problems.append(f"{queries.count} SQL statements, the budget is {config['SQL_QUERY_BUDGET']}")
+        statement, repeats = queries.most_repeated()
+        if config["SQL_REPEAT_LIMIT"] and repeats >= config["SQL_REPEAT_LIMIT"]:
+            problems.append(f"SQL statement repeated {repeats} times: {statement[:500]}")
+        for problem in problems:
+            logger.warning("%s %s ran %s", request.method, request.path, problem)
+        if problems and config["SQL_BUDGET_STRICT"]:
+            raise QueryBudgetExceeded(f"{request.method} {request.path} ran {'; '.join(problems)}")
+        return response
+
+
+query_budget = QueryBudget()
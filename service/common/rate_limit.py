@@ -0,0 +1,238 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Rate Limiting and Load Shedding
+
+Every client has a token bucket that refills at RATE_LIMIT_RATE tokens a
+second up to RATE_LIMIT_BURST, and every request takes the cost of its
+endpoint from it or gets 429 Too Many Requests. Clients are told apart by
+their X-Api-Key header, or by their address without one. Behind proxies,
+TRUSTED_PROXY_HOPS of them, the address is read from X-Forwarded-For
+instead of being the address of the nearest proxy. Buckets live in
+the process by default; a SharedBackend keeps them in a store that all
+replicas use. The load shedder answers 503 Service Unavailable once a
+process is already serving LOAD_SHED_MAX_IN_FLIGHT requests, so a burst
+queues at the clients instead of in front of the database.
+"""
+import math
+import time
+import hashlib
+import logging
+import threading
+from flask import current_app, g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+logger = logging.getLogger("flask.app")
+
+# Probes, the UI and the admin endpoints are never limited or shed
+EXEMPT_ENDPOINTS = frozenset({"index", "health", "readyz", "admin_ui", "static", "profile_worker"})
+
+# Event streams wait on notifications for a long time without a connection
+UNSHED_ENDPOINTS = EXEMPT_ENDPOINTS | {"stream_order_events", "stream_events_for_order"}
+
+
+def parse_costs(value: str) -> dict:
+    """Parses "endpoint=cost,endpoint=cost" into a dictionary of costs"""
+    costs = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        name, _, cost = entry.partition("=")
+        costs[name.strip()] = float(cost)
+    return costs
+
+
+def client_key() -> str:
+    """Returns the key of the bucket of the current client
+
+    API keys are hashed so that they are not kept in memory or in the store
+    """
+    api_key = request.headers.get("X-Api-Key")
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+    return f"ip:{request.remote_addr}"
+
+
+class TokenBucket:
+    """The tokens a client has left and when they were last counted"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def take(self, cost: float, rate: float, burst: float, now: float) -> float:
+        """Takes cost tokens if there are enough
+
+        Returns 0 if they were taken, or the seconds until there are enough
+        """
+        self.tokens = min(burst, self.tokens + max(now - self.updated, 0.0) * rate)
+        self.updated = now
+        # A request that costs more than the burst would never get through
+        cost = min(cost, burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / rate
+
+
+class MemoryBackend:
+    """Keeps the buckets in the process, each replica limits on its own"""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        """Takes tokens from the bucket of a client, see TokenBucket.take"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now, rate, burst)
+                bucket = self._buckets[key] = TokenBucket(burst, now)
+            return bucket.take(cost, rate, burst, now)
+
+    def _prune(self, now: float, rate: float, burst: float):
+        """Drops the buckets that have refilled, they are the same as new ones"""
+        full = now - burst / rate
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket.updated > full}
+
+
+class LocalStore:
+    """An in-process stand-in for a shared key-value store
+
+    A shared store only needs get() and an atomic compare_and_set() with an
+    expiry, which a Redis or memcached client provides with WATCH or CAS.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Returns the value of a key, or None if it is missing or expired"""
+        with self._lock:
+            value, expires = self._values.get(key, (None, 0.0))
+            return value if expires > time.time() else None
+
+    def compare_and_set(self, key: str, expected, value, ttl: float) -> bool:
+        """Sets a key that still has the expected value, returns False if it changed"""
+        with self._lock:
+            current, expires = self._values.get(key, (None, 0.0))
+            if (current if expires > time.time() else None) != expected:
+                return False
+            self._values[key] = (value, time.time() + ttl)
+            return True
+
+
+class SharedBackend:
+    """Keeps the buckets in a store shared by all replicas
+
+    Requests are let through if the store fails or stays contended, an
+    outage of the store must not take the service down with it.
+    """
+
+    def __init__(self, store, retries: int = 5):
+        self.store = store
+        self.retries = retries
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        """Takes tokens from the bucket of a client, see TokenBucket.take"""
+        try:
+            for _ in range(self.retries):
+                current = self.store.get(key)
+                now = time.time()
+                bucket = TokenBucket(*current) if current else TokenBucket(burst, now)
+                wait = bucket.take(cost, rate, burst, now)
+                # Unused buckets expire once they would have refilled anyway
+                if self.store.compare_and_set(key, current, (bucket.tokens, bucket.updated), burst / rate):
+                    return wait
+            logger.warning("Rate limit store is contended for %s, request let through", key)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Rate limit store failed, request let through: %s", error)
+        return 0.0
+
+
+class RateLimiter:
+    """Limits the rate of each client and sheds load when a process is full"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.costs = {}
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app, backend=None):
+        """Limits the app's requests, the limiter and the shedder are off by default
+
+        RATE_LIMIT_RATE is the tokens a second each client gets, 0 turns the
+        limiter off, and RATE_LIMIT_COSTS the tokens of the costly endpoints.
+        LOAD_SHED_MAX_IN_FLIGHT is the most requests a process serves at once,
+        0 turns the shedder off. TRUSTED_PROXY_HOPS is the number of proxies
+        in front of the app that add to X-Forwarded-For, 0 when clients
+        connect directly and could send any X-Forwarded-For they like.
+        """
+        hops = app.config.get("TRUSTED_PROXY_HOPS", 0)
+        if hops:
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops)
+        if backend is not None:
+            self.backend = backend
+        self.costs = parse_costs(app.config.get("RATE_LIMIT_COSTS", ""))
+        app.before_request(self.limit)
+        app.before_request(self.shed)
+        app.teardown_request(self.release)
+
+    def limit(self):
+        """Rejects a request with 429 if its client has run out of tokens"""
+        config = current_app.config
+        if not config["RATE_LIMIT_RATE"] or request.endpoint in EXEMPT_ENDPOINTS:
+            return
+        cost = self.costs.get(request.endpoint, 1.0)
+        wait = self.backend.take(client_key(), cost, config["RATE_LIMIT_RATE"], config["RATE_LIMIT_BURST"])
+        if wait:
+            raise TooManyRequests(
+                f"Rate limit exceeded for {request.method} {request.path}, retry in {wait:.1f} seconds",
+                retry_after=math.ceil(wait),
+            )
+
+    def shed(self):
+        """Rejects a request with 503 if the process is serving too many already"""
+        config = current_app.config
+        if not config["LOAD_SHED_MAX_IN_FLIGHT"] or request.endpoint in UNSHED_ENDPOINTS:
+            return
+        with self._lock:
+            busy = self.in_flight >= config["LOAD_SHED_MAX_IN_FLIGHT"]
+            if not busy:
+                self.in_flight += 1
+        if busy:
+            raise ServiceUnavailable(
+                f"Server is busy with {self.in_flight} requests, retry later",
+                retry_after=config["LOAD_SHED_RETRY_AFTER"],
+            )
+        g.rate_limit_in_flight = True
+
+    def release(self, error=None):  # pylint: disable=unused-argument
+        """Counts a request that was let through by the shedder as done"""
+        if g.pop("rate_limit_in_flight", False):
+            with self._lock:
+                self.in_flight -= 1
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,245 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Product Sales
+
+Units sold and revenue of products by day, summed over the order items
+by the order_date of their order. The items of cancelled, returned and
+refunded orders are not sales.
+
+With SALES_ROLLUPS on, 'flask sales-rollup' keeps the sums of every
+product and day in product_daily_sales up to the day it runs, and queries
+only sum the items of the days after that. On PostgreSQL, triggers note
+the rolled up days that item and order writes change in
+sales_changed_days. Each refresh sums the new days, the last few days and
+the noted days again. Orders.archive turns the triggers off for its
+deletes, so the sales of archived orders stay in the rollups. The
+triggers are only installed on PostgreSQL, so on SQLite a refresh sums
+only the new and last few days again.
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import DDL, event
+from service.common import money
+from service.models import OrderItems, Orders, db
+
+logger = logging.getLogger("flask.app")
+
+# The items of orders in these states were not sold
+UNSOLD_STATUSES = ("cancelled", "returned", "refunded")
+
+# Serializes rollup refreshes
+ADVISORY_LOCK_ID = 2821
+
+product_daily_sales = db.Table(
+    "product_daily_sales",
+    db.Column("product_id", db.Integer, primary_key=True),
+    db.Column("day", db.Date, primary_key=True),
+    db.Column("quantity", db.BigInteger, nullable=False),
+    # Sums of many items need more digits than an amount of money
+    db.Column("revenue", db.Numeric(18, money.SCALE), nullable=False),
+)
+
+# A single row, product_daily_sales is complete for the days before rolled_up_until
+sales_rollup_state = db.Table(
+    "sales_rollup_state",
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("rolled_up_until", db.Date, nullable=False),
+    db.Column("refreshed_at", db.DateTime, nullable=False),
+)
+
+# Rolled up days that writes changed since the last refresh. Not unique,
+# so that writers of the same day never wait for each other.
+sales_changed_days = db.Table(
+    "sales_changed_days",
+    db.Column("day", db.Date, nullable=False, index=True),
+)
+
+SALE_DAY = db.cast(Orders.order_date, db.Date)
+
+# Notes the days of the old and new rows of a write that are rolled up.
+# Days after the last refresh are summed again by the next one anyway.
+SALES_CHANGES_DDL = (
+    """
+CREATE OR REPLACE FUNCTION record_sales_change() RETURNS trigger AS $$
+DECLARE
+    watermark date := (SELECT rolled_up_until FROM sales_rollup_state);
+    touched date[] := ARRAY[]::date[];
+BEGIN
+    -- Archiving moves sales out of the database, not out of the rollups
+    IF watermark IS NULL OR current_setting('sales.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        touched := touched || OLD.order_date::date;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        touched := touched || NEW.order_date::date;
+    END IF;
+    INSERT INTO sales_changed_days (day)
+        SELECT DISTINCT changed FROM unnest(touched) AS changed
+        WHERE changed < watermark
+            AND NOT EXISTS (SELECT 1 FROM sales_changed_days WHERE day = changed);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""",
+    "DROP TRIGGER IF EXISTS orders_sales_changes ON orders",
+    """
+CREATE TRIGGER orders_sales_changes AFTER UPDATE OF order_date, status OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION record_sales_change()
+""",
+    "DROP TRIGGER IF EXISTS order_items_sales_changes ON order_items",
+    """
+CREATE TRIGGER order_items_sales_changes
+    AFTER INSERT OR DELETE OR UPDATE OF order_id, order_date, product_id, quantity, price ON order_items
+    FOR EACH ROW EXECUTE FUNCTION record_sales_change()
+""",
+)
+
+# order_items is created after orders, which it references
+for ddl in SALES_CHANGES_DDL:
+    event.listen(OrderItems.__table__, "after_create", DDL(ddl).execute_if(dialect="postgresql"))
+
+
+def live_sales(since: date | None, until: date, product_id: int | None = None, days: list | None = None):
+    """Selects the (product_id, day, quantity, revenue) of the items sold from since until the day before until"""
+    statement = (
+        db.select(
+            OrderItems.product_id,
+            SALE_DAY.label("day"),
+            db.func.sum(OrderItems.quantity).label("quantity"),
+            db.func.sum(OrderItems.quantity * OrderItems.price).label("revenue"),
+        )
+        .join(Orders, Orders.order_id == OrderItems.order_id)
+        .where(Orders.order_date < datetime.combine(until, time()), Orders.status.not_in(UNSOLD_STATUSES))
+        .group_by(OrderItems.product_id, SALE_DAY)
+    )
+    if since is not None:
+        statement = statement.where(Orders.order_date >= datetime.combine(since, time()))
+    if product_id is not None:
+        statement = statement.where(OrderItems.product_id == product_id)
+    if days is not None:
+        # A range of order_date for each day, which the index of order_date serves
+        statement = statement.where(
+            db.or_(
+                *[
+                    db.and_(
+                        Orders.order_date >= datetime.combine(day, time()),
+                        Orders.order_date < datetime.combine(day + timedelta(days=1), time()),
+                    )
+                    for day in days
+                ]
+            )
+        )
+    return statement
+
+
+class ProductSales:
+    """Sales of products, from the daily rollups when they are on"""
+
+    def __init__(self):
+        self.rollups = False
+
+    def init_app(self, app):
+        """Reads the daily rollups if SALES_ROLLUPS is on"""
+        self.rollups = app.config.get("SALES_ROLLUPS", False)
+
+    def sales(self, since: date, until: date, product_id: int | None = None):
+        """Selects the (product_id, day, quantity, revenue) of the days from since until the day before until"""
+        rolled_up_until = db.session.scalar(db.select(sales_rollup_state.c.rolled_up_until)) if self.rollups else None
+        if rolled_up_until is None or rolled_up_until <= since:
+            return live_sales(since, until, product_id)
+        split = min(rolled_up_until, until)
+        rolled_up = db.select(product_daily_sales).where(
+            product_daily_sales.c.day >= since, product_daily_sales.c.day < split
+        )
+        if product_id is not None:
+            rolled_up = rolled_up.where(product_daily_sales.c.product_id == product_id)
+        if split == until:
+            return rolled_up
+        return db.union_all(rolled_up, live_sales(split, until, product_id))
+
+    def daily(self, product_id: int, since: date, until: date) -> list:
+        """Returns the (day, quantity, revenue) of a product for each day it sold"""
+        rows = self.sales(since, until, product_id).subquery()
+        return db.session.execute(
+            db.select(rows.c.day, db.func.sum(rows.c.quantity), db.func.sum(rows.c.revenue))
+            .group_by(rows.c.day)
+            .order_by(rows.c.day)
+        ).all()
+
+    def top(self, since: date, until: date, limit: int, by: str = "quantity") -> list:
+        """Returns the (product_id, quantity, revenue) of the products that sold the most
+
+        Raises ValueError if by is not "quantity" or "revenue"
+        """
+        if by not in ("quantity", "revenue"):
+            raise ValueError(f"Cannot rank products by {by!r}, rank by quantity or revenue")
+        rows = self.sales(since, until).subquery()
+        totals = {"quantity": db.func.sum(rows.c.quantity), "revenue": db.func.sum(rows.c.revenue)}
+        return db.session.execute(
+            db.select(rows.c.product_id, totals["quantity"], totals["revenue"])
+            .group_by(rows.c.product_id)
+            .order_by(totals[by].desc(), rows.c.product_id)
+            .limit(limit)
+        ).all()
+
+    @staticmethod
+    def refresh(days: int = 3, today: date | None = None) -> int:
+        """Rolls up the sales of every day before today that may have changed
+
+        Returns the number of days that were summed again
+        """
+        today = today or datetime.utcnow().date()
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(db.text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        state = db.session.execute(db.select(sales_rollup_state)).first()
+        if state is None:
+            logger.info("Rolling up all sales before %s", today)
+            db.session.execute(db.delete(product_daily_sales))
+            db.session.execute(db.delete(sales_changed_days))
+            db.session.execute(db.insert(product_daily_sales).from_select(
+                ["product_id", "day", "quantity", "revenue"], live_sales(None, today)
+            ))
+            refreshed = db.session.scalar(db.select(db.func.count(db.distinct(product_daily_sales.c.day))))
+            db.session.execute(
+                db.insert(sales_rollup_state).values(id=1, rolled_up_until=today, refreshed_at=datetime.utcnow())
+            )
+        else:
+            # The days since the last refresh, the last few days and the days writes changed.
+            # Writes that commit after the DELETE leave their days for the next refresh.
+            days = max(days, (today - state.rolled_up_until).days)
+            changed = {today - timedelta(days=number) for number in range(1, days + 1)}
+            changed.update(db.session.scalars(db.delete(sales_changed_days).returning(sales_changed_days.c.day)))
+            changed = sorted(day for day in changed if day < today)
+            logger.info("Rolling up the sales of %s", ", ".join(day.isoformat() for day in changed))
+            if changed:
+                db.session.execute(db.delete(product_daily_sales).where(product_daily_sales.c.day.in_(changed)))
+                db.session.execute(db.insert(product_daily_sales).from_select(
+                    ["product_id", "day", "quantity", "revenue"],
+                    live_sales(changed[0], changed[-1] + timedelta(days=1), days=changed),
+                ))
+            refreshed = len(changed)
+            db.session.execute(
+                db.update(sales_rollup_state).values(rolled_up_until=today, refreshed_at=datetime.utcnow())
+            )
+        db.session.commit()
+        return refreshed
+
+
+product_sales = ProductSales()
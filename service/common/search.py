@@ -0,0 +1,85 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Sorted Search Index
+
+In-memory index of string keys used for prefix and fuzzy searches when the
+database cannot do them itself (SQLite). It only sees the writes of its own
+process, so it must not serve a database shared by several workers.
+"""
+import threading
+from bisect import bisect_left
+from difflib import SequenceMatcher
+
+
+class SortedIndex:
+    """A sorted list of (key, id) pairs that is rebuilt lazily when stale"""
+
+    def __init__(self, min_similarity: float = 0.5):
+        self.min_similarity = min_similarity
+        self._entries = []
+        self._stale = True
+        self._lock = threading.Lock()
+
+    @property
+    def stale(self) -> bool:
+        """True if the index must be rebuilt before the next search"""
+        return self._stale
+
+    def invalidate(self):
+        """Marks the index as stale"""
+        self._stale = True
+
+    def rebuild(self, rows):
+        """Replaces the contents of the index with (key, id) rows"""
+        entries = sorted((key, ident) for key, ident in rows if key is not None)
+        with self._lock:
+            self._entries = entries
+            self._stale = False
+
+    def prefix(self, query: str, offset: int = 0, limit: int = 20) -> list:
+        """Returns ids whose key starts with query, in key order"""
+        entries = self._entries
+        position = bisect_left(entries, (query,))
+        matches = []
+        while position < len(entries) and entries[position][0].startswith(query):
+            matches.append(entries[position][1])
+            if len(matches) == offset + limit:
+                break
+            position += 1
+        return matches[offset:]
+
+    def fuzzy(self, query: str, offset: int = 0, limit: int = 20) -> list:
+        """Returns ids whose key contains or resembles query, best match first"""
+        scored = []
+        for key, ident in self._entries:
+            score = self.similarity(query, key, self.min_similarity)
+            if score >= self.min_similarity:
+                scored.append((-score, key, ident))
+        scored.sort()
+        return [ident for _, _, ident in scored[offset:offset + limit]]
+
+    @staticmethod
+    def similarity(query: str, key: str, cutoff: float = 0.0) -> float:
+        """Scores a key against the query, substrings rank above near misses"""
+        if query in key:
+            return 1.0 + len(query) / len(key)
+        matcher = SequenceMatcher(None, query, key)
+        # The upper bounds are cheap, only compute the real ratio if they pass
+        if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+            return 0.0
+        return matcher.ratio()
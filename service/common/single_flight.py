@@ -0,0 +1,99 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Single Flight
+
+Coalesces identical reads of a worker. The first request for a key runs
+the query and the requests for the same key that arrive while it runs
+wait for it and share its result, or its exception, instead of running
+the query again. Results are shared between threads, so they must be
+serialized values and not ORM objects, and nobody may change them.
+
+A commit in the worker ends the flights in progress for new requests, so
+a client that reads after its own write never gets a result that was
+loaded before the write.
+"""
+import logging
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("flask.app")
+
+
+class Flight:  # pylint: disable=too-few-public-methods
+    """A call in progress and the result it shares"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Runs one call at a time for each key and shares its result"""
+
+    def __init__(self):
+        self.enabled = True
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Coalesces reads unless SINGLE_FLIGHT is off"""
+        self.enabled = app.config.get("SINGLE_FLIGHT", True)
+        self.forget()
+
+    def do(self, key, function):
+        """Returns function(), or the result of the call for key in progress"""
+        if not self.enabled:
+            return function()
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = function()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+            if flight.followers:
+                logger.debug("%s requests shared the result of %s", flight.followers, key)
+        return flight.result
+
+    def forget(self, session=None):  # pylint: disable=unused-argument
+        """Lets new calls start their own flight, the callers waiting still share theirs"""
+        with self._lock:
+            self._flights.clear()
+
+
+single_flight = SingleFlight()
+
+event.listen(Session, "after_commit", single_flight.forget)
@@ -0,0 +1,187 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Tracing
+
+Optional tracing of requests, their SQL statements and the steps of a
+route. Trace ids are taken from and compatible with the W3C traceparent
+header, and finished spans are exported as JSON lines in the OpenTelemetry
+(OTLP) span format to the console or a file, where any collector that
+reads OTLP JSON can pick them up. Without an exporter spans cost nothing.
+"""
+import re
+import sys
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+current_span = ContextVar("current_span", default=None)
+
+
+def new_id(bits: int) -> str:
+    """Returns a random non-zero trace or span id in hex"""
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+class Span:
+    """A timed operation of a trace"""
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "attributes", "start", "end", "error")
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: str | None = None, attributes: dict | None = None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def child(self, name: str, attributes: dict | None = None):
+        """Starts a span within this one"""
+        return Span(self.tracer, name, self.trace_id, self.span_id, attributes)
+
+    def to_otlp(self) -> dict:
+        """Returns the span in the OTLP JSON format"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start,
+            "endTimeUnixNano": self.end,
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+
+
+class Tracer:
+    """Creates the spans of requests and exports them when they end"""
+
+    def __init__(self):
+        self.exporter = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """True if spans are exported"""
+        return self.exporter is not None
+
+    def init_app(self, app):
+        """Traces the app's requests if TRACING_EXPORTER is "console" or a file path"""
+        target = app.config.get("TRACING_EXPORTER")
+        if not target:
+            return
+        # pylint: disable=consider-using-with
+        self.exporter = sys.stdout if target == "console" else open(target, "a", encoding="utf-8")
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.end_request)
+
+    def export(self, span: Span):
+        """Writes a finished span"""
+        line = json.dumps(span.to_otlp(), separators=(",", ":"))
+        with self._lock:
+            self.exporter.write(line + "\n")
+            self.exporter.flush()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Times a block as a span of the current trace, does nothing outside one"""
+        parent = current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = parent.child(name, attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except Exception as error:
+            span.error = repr(error)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end = time.time_ns()
+            span.tracer.export(span)
+
+    def start_request(self):
+        """Starts the span of a request, continuing the trace of the caller"""
+        match = TRACEPARENT.match(request.headers.get("traceparent", ""))
+        trace_id, parent_id = (match[1], match[2]) if match else (new_id(128), None)
+        span = Span(
+            self,
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            trace_id,
+            parent_id,
+            {"http.method": request.method, "http.target": request.full_path.rstrip("?")},
+        )
+        g.trace_token = current_span.set(span)
+        g.trace_span = span
+
+    @staticmethod
+    def finish_request(response):
+        """Records the status of a request and returns its trace id"""
+        span = g.get("trace_span")
+        if span is not None:
+            span.attributes["http.status_code"] = response.status_code
+            response.headers["traceparent"] = f"00-{span.trace_id}-{span.span_id}-01"
+        return response
+
+    def end_request(self, error=None):
+        """Ends and exports the span of a request"""
+        span = g.pop("trace_span", None)
+        if span is None:
+            return
+        current_span.reset(g.pop("trace_token"))
+        if error is not None:
+            span.error = repr(error)
+        span.end = time.time_ns()
+        self.export(span)
+
+
+tracer = Tracer()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_span(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=R0913
+    """Starts a span for a SQL statement run inside a trace"""
+    parent = current_span.get()
+    if parent is not None and context is not None:
+        context.trace_span = parent.child(
+            statement.split(None, 1)[0].upper(),
+            {"db.system": conn.dialect.name, "db.statement": statement[:1000]},
+        )
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement_span(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=R0913
+    """Ends and exports the span of a SQL statement"""
+    span = getattr(context, "trace_span", None)
+    if span is not None:
+        span.end = time.time_ns()
+        span.attributes["db.rows"] = cursor.rowcount
+        span.tracer.export(span)
@@ -15,6 +15,93 @@ SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 # SQLALCHEMY_POOL_SIZE = 2
 
+# psycopg prepares a statement on the server once a connection has run it
+# this many times, empty turns prepared statements off, which a pooler
+# like PgBouncer in transaction mode needs
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "2")
+SQLALCHEMY_ENGINE_OPTIONS = (
+    {"connect_args": {"prepare_threshold": int(DB_PREPARE_THRESHOLD) if DB_PREPARE_THRESHOLD else None}}
+    if DATABASE_URI.startswith("postgresql+psycopg")
+    else {}
+)
+
+# What workers do with the database schema when they start: "upgrade"
+# applies pending migrations, "verify" only checks the schema version and
+# "none" skips both. Production verifies and runs 'flask db-upgrade' first.
+DB_SCHEMA_MODE = os.getenv("DB_SCHEMA_MODE", "upgrade")
+
+# A file whose presence fails /readyz, created by the preStop hook of the
+# pod, and the seconds a stopping worker waits for requests in flight
+DRAIN_FILE = os.getenv("DRAIN_FILE", "")
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
+# "json" for one JSON object per line, or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Fractions of INFO records to keep by logger, e.g. "flask.app.models=0.1"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# Seconds between keep-alive comments on Server-Sent Events streams
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Streams a worker serves at once, each takes one of its GUNICORN_THREADS
+# until it ends, and the seconds clients past it wait to retry. 0 is no
+# limit, for gevent workers whose streams do not take a thread.
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "2"))
+SSE_RETRY_AFTER = int(os.getenv("SSE_RETRY_AFTER", "15"))
+
+# Folder of archived orders, orders are not archived without one
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH")
+
+# Most SQL statements a request should run and times it may repeat one,
+# 0 turns the check off. Strict mode makes requests over budget fail.
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", "50"))
+SQL_REPEAT_LIMIT = int(os.getenv("SQL_REPEAT_LIMIT", "10"))
+SQL_BUDGET_STRICT = os.getenv("SQL_BUDGET_STRICT", "false").lower() == "true"
+
+# Export request traces to "console" or to a file path, no tracing if empty
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "")
+
+# Seconds the orders of a customer stay cached, 0 turns the cache off, and
+# seconds more a stale page is still served while it is reloaded
+ORDER_CACHE_TTL = float(os.getenv("ORDER_CACHE_TTL", "0"))
+ORDER_CACHE_STALE = float(os.getenv("ORDER_CACHE_STALE", "30"))
+# Pages of orders each process keeps in front of the shared cache
+ORDER_CACHE_SIZE = int(os.getenv("ORDER_CACHE_SIZE", "1000"))
+# Redis server shared by the workers, e.g. "redis://cache:6379/0". Without
+# one each worker caches on its own and only sees its own changes at once.
+CACHE_URL = os.getenv("CACHE_URL", "")
+
+# Identical reads that arrive together in a worker share one query
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+
+# Sales of products read the daily rollups kept by 'flask sales-rollup' and
+# sum only the items of the days after them
+SALES_ROLLUPS = os.getenv("SALES_ROLLUPS", "false").lower() == "true"
+
+# Bearer token of the admin endpoints and ?profile=1, which are off without one
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Responses smaller than this many bytes are not compressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_LEVEL = int(os.getenv("COMPRESSION_BROTLI_LEVEL", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+# Tokens a second each client gets and the most it can save up, 0 turns rate
+# limiting off. Requests take 1 token unless RATE_LIMIT_COSTS says otherwise.
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "60"))
+RATE_LIMIT_COSTS = os.getenv(
+    "RATE_LIMIT_COSTS",
+    "list_orders=5,search_orders=5,bulk_update_status=10,get_product_sales=5,list_top_products=10",
+)
+
+# Proxies in front of the app whose X-Forwarded-For tells the address of a
+# client, such as the ingress controller, 0 if clients connect directly
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+# Requests a process serves at once before it answers 503, 0 turns it off
+LOAD_SHED_MAX_IN_FLIGHT = int(os.getenv("LOAD_SHED_MAX_IN_FLIGHT", "0"))
+LOAD_SHED_RETRY_AFTER = int(os.getenv("LOAD_SHED_RETRY_AFTER", "1"))
@@ -3,23 +3,74 @@ Models for YourResourceModel
 
 All of the models are stored in this module
 """
+# pylint: disable=too-many-lines
 
 import logging
 from datetime import datetime
+from decimal import Decimal
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Enum
+from sqlalchemy import DDL, Enum, event, inspect, text, values
+from sqlalchemy.orm import Session
+from service.common import keyset, money
+from service.common.archive import order_archive
+from service.common.cache import order_cache
+from service.common.events import broker
+from service.common.search import SortedIndex
 
-logger = logging.getLogger("flask.app")
+# A logger of its own so its INFO messages can be sampled
+logger = logging.getLogger("flask.app.models")
+
+# Orders in these states are done with and can be archived
+TERMINAL_STATUSES = ("delivered", "cancelled", "refunded")
+
+# The statuses an order can move to from each status
+STATUS_TRANSITIONS = {
+    "pending": ("processing", "shipped", "cancelled"),
+    "processing": ("shipped", "cancelled"),
+    "shipped": ("delivered", "returned"),
+    "delivered": ("returned",),
+    "returned": ("refunded",),
+    "cancelled": ("refunded",),
+    "refunded": (),
+}
+
+# The error raised by the database for a status change not in STATUS_TRANSITIONS
+INVALID_TRANSITION_SQLSTATE = "23514"
+
+# Number of orders changed by each statement of a bulk update
+BULK_CHUNK_SIZE = 1000
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Fallback for tracking number searches the database cannot index itself
+tracking_number_index = SortedIndex()
+
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
-class Orders(db.Model):
+class StatusTransitionError(DataValidationError):
+    """Used when an order cannot move from its status to another"""
+
+
+def database_error(error: Exception) -> DataValidationError:
+    """Converts an error raised by the database into a DataValidationError"""
+    if getattr(getattr(error, "orig", None), "sqlstate", None) == INVALID_TRANSITION_SQLSTATE:
+        return StatusTransitionError(error.orig)
+    return DataValidationError(error)
+
+
+def check_status_transition(old_status: str | None, new_status: str):
+    """Raises StatusTransitionError if an order cannot move between the statuses"""
+    if new_status not in STATUS_TRANSITIONS:
+        raise DataValidationError(f"Invalid status: {new_status}")
+    if old_status is not None and old_status != new_status and new_status not in STATUS_TRANSITIONS[old_status]:
+        raise StatusTransitionError(f"Invalid status transition from {old_status} to {new_status}")
+
+
+class Orders(db.Model):  # pylint: disable=too-many-public-methods
     """
     Class that represents a order
     """
@@ -44,12 +95,36 @@ class Orders(db.Model):
         default="pending",
     )
     tracking_number: str | None = db.Column(db.String, nullable=True)
-    discount_amount: float = db.Column(db.Float, default=0.0)
+    discount_amount: Decimal = db.Column(
+        db.Numeric(money.PRECISION, money.SCALE), default=Decimal(0), index=True
+    )
+    # Kept in step with the order's items when they are written, so lists
+    # can show and filter on them without loading the items
+    item_count: int = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    total_amount: Decimal = db.Column(
+        db.Numeric(money.PRECISION, money.SCALE), nullable=False, default=Decimal(0), server_default="0"
+    )
     # Relationship to OrderItems
     order_items = db.relationship(
         "OrderItems", backref="orders", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        # text_pattern_ops lets LIKE 'prefix%' use the index in any collation
+        db.Index(
+            "ix_orders_tracking_number",
+            "tracking_number",
+            postgresql_ops={"tracking_number": "text_pattern_ops"},
+        ),
+        # Serve lists sorted by these columns, in either direction
+        db.Index("ix_orders_order_date", "order_date", "order_id"),
+        db.Index("ix_orders_customer_id", "customer_id", "order_id"),
+        db.Index("ix_orders_total_amount", "total_amount", "order_id"),
+    )
+
+    # True for orders read back from the archive, which are read-only
+    archived = False
+
     def __repr__(self):
         return f"<Order id=[{self.order_id}]>"
 
@@ -61,6 +136,8 @@ class Orders(db.Model):
         self.order_id = None  # pylint: disable=invalid-name
         try:
             db.session.add(self)
+            db.session.flush()
+            broker.publish(db.session, [self.status_event()])
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -71,13 +148,23 @@ class Orders(db.Model):
         """
         Updates a Order to the database
         """
-        logger.info("Saving %s", self.order_id)
         try:
+            logger.info("Saving %s", self.order_id)
+            history = inspect(self).attrs.status.history
+            if history.has_changes():
+                # The old status is only known if it was loaded, the database
+                # checks the transition again against the row it updates
+                check_status_transition(history.deleted[0] if history.deleted else None, self.status)
+                db.session.flush()
+                broker.publish(db.session, [self.status_event()])
             db.session.commit()
+        except DataValidationError:
+            db.session.rollback()
+            raise
         except Exception as e:
             db.session.rollback()
             logger.error("Error updating record: %s", self)
-            raise DataValidationError(e) from e
+            raise database_error(e) from e
 
     def delete(self):
         """Removes a Order from the data store"""
@@ -95,10 +182,22 @@ class Orders(db.Model):
         return {
             "order_id": self.order_id,
             "customer_id": self.customer_id,
-            "order_date": self.order_date.isoformat(),
+            # The column is nullable, rows written outside the service may have none
+            "order_date": self.order_date and self.order_date.isoformat(),
+            "status": self.status,
+            "tracking_number": self.tracking_number,
+            "discount_amount": money.serialize(self.discount_amount),
+            "item_count": self.item_count,
+            "total_amount": money.serialize(self.total_amount),
+        }
+
+    def status_event(self):
+        """Describes the current status of a Order for event subscribers"""
+        return {
+            "order_id": self.order_id,
+            "customer_id": self.customer_id,
             "status": self.status,
             "tracking_number": self.tracking_number,
-            "discount_amount": self.discount_amount,
         }
 
     def deserialize(self, data):
@@ -115,7 +214,7 @@ class Orders(db.Model):
             )
             self.status: str = data.get("status", "pending")
             self.tracking_number: str | None = data.get("tracking_number", None)
-            self.discount_amount: float = data.get("discount_amount", 0.0)
+            self.discount_amount: Decimal = money.parse(data.get("discount_amount", 0))
         except KeyError as error:
             raise DataValidationError(
                 "Invalid YourResourceModel: missing " + error.args[0]
@@ -125,6 +224,8 @@ class Orders(db.Model):
                 "Invalid YourResourceModel: body of request contained bad or no data "
                 + str(error)
             ) from error
+        except ValueError as error:
+            raise DataValidationError("Invalid YourResourceModel: " + str(error)) from error
         return self
 
     ##################################################
@@ -148,27 +249,332 @@ class Orders(db.Model):
 
     @classmethod
     def find(cls, order_id):
-        """Returns a single order by its ID"""
+        """Returns a single order by its ID, looking in the archive if it is not in the database"""
         logger.info("Processing get_order request for id %s", order_id)
-        return cls.query.get(order_id)
+        order = db.session.scalars(FIND_ORDER, {"order_id": order_id}).first()
+        if order is None and order_archive.enabled:
+            data = order_archive.find(order_id)
+            if data is not None:
+                order = cls.from_archive(data)
+        return order
+
+    @classmethod
+    def from_archive(cls, data):
+        """Rebuilds a read-only Order and its items from the archive"""
+        order = cls(
+            order_id=data["order_id"],
+            customer_id=data["customer_id"],
+            order_date=datetime.fromisoformat(data["order_date"]),
+            status=data["status"],
+            tracking_number=data["tracking_number"],
+            discount_amount=money.parse(data["discount_amount"]),
+        )
+        order.order_items = [
+            OrderItems(
+                order_item_id=item["order_item_id"],
+                order_id=item["order_id"],
+                product_id=item["product_id"],
+                quantity=item["quantity"],
+                price=money.parse(item["price"]),
+            )
+            for item in data["order_items"]
+        ]
+        order.item_count = len(order.order_items)
+        order.total_amount = sum((item_amount(item.quantity, item.price) for item in order.order_items), Decimal(0))
+        order.archived = True
+        return order
+
+    @classmethod
+    def archive(cls, older_than: datetime, batch_size: int = 1000) -> int:
+        """Moves finished Orders and their items from the database to the archive
+
+        :param older_than: only archive Orders placed before this date
+        :type older_than: datetime
+        :param batch_size: the number of Orders in each archive file
+        :type batch_size: int
+
+        :return: the number of Orders archived
+        :rtype: int
+
+        """
+        logger.info("Archiving orders placed before %s ...", older_than)
+        archived = 0
+        while True:
+            orders = (
+                cls.query.filter(cls.status.in_(TERMINAL_STATUSES), cls.order_date < older_than)
+                .order_by(cls.order_id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+                .options(db.selectinload(cls.order_items))
+                .all()
+            )
+            if not orders:
+                break
+            # The batch is safely on disk before it leaves the database
+            order_archive.write_batch(
+                [
+                    dict(order.serialize(), order_items=[item.serialize() for item in order.order_items])
+                    for order in orders
+                ]
+            )
+            order_ids = [order.order_id for order in orders]
+            if db.engine.dialect.name == "postgresql":
+                # Keeps the sales of the archived orders in the daily rollups
+                db.session.execute(db.text("SELECT set_config('sales.archiving', 'on', true)"))
+            db.session.execute(db.delete(OrderItems).where(OrderItems.order_id.in_(order_ids)))
+            db.session.execute(db.delete(cls).where(cls.order_id.in_(order_ids)))
+            order_cache.changed(db.session, {customer_scope(order.customer_id) for order in orders})
+            db.session.commit()
+            db.session.expunge_all()
+            tracking_number_index.invalidate()
+            archived += len(orders)
+        return archived
+
+    @classmethod
+    def recompute_totals(cls, batch_size: int = 1000) -> int:
+        """Recomputes the item counts and totals of all Orders from their items
+
+        :param batch_size: the number of Orders recomputed in each transaction
+        :type batch_size: int
+
+        :return: the number of Orders whose totals were wrong
+        :rtype: int
+
+        """
+        logger.info("Recomputing order totals ...")
+        repaired, last_order_id = 0, 0
+        while True:
+            # Locked first, so the items counted next include every change
+            # committed to them before the lock and none can slip in after
+            order_ids = db.session.scalars(
+                db.select(cls.order_id)
+                .where(cls.order_id > last_order_id)
+                .order_by(cls.order_id)
+                .limit(batch_size)
+                .with_for_update()
+            ).all()
+            if not order_ids:
+                break
+            changed = db.session.execute(recompute_totals_statement(order_ids)).all()
+            order_cache.changed(db.session, {customer_scope(row.customer_id) for row in changed})
+            db.session.commit()
+            if changed:
+                logger.warning("Repaired the totals of orders %s", [row.order_id for row in changed])
+            repaired += len(changed)
+            last_order_id = order_ids[-1]
+        return repaired
+
+    @classmethod
+    def find_status_history(cls, order_id: int) -> list:
+        """Returns the status changes of an Order, oldest first
+
+        :param order_id: the id of the Order
+        :type order_id: int
+
+        :return: a collection of status changes
+        :rtype: list
+
+        """
+        logger.info("Processing status history query for %s ...", order_id)
+        rows = db.session.execute(
+            db.select(order_status_history)
+            .where(order_status_history.c.order_id == order_id)
+            .order_by(order_status_history.c.changed_at)
+        )
+        return [
+            {
+                "from_status": row.from_status,
+                "to_status": row.to_status,
+                "changed_at": row.changed_at.isoformat(),
+            }
+            for row in rows
+        ]
+
+    @classmethod
+    def find_ids_by_filter(cls, criteria: dict) -> list:
+        """Returns the ids of the Orders matching a filter
+
+        :param criteria: the customer_id and/or status the Orders must have
+        :type criteria: dict
+
+        :return: a collection of order ids
+        :rtype: list
+
+        """
+        logger.info("Processing order id query for %s ...", criteria)
+        if not isinstance(criteria, dict) or not criteria or set(criteria) - {"customer_id", "status"}:
+            raise DataValidationError(f"Invalid filter: {criteria}")
+        if "status" in criteria and criteria["status"] not in STATUS_TRANSITIONS:
+            raise DataValidationError(f"Invalid status: {criteria['status']}")
+        customer_id = criteria.get("customer_id")
+        if "customer_id" in criteria and (not isinstance(customer_id, int) or isinstance(customer_id, bool)):
+            raise DataValidationError(f"Invalid customer_id: {customer_id}")
+        return list(db.session.scalars(db.select(cls.order_id).filter_by(**criteria).order_by(cls.order_id)))
+
+    @classmethod
+    def bulk_update_status(
+        cls, order_ids: list, new_status: str, tracking_numbers: dict | None = None, chunk_size: int = BULK_CHUNK_SIZE
+    ) -> dict:
+        """Moves many Orders to a new status with one UPDATE per chunk, all in one transaction
+
+        :param order_ids: the ids of the Orders to update
+        :type order_ids: list
+        :param new_status: the status to move the Orders to
+        :type new_status: str
+        :param tracking_numbers: optional tracking numbers by order id
+        :type tracking_numbers: dict
+        :param chunk_size: the number of Orders in each statement
+        :type chunk_size: int
+
+        :return: the ids that were updated, rejected by the state rules and not found
+        :rtype: dict
+
+        """
+        logger.info("Processing bulk status update of %s orders to %s ...", len(order_ids), new_status)
+        if new_status not in STATUS_TRANSITIONS:
+            raise DataValidationError(f"Invalid status: {new_status}")
+        tracking_numbers = tracking_numbers or {}
+        sources = [source for source, targets in STATUS_TRANSITIONS.items() if new_status in targets]
+        order_ids = list(dict.fromkeys(order_ids))
+        updated = []
+        rejected = []
+        # A failed chunk rolls back the chunks before it, so no order is moved
+        try:
+            for start in range(0, len(order_ids), chunk_size):
+                chunk = order_ids[start:start + chunk_size]
+                statement = cls._bulk_status_statement(
+                    [(order_id, tracking_numbers.get(order_id)) for order_id in chunk], new_status, sources
+                )
+                rows = db.session.execute(statement, execution_options={"synchronize_session": False}).all()
+                broker.publish(db.session, [dict(row._mapping) for row in rows])
+                order_cache.changed(db.session, {customer_scope(row.customer_id) for row in rows})
+                changed = {row.order_id for row in rows}
+                updated.extend(order_id for order_id in chunk if order_id in changed)
+                rejected.extend(order_id for order_id in chunk if order_id not in changed)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error updating the status of orders to %s", new_status)
+            raise DataValidationError(e) from e
+        tracking_number_index.invalidate()
+
+        # Only the ids that were not updated need a second look
+        found = set()
+        for start in range(0, len(rejected), chunk_size):
+            chunk = rejected[start:start + chunk_size]
+            found.update(db.session.scalars(db.select(cls.order_id).where(cls.order_id.in_(chunk))))
+        return {
+            "status": new_status,
+            "updated": updated,
+            "rejected": [order_id for order_id in rejected if order_id in found],
+            "not_found": [order_id for order_id in rejected if order_id not in found],
+        }
+
+    @classmethod
+    def _bulk_status_statement(cls, changes: list, new_status: str, sources: list):
+        """Builds an UPDATE ... FROM (VALUES ...) of (order_id, tracking_number) rows"""
+        changes = values(
+            db.column("order_id", db.Integer), db.column("tracking_number", db.String), name="changes"
+        ).data(changes)
+        return (
+            db.update(cls)
+            .where(cls.order_id == changes.c.order_id, cls.status.in_(sources))
+            .values(
+                status=new_status,
+                tracking_number=db.func.coalesce(changes.c.tracking_number, cls.tracking_number),
+            )
+            .returning(cls.order_id, cls.customer_id, cls.status, cls.tracking_number)
+        )
 
     @classmethod
     def update_order(cls, order_id, data):
-        """Updates an order by its ID"""
+        """Updates an order by its ID, the fields the service maintains are ignored"""
         logger.info("Processing update_order request for id %s", order_id)
-        order = cls.query.get(order_id)
+        order = db.session.get(cls, order_id)
         if not order:
             return None
         for key, value in data.items():
+            if key in READ_ONLY_FIELDS:
+                continue
+            if key == "discount_amount":
+                try:
+                    value = money.parse(value)
+                except ValueError as error:
+                    raise DataValidationError(f"Invalid {key}: {error}") from error
             setattr(order, key, value)
         order.update()
         return order
 
+    @classmethod
+    def merge_patch(cls, order_id: int, patch: dict):
+        """Applies an RFC 7396 JSON merge patch to an Order
+
+        Only the columns in the patch are written, with a single UPDATE that
+        leaves the row alone if none of them would change
+
+        :param order_id: the id of the Order to patch
+        :type order_id: int
+        :param patch: the merge patch, null removes a value
+        :type patch: dict
+
+        :return: the patched Order, or None if it was not found
+        :rtype: Orders
+
+        """
+        changes = merge_patch_values(patch)
+        logger.info("Processing merge patch of order %s with %s", order_id, changes)
+        if not changes:
+            return db.session.get(cls, order_id)
+        statement = (
+            db.update(cls)
+            .where(
+                cls.order_id == order_id,
+                db.or_(*[getattr(cls, key).is_distinct_from(value) for key, value in changes.items()]),
+            )
+            .values(**changes)
+        )
+        if "status" in changes or "customer_id" in changes:
+            # The locked row before the update tells if the status moved
+            # and which customer the order belonged to
+            old = (
+                db.select(cls.order_id, cls.status, cls.customer_id)
+                .where(cls.order_id == order_id)
+                .with_for_update()
+                .subquery("old")
+            )
+            statement = statement.where(cls.order_id == old.c.order_id).returning(cls, old.c.status, old.c.customer_id)
+        else:
+            statement = statement.returning(cls)
+        try:
+            row = db.session.execute(
+                statement, execution_options={"synchronize_session": "fetch"}
+            ).first()
+            if row is None:
+                db.session.rollback()
+                return db.session.get(cls, order_id)
+            order = row[0]
+            if "order_date" in changes:
+                db.session.execute(move_items_statement(order_id, order.order_date))
+            if "status" in changes and row[1] != order.status:
+                broker.publish(db.session, [order.status_event()])
+            customers = {order.customer_id, row[2]} if len(row) > 2 else {order.customer_id}
+            order_cache.changed(db.session, {customer_scope(customer_id) for customer_id in customers})
+            # Detached, the returned values stay loaded after the commit
+            db.session.expunge(order)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error patching order %s", order_id)
+            raise database_error(e) from e
+        if "tracking_number" in changes:
+            tracking_number_index.invalidate()
+        return order
+
     @classmethod
     def delete_order(cls, order_id):
         """Deletes an order by its ID"""
         logger.info("Processing delete_order request for id %s", order_id)
-        order = cls.query.get(order_id)
+        order = db.session.get(cls, order_id)
         if not order:
             return None
         order.delete()
@@ -192,7 +598,90 @@ class Orders(db.Model):
 
         """
         logger.info("Processing customer_id query for %s ...", customer_id)
-        return cls.query.filter_by(customer_id=customer_id).all()
+        return db.session.scalars(FIND_ORDERS_BY["customer_id"], {"value": customer_id}).all()
+
+    @classmethod
+    def find_serialized_by_customer_id(cls, customer_id: int, page: int = 1, per_page: int | None = None) -> list:
+        """Returns a page of the serialized Orders of a customer, in order_id order
+
+        The pages and the order ids of the customer come from order_cache
+        when it is on
+
+        :param customer_id: the customer_id of the Orders you want to match
+        :type customer_id: int
+        :param page: the 1-based page of Orders
+        :type page: int
+        :param per_page: the number of Orders in a page, None for all of them
+        :type per_page: int
+
+        :return: a collection of serialized Orders with that customer_id
+        :rtype: list
+
+        """
+        scope = customer_scope(customer_id)
+        start = (page - 1) * (per_page or 0)
+        end = start + per_page if per_page else None
+
+        def load_page():
+            if not order_cache.enabled:
+                query = cls.query.filter_by(customer_id=customer_id).order_by(cls.order_id).offset(start)
+                return [order.serialize() for order in (query.limit(per_page) if per_page else query)]
+            order_ids = order_cache.get(scope, "ids", lambda: cls.find_ids_by_filter({"customer_id": customer_id}))
+            order_ids = order_ids[start:end]
+            if not order_ids:
+                return []
+            return [order.serialize() for order in cls.query.filter(cls.order_id.in_(order_ids)).order_by(cls.order_id)]
+
+        logger.info("Processing serialized customer_id query for %s ...", customer_id)
+        return order_cache.get(scope, f"page:{page}:{per_page}", load_page)
+
+    @classmethod
+    def find_sorted(  # pylint: disable=too-many-arguments
+        cls,
+        criteria: dict,
+        sort: str | None,
+        per_page: int,
+        page_token: str | None = None,
+        total_range: tuple = (None, None),
+    ) -> tuple:
+        """Returns a page of the Orders that match criteria, in the order of sort
+
+        :param criteria: the values of the columns of the Orders you want to match
+        :type criteria: dict
+        :param sort: the columns to sort by, such as "-order_date,customer_id"
+        :type sort: str
+        :param per_page: the number of Orders in a page
+        :type per_page: int
+        :param page_token: the token of the page to return, None for the first one
+        :type page_token: str
+        :param total_range: the smallest and largest total_amount to match, None for unbounded
+        :type total_range: tuple
+
+        :return: a page of Orders and the token of the next page, None on the last page
+        :rtype: tuple
+
+        """
+        logger.info("Processing sorted query for %s by %s ...", criteria, sort)
+        try:
+            order = keyset.parse_sort(sort, SORTABLE_COLUMNS, "order_id")
+            after = keyset.decode_token(page_token, order) if page_token else None
+        except ValueError as error:
+            raise DataValidationError(str(error)) from error
+        statement = db.select(cls).filter_by(**criteria)
+        total_min, total_max = total_range
+        if total_min is not None:
+            statement = statement.where(cls.total_amount >= total_min)
+        if total_max is not None:
+            statement = statement.where(cls.total_amount <= total_max)
+        if after is not None:
+            statement = statement.where(keyset.after(order, after))
+        # One more row than a page tells if there is a next page
+        statement = statement.order_by(*keyset.order_by(order)).limit(per_page + 1)
+        orders = db.session.scalars(statement).all()
+        if len(orders) <= per_page:
+            return orders, None
+        orders = orders[:per_page]
+        return orders, keyset.encode_token(order, [getattr(orders[-1], name) for name, _, _ in order])
 
     @classmethod
     def find_by_order_date(cls, order_date: str) -> list:
@@ -206,7 +695,7 @@ class Orders(db.Model):
 
         """
         logger.info("Processing order_date query for %s ...", order_date)
-        return cls.query.filter_by(order_date=order_date).all()
+        return db.session.scalars(FIND_ORDERS_BY["order_date"], {"value": order_date}).all()
 
     @classmethod
     def find_by_status(cls, order_status: str) -> list:
@@ -220,7 +709,7 @@ class Orders(db.Model):
 
         """
         logger.info("Processing status query for %s ...", order_status)
-        return cls.query.filter_by(status=order_status).all()
+        return db.session.scalars(FIND_ORDERS_BY["status"], {"value": order_status}).all()
 
     @classmethod
     def find_by_tracking_number(cls, tracking_number: str) -> list:
@@ -234,21 +723,107 @@ class Orders(db.Model):
 
         """
         logger.info("Processing tracking_number query for %s ...", tracking_number)
-        return cls.query.filter_by(tracking_number=tracking_number).all()
+        return db.session.scalars(FIND_ORDERS_BY["tracking_number"], {"value": tracking_number}).all()
+
+    @classmethod
+    def search_by_tracking_number(
+        cls, query: str, mode: str = "prefix", page: int = 1, per_page: int = 20
+    ) -> list:
+        """Returns Orders whose tracking_number matches a partial one, best match first
+
+        :param query: the full or partial tracking_number to search for
+        :type query: str
+        :param mode: 'prefix' to match the start, 'fuzzy' for substrings and typos
+        :type mode: str
+        :param page: the 1-based page of results to return
+        :type page: int
+        :param per_page: the number of results in a page
+        :type per_page: int
+
+        :return: a ranked collection of Orders
+        :rtype: list
+
+        """
+        logger.info("Processing tracking_number %s search for %s ...", mode, query)
+        if mode not in ("prefix", "fuzzy"):
+            raise DataValidationError(f"Invalid search mode: {mode}")
+        if not query or page < 1 or per_page < 1:
+            raise DataValidationError("Search requires a query, page and per_page")
+        offset = (page - 1) * per_page
+
+        if mode == "fuzzy" and has_trigram_index():
+            # <% and <<-> compare the query with the closest part of the
+            # tracking number and are both served by the trigram GiST index
+            matches = db.literal(query).op("<%", is_comparison=True)
+            distance = db.literal(query).op("<<->", return_type=db.Float)
+            return (
+                cls.query.filter(matches(cls.tracking_number))
+                .order_by(distance(cls.tracking_number), cls.order_id)
+                .offset(offset)
+                .limit(per_page)
+                .all()
+            )
+        if searches_in_database():
+            # Without pg_trgm fuzzy searches only match substrings, the
+            # in-memory index would go stale in the other workers
+            pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            if mode == "prefix":
+                matches = cls.tracking_number.like(pattern + "%", escape="\\")
+            else:
+                matches = cls.tracking_number.ilike("%" + pattern + "%", escape="\\")
+            return (
+                cls.query.filter(matches)
+                .order_by(cls.tracking_number, cls.order_id)
+                .offset(offset)
+                .limit(per_page)
+                .all()
+            )
+
+        if tracking_number_index.stale:
+            tracking_number_index.rebuild(
+                db.session.query(cls.tracking_number, cls.order_id).all()
+            )
+        search = getattr(tracking_number_index, mode)
+        order_ids = search(query, offset, per_page)
+        found = {order.order_id: order for order in cls.query.filter(cls.order_id.in_(order_ids))}
+        return [found[order_id] for order_id in order_ids if order_id in found]
 
     @classmethod
-    def find_by_discount_amount(cls, discount_amount: float) -> list:
+    def find_by_discount_amount(cls, discount_amount: Decimal) -> list:
         """Returns all Pets by their discount amount
 
         :param discount_amount: the discount_amount of the Orders you want to match
-        :type discount_amount: str
+        :type discount_amount: Decimal
 
         :return: a collection of Orders in that discount_amount
         :rtype: list
 
         """
         logger.info("Processing discount_amount query for %s ...", discount_amount)
-        return cls.query.filter_by(discount_amount=discount_amount).all()
+        return db.session.scalars(FIND_ORDERS_BY["discount_amount"], {"value": discount_amount}).all()
+
+    @classmethod
+    def find_by_discount_range(
+        cls, discount_min: Decimal | None = None, discount_max: Decimal | None = None
+    ) -> list:
+        """Returns all Orders with a discount amount in a range
+
+        :param discount_min: the smallest discount_amount to match, unbounded if None
+        :type discount_min: Decimal
+        :param discount_max: the largest discount_amount to match, unbounded if None
+        :type discount_max: Decimal
+
+        :return: a collection of Orders with a discount_amount in the range
+        :rtype: list
+
+        """
+        logger.info("Processing discount_amount range query for %s - %s ...", discount_min, discount_max)
+        query = cls.query
+        if discount_min is not None:
+            query = query.filter(cls.discount_amount >= discount_min)
+        if discount_max is not None:
+            query = query.filter(cls.discount_amount <= discount_max)
+        return query.order_by(cls.discount_amount, cls.order_id).all()
 
 
 class OrderItems(db.Model):
@@ -259,11 +834,18 @@ class OrderItems(db.Model):
     ##################################################
     # Table Schema
     ##################################################
+    __table_args__ = (
+        # Serves the sales of a product, see service.common.sales
+        db.Index("ix_order_items_product_id", "product_id", "order_date"),
+    )
+
     order_item_id: int = db.Column(db.Integer, primary_key=True)
-    order_id: int = db.Column(db.Integer, db.ForeignKey("orders.order_id"))
+    order_id: int = db.Column(db.Integer, db.ForeignKey("orders.order_id"), index=True)
+    # Copy of the order's order_date, the partition key when orders are partitioned
+    order_date: datetime = db.Column(db.DateTime)
     product_id: int = db.Column(db.Integer, nullable=False)
     quantity: int = db.Column(db.Integer, nullable=False)
-    price: float = db.Column(db.Float, nullable=False)
+    price: Decimal = db.Column(db.Numeric(money.PRECISION, money.SCALE), nullable=False)
 
     def __repr__(self):
         return f"<OrderItem id=[{self.order_item_id}]>"
@@ -312,7 +894,7 @@ class OrderItems(db.Model):
             "order_id": self.order_id,
             "product_id": self.product_id,
             "quantity": self.quantity,
-            "price": self.price,
+            "price": money.serialize(self.price),
         }
 
     def deserialize(self, data):
@@ -325,7 +907,7 @@ class OrderItems(db.Model):
         try:
             self.product_id: int = data["product_id"]
             self.quantity: int = data["quantity"]
-            self.price: float = data["price"]
+            self.price: Decimal = money.parse(data["price"])
         except KeyError as error:
             raise DataValidationError(
                 "Invalid OrderItem: missing " + error.args[0]
@@ -335,6 +917,8 @@ class OrderItems(db.Model):
                 "Invalid OrderItem: body of request contained bad or no data "
                 + str(error)
             ) from error
+        except ValueError as error:
+            raise DataValidationError("Invalid OrderItem: " + str(error)) from error
         return self
 
     ##################################################
@@ -345,7 +929,7 @@ class OrderItems(db.Model):
     def find_by_order(cls, order_id):
         """Returns all OrderItems with the given order ID"""
         logger.info("Processing order query for %s ...", order_id)
-        return cls.query.filter(cls.order_id == order_id).all()
+        return db.session.scalars(FIND_ITEMS_BY_ORDER, {"order_id": order_id}).all()
 
     @classmethod
     def create_item(cls, order_id, item_data):
@@ -357,20 +941,134 @@ class OrderItems(db.Model):
         new_item.create()
         return new_item
 
+    @classmethod
+    def apply_batch(cls, order_id: int, operations: list) -> list:
+        """Adds, updates and removes items of an order in one transaction
+
+        :param order_id: the id of the Order the items belong to
+        :type order_id: int
+        :param operations: {"op": "add" | "update" | "remove", ...} operations
+        :type operations: list
+
+        :return: the items of the Order after the operations
+        :rtype: list
+
+        """
+        adds, updates, removes = cls._parse_operations(operations)
+        logger.info("Applying %s item operations to order %s ...", len(operations), order_id)
+        try:
+            # Locking the order serializes concurrent edits of its items
+            order_date = db.session.scalar(
+                db.select(Orders.order_date).where(Orders.order_id == order_id).with_for_update()
+            )
+            if removes:
+                removed = db.session.scalars(
+                    db.delete(cls)
+                    .where(cls.order_id == order_id, cls.order_item_id.in_(removes))
+                    .returning(cls.order_item_id),
+                    execution_options={"synchronize_session": False},
+                ).all()
+                check_items_found(removes, removed)
+            if updates:
+                updated = db.session.scalars(
+                    cls._batch_update_statement(order_id, updates),
+                    execution_options={"synchronize_session": False},
+                ).all()
+                check_items_found([update["order_item_id"] for update in updates], updated)
+            if adds:
+                # Bulk inserts skip mapper events, so order_date is set here
+                db.session.execute(
+                    db.insert(cls), [dict(add, order_id=order_id, order_date=order_date) for add in adds]
+                )
+            # So do bulk statements, the order is locked so its totals can be counted again
+            changed = db.session.execute(recompute_totals_statement([order_id])).all()
+            order_cache.changed(db.session, {customer_scope(row.customer_id) for row in changed})
+            db.session.commit()
+        except DataValidationError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error applying item operations to order %s", order_id)
+            raise DataValidationError(e) from e
+        db.session.expire_all()
+        return cls.query.filter(cls.order_id == order_id).order_by(cls.order_item_id).all()
+
+    @classmethod
+    def _parse_operations(cls, operations) -> tuple:
+        """Validates item operations and splits them into adds, updates and removes"""
+        if not isinstance(operations, list):
+            raise DataValidationError("Item operations must be a list")
+        adds, updates, removes = [], [], []
+        for operation in operations:
+            kind = operation.get("op") if isinstance(operation, dict) else None
+            if kind == "add":
+                adds.append(item_values(operation, ITEM_FIELDS, required=ITEM_FIELDS))
+            elif kind == "update":
+                updates.append(item_values(operation, ("order_item_id",) + ITEM_FIELDS, required=("order_item_id",)))
+            elif kind == "remove":
+                removes.append(item_values(operation, ("order_item_id",), required=("order_item_id",))["order_item_id"])
+            else:
+                raise DataValidationError(f"Invalid item operation: {operation}")
+        return adds, updates, removes
+
+    @classmethod
+    def _batch_update_statement(cls, order_id: int, updates: list):
+        """Builds an UPDATE ... FROM (VALUES ...) of item changes, None keeps a value"""
+        changes = values(
+            db.column("order_item_id", db.Integer),
+            db.column("product_id", db.Integer),
+            db.column("quantity", db.Integer),
+            db.column("price", cls.price.type),
+            name="changes",
+        ).data(
+            [
+                (update["order_item_id"], update.get("product_id"), update.get("quantity"), update.get("price"))
+                for update in updates
+            ]
+        )
+        return (
+            db.update(cls)
+            .where(cls.order_item_id == changes.c.order_item_id, cls.order_id == order_id)
+            .values(
+                # A column of VALUES that only has NULLs is text without a cast
+                product_id=db.func.coalesce(db.cast(changes.c.product_id, db.Integer), cls.product_id),
+                quantity=db.func.coalesce(db.cast(changes.c.quantity, db.Integer), cls.quantity),
+                price=db.func.coalesce(db.cast(changes.c.price, cls.price.type), cls.price),
+            )
+            .returning(cls.order_item_id)
+        )
+
     @classmethod
     def find_item_in_order(cls, order_id, item_id):
         """Finds a single item in an order"""
         logger.info("Finding item %s in order %s ...", item_id, order_id)
-        return cls.query.filter_by(order_id=order_id, order_item_id=item_id).first()
+        return db.session.scalars(FIND_ITEM_IN_ORDER, {"order_id": order_id, "item_id": item_id}).first()
 
     @classmethod
     def update_item_in_order(cls, order_id, item_id, data):
-        """Updates a single item in an order"""
+        """Updates a single item in an order, only its product_id, quantity and price
+
+        Raises DataValidationError if a value is invalid
+        """
         logger.info("Updating item %s in order %s ...", item_id, order_id)
         item = cls.find_item_in_order(order_id, item_id)
         if not item:
             return None
-        for key, value in data.items():
+        # Parsed before any is set, the totals of the order add up the new values
+        changes = {}
+        for key in ITEM_FIELDS:
+            if key not in data:
+                continue
+            value = data[key]
+            try:
+                if key == "price":
+                    changes[key] = money.parse(value)
+                else:
+                    changes[key] = parse_integer(int(value) if isinstance(value, str) else value)
+            except (TypeError, ValueError) as error:
+                raise DataValidationError(f"Invalid {key}: {error}") from error
+        for key, value in changes.items():
             setattr(item, key, value)
         item.update()
         return item
@@ -384,3 +1082,406 @@ class OrderItems(db.Model):
             return None
         item.delete()
         return item
+
+
+######################################################################
+# Merge patch
+######################################################################
+def parse_integer(value) -> int:
+    """Returns an integer from JSON, rejecting booleans and other types"""
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise TypeError("must be an integer")
+    return value
+
+
+def parse_string(value) -> str:
+    """Returns a string from JSON"""
+    if not isinstance(value, str):
+        raise TypeError("must be a string")
+    return value
+
+
+def parse_status(value) -> str:
+    """Returns a known order status"""
+    if value not in STATUS_TRANSITIONS:
+        raise ValueError(f"unknown status {value}")
+    return value
+
+
+# The fields of an order the service maintains, clients cannot set them
+READ_ONLY_FIELDS = ("order_id", "item_count", "total_amount")
+
+# The fields of an order a merge patch can change: (nullable, parser)
+MERGE_PATCH_FIELDS = {
+    "customer_id": (False, parse_integer),
+    "order_date": (False, datetime.fromisoformat),
+    "status": (False, parse_status),
+    "tracking_number": (True, parse_string),
+    "discount_amount": (False, money.parse),
+}
+
+
+def merge_patch_values(patch) -> dict:
+    """Returns the validated column values of a merge patch of an order
+
+    Raises DataValidationError if the patch changes a field that cannot be
+    changed, removes a required one or has an invalid value
+    """
+    if not isinstance(patch, dict):
+        raise DataValidationError("Invalid merge patch: must be a JSON object")
+    changes = {}
+    for key, value in patch.items():
+        if key not in MERGE_PATCH_FIELDS:
+            raise DataValidationError(f"Invalid merge patch: {key} cannot be changed")
+        nullable, parse = MERGE_PATCH_FIELDS[key]
+        if value is None and not nullable:
+            raise DataValidationError(f"Invalid merge patch: {key} cannot be removed")
+        try:
+            changes[key] = None if value is None else parse(value)
+        except (TypeError, ValueError) as error:
+            raise DataValidationError(f"Invalid merge patch: {key} {error}") from error
+    return changes
+
+
+######################################################################
+# Batch item operations
+######################################################################
+ITEM_FIELDS = ("product_id", "quantity", "price")
+
+
+def item_values(operation: dict, fields: tuple, required: tuple = ()) -> dict:
+    """Returns the validated item columns of an operation
+
+    Raises DataValidationError if a required column is missing or a value is invalid
+    """
+    missing = [key for key in required if key not in operation]
+    if missing:
+        raise DataValidationError(f"Invalid item operation: missing {', '.join(missing)}")
+    result = {}
+    for key in ("order_item_id", "product_id", "quantity"):
+        if key in operation and key in fields:
+            if not isinstance(operation[key], int) or isinstance(operation[key], bool):
+                raise DataValidationError(f"Invalid item operation: {key} must be an integer")
+            result[key] = operation[key]
+    if "price" in operation and "price" in fields:
+        try:
+            result["price"] = money.parse(operation["price"])
+        except ValueError as error:
+            raise DataValidationError(f"Invalid item operation: {error}") from error
+    return result
+
+
+def check_items_found(expected: list, found: list):
+    """Raises DataValidationError if some of the expected item ids were not found"""
+    missing = sorted(set(expected) - set(found))
+    if missing or len(found) != len(expected):
+        raise DataValidationError(f"Items not found in order or given twice: {missing or expected}")
+
+
+######################################################################
+# Statements of hot lookups
+######################################################################
+# Built once with bound parameters instead of a Query per call, which
+# spares building the statement and computing its cache key every time.
+# The SQL is then always the same, so psycopg prepares it on the server
+# once a connection has run it DB_PREPARE_THRESHOLD times.
+# Lists can only be sorted by indexed columns, order_id ends every sort
+SORTABLE_COLUMNS = {
+    "order_id": Orders.order_id,
+    "order_date": Orders.order_date,
+    "customer_id": Orders.customer_id,
+    "discount_amount": Orders.discount_amount,
+    "total_amount": Orders.total_amount,
+}
+
+FIND_ORDER = db.select(Orders).where(Orders.order_id == db.bindparam("order_id"))
+
+FIND_ORDERS_BY = {
+    name: db.select(Orders).where(column == db.bindparam("value", type_=column.type))
+    for name, column in (
+        ("customer_id", Orders.customer_id),
+        ("order_date", Orders.order_date),
+        ("status", Orders.status),
+        ("tracking_number", Orders.tracking_number),
+        ("discount_amount", Orders.discount_amount),
+    )
+}
+
+FIND_ITEMS_BY_ORDER = db.select(OrderItems).where(OrderItems.order_id == db.bindparam("order_id"))
+
+FIND_ITEM_IN_ORDER = (
+    db.select(OrderItems)
+    .where(OrderItems.order_id == db.bindparam("order_id"), OrderItems.order_item_id == db.bindparam("item_id"))
+    .limit(1)
+)
+
+
+######################################################################
+# Status history
+######################################################################
+# Append-only log of status changes, written by a trigger on orders
+order_status_history = db.Table(
+    "order_status_history",
+    db.Column("order_id", db.Integer, nullable=False, index=True),
+    db.Column("from_status", Orders.__table__.c.status.type, nullable=True),
+    db.Column("to_status", Orders.__table__.c.status.type, nullable=False),
+    # UTC, the trigger of PostgreSQL sets it and the default is for SQLite
+    db.Column("changed_at", db.DateTime, nullable=False, server_default=db.func.now()),
+)
+
+ALLOWED_TRANSITIONS_SQL = ", ".join(
+    f"('{old_status}', '{new_status}')"
+    for old_status, new_statuses in STATUS_TRANSITIONS.items()
+    for new_status in new_statuses
+)
+
+# The trigger rejects changes not in STATUS_TRANSITIONS and logs the others
+# in the same statement, so neither needs another round trip
+STATUS_HISTORY_DDL = (
+    f"""
+CREATE OR REPLACE FUNCTION record_order_status() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF OLD.status IS NOT DISTINCT FROM NEW.status THEN
+            RETURN NULL;
+        END IF;
+        IF (OLD.status::text, NEW.status::text) NOT IN ({ALLOWED_TRANSITIONS_SQL}) THEN
+            RAISE EXCEPTION USING
+                ERRCODE = '{INVALID_TRANSITION_SQLSTATE}',
+                MESSAGE = 'Invalid status transition from ' || OLD.status || ' to ' || NEW.status;
+        END IF;
+    END IF;
+    INSERT INTO order_status_history (order_id, from_status, to_status, changed_at)
+        VALUES (NEW.order_id, CASE WHEN TG_OP = 'UPDATE' THEN OLD.status END, NEW.status, now() AT TIME ZONE 'utc');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""",
+    "DROP TRIGGER IF EXISTS orders_status_history ON orders",
+    """
+CREATE TRIGGER orders_status_history AFTER INSERT OR UPDATE OF status ON orders
+    FOR EACH ROW EXECUTE FUNCTION record_order_status()
+""",
+)
+
+# The history is only ever appended to
+APPEND_ONLY_DDL = (
+    """
+CREATE OR REPLACE FUNCTION reject_history_change() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'order_status_history is append-only';
+END
+$$ LANGUAGE plpgsql
+""",
+    "DROP TRIGGER IF EXISTS order_status_history_append_only ON order_status_history",
+    """
+CREATE TRIGGER order_status_history_append_only BEFORE UPDATE OR DELETE ON order_status_history
+    FOR EACH ROW EXECUTE FUNCTION reject_history_change()
+""",
+)
+
+for ddl in STATUS_HISTORY_DDL:
+    event.listen(Orders.__table__, "after_create", DDL(ddl).execute_if(dialect="postgresql"))
+for ddl in APPEND_ONLY_DDL:
+    event.listen(order_status_history, "after_create", DDL(ddl).execute_if(dialect="postgresql"))
+
+
+######################################################################
+# Tracking number search support
+######################################################################
+TRIGRAM_INDEX = "ix_orders_tracking_number_trgm"
+
+# pg_trgm is optional, without it fuzzy searches only match substrings
+TRIGRAM_INDEX_DDL = f"""
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX}
+            ON orders USING gist (tracking_number gist_trgm_ops);
+    END IF;
+END
+$$;
+"""
+
+event.listen(Orders.__table__, "after_create", DDL(TRIGRAM_INDEX_DDL).execute_if(dialect="postgresql"))
+
+
+_trigram_index_found = {}
+
+
+def has_trigram_index() -> bool:
+    """Returns True if the database can serve fuzzy tracking number searches"""
+    engine = db.engine
+    if engine.dialect.name != "postgresql":
+        return False
+    if engine not in _trigram_index_found:
+        with engine.connect() as conn:
+            _trigram_index_found[engine] = bool(
+                conn.execute(text("SELECT to_regclass(:name)"), {"name": TRIGRAM_INDEX}).scalar()
+            )
+    return _trigram_index_found[engine]
+
+
+def searches_in_database() -> bool:
+    """Returns True if the database searches tracking numbers, False if tracking_number_index does
+
+    The in-memory index only follows the writes of its own process, so it
+    serves SQLite, which has a single process, and not PostgreSQL.
+    """
+    return db.engine.dialect.name == "postgresql"
+
+
+@event.listens_for(OrderItems, "before_insert")
+def copy_order_date(mapper, connection, target):  # pylint: disable=unused-argument
+    """Inserts order items with the order_date of their order"""
+    if target.order_date is None:
+        target.order_date = (
+            db.select(Orders.order_date).where(Orders.order_id == target.order_id).scalar_subquery()
+        )
+
+
+def move_items_statement(order_id: int, order_date: datetime):
+    """Returns the UPDATE that copies a new order_date of an order onto its items
+
+    Partitioned tables already cascade the change through the foreign key of
+    order_items, and the UPDATE then finds nothing to change.
+    """
+    order_date = db.literal(order_date, OrderItems.order_date.type)
+    return (
+        db.update(OrderItems)
+        .where(OrderItems.order_id == order_id, OrderItems.order_date.is_distinct_from(order_date))
+        .values(order_date=order_date)
+        .execution_options(synchronize_session=False)
+    )
+
+
+@event.listens_for(Orders, "after_update")
+def move_items(mapper, connection, target):  # pylint: disable=unused-argument
+    """Copies the order_date of an Order onto its items in the same flush"""
+    if inspect(target).attrs.order_date.history.has_changes():
+        connection.execute(move_items_statement(target.order_id, target.order_date))
+
+
+@event.listens_for(Orders, "after_insert")
+@event.listens_for(Orders, "after_update")
+@event.listens_for(Orders, "after_delete")
+def invalidate_tracking_number_index(mapper, connection, target):  # pylint: disable=unused-argument
+    """Marks the in-memory tracking number index as stale when Orders change"""
+    tracking_number_index.invalidate()
+
+
+def customer_scope(customer_id: int) -> str:
+    """Returns the order_cache scope of the Orders of a customer"""
+    return f"customer:{customer_id}"
+
+
+@event.listens_for(Orders, "after_insert")
+@event.listens_for(Orders, "after_update")
+@event.listens_for(Orders, "after_delete")
+def invalidate_customer_orders(mapper, connection, target):  # pylint: disable=unused-argument
+    """Bumps the cached Orders of the customers of a changed Order once it commits"""
+    state = inspect(target)
+    customers = {target.customer_id, *state.attrs.customer_id.history.deleted}
+    order_cache.changed(state.session, {customer_scope(customer_id) for customer_id in customers})
+
+
+######################################################################
+# Item counts and totals of orders
+######################################################################
+# The item changes of a flush, by order_id: [count, amount], or None when
+# the totals must be counted again
+ORDER_TOTALS = "order_totals"
+
+
+def item_amount(quantity, price) -> Decimal:
+    """Returns what an item adds to the total of its order"""
+    return money.parse(price) * quantity
+
+
+def recompute_totals_statement(order_ids: list):
+    """Builds an UPDATE that counts the items of Orders again, returning the Orders that were wrong"""
+    orders, items = Orders.__table__, OrderItems.__table__
+    count = db.select(db.func.count()).where(items.c.order_id == orders.c.order_id).scalar_subquery()
+    total = (
+        db.select(db.func.coalesce(db.func.sum(items.c.quantity * items.c.price), 0))
+        .where(items.c.order_id == orders.c.order_id)
+        .scalar_subquery()
+    )
+    return (
+        orders.update()
+        .where(orders.c.order_id.in_(order_ids), db.or_(orders.c.item_count != count, orders.c.total_amount != total))
+        .values(item_count=count, total_amount=total)
+        .returning(orders.c.order_id, orders.c.customer_id)
+    )
+
+
+def change_totals(session, order_id, count: int = 0, amount: Decimal | None = None):
+    """Notes an item change of an Order, None for an amount that is not known"""
+    changes = session.info.setdefault(ORDER_TOTALS, {})
+    if amount is None or (order_id in changes and changes[order_id] is None):
+        changes[order_id] = None
+        return
+    change = changes.setdefault(order_id, [0, Decimal(0)])
+    change[0] += count
+    change[1] += amount
+
+
+@event.listens_for(OrderItems, "after_insert")
+def count_inserted_item(mapper, connection, target):  # pylint: disable=unused-argument
+    """Adds a new item to the totals of its Order"""
+    change_totals(inspect(target).session, target.order_id, 1, item_amount(target.quantity, target.price))
+
+
+@event.listens_for(OrderItems, "after_delete")
+def count_deleted_item(mapper, connection, target):  # pylint: disable=unused-argument
+    """Takes a deleted item out of the totals of its Order"""
+    change_totals(inspect(target).session, target.order_id, -1, -item_amount(target.quantity, target.price))
+
+
+@event.listens_for(OrderItems, "after_update")
+def count_updated_item(mapper, connection, target):  # pylint: disable=unused-argument
+    """Replaces the old values of a changed item in the totals of its Orders"""
+    state = inspect(target)
+    old = {}
+    for name in ("order_id", "quantity", "price"):
+        history = state.attrs[name].history
+        if history.has_changes() and not history.deleted:
+            # Changed before it was loaded, the old value is not known
+            change_totals(state.session, target.order_id)
+            return
+        old[name] = history.deleted[0] if history.deleted else getattr(target, name)
+    change_totals(state.session, old["order_id"], -1, -item_amount(old["quantity"], old["price"]))
+    change_totals(state.session, target.order_id, 1, item_amount(target.quantity, target.price))
+
+
+@event.listens_for(Session, "after_flush")
+def update_order_totals(session, flush_context):  # pylint: disable=unused-argument
+    """Applies the item changes of a flush to their Orders, in its transaction"""
+    changes = session.info.pop(ORDER_TOTALS, None)
+    if not changes:
+        return
+    orders = Orders.__table__
+    deleted = {order.order_id for order in session.deleted if isinstance(order, Orders)}
+    customers = set()
+    for order_id, change in changes.items():
+        if order_id in deleted or change == [0, 0]:
+            continue
+        if change is None:
+            statement = recompute_totals_statement([order_id])
+        else:
+            # Adding to the columns is safe against concurrent changes of the same Order
+            statement = (
+                orders.update()
+                .where(orders.c.order_id == order_id)
+                .values(item_count=orders.c.item_count + change[0], total_amount=orders.c.total_amount + change[1])
+                .returning(orders.c.order_id, orders.c.customer_id)
+            )
+        customers.update(row.customer_id for row in session.connection().execute(statement))
+    order_cache.changed(session, {customer_scope(customer_id) for customer_id in customers})
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_order_totals(session):
+    """Forgets the item changes of a flush that failed"""
+    session.info.pop(ORDER_TOTALS, None)
@@ -21,11 +21,19 @@ This service implements a REST API that allows you to Create, Read, Update
 and Delete Pets from the inventory of pets in the PetShop
 """
 
-from datetime import datetime
-from flask import jsonify, request, url_for
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from flask import Response, jsonify, request, url_for
 from flask import current_app as app  # Import Flask application
-from service.models import OrderItems, Orders
-from service.common import status, error_handlers  # HTTP Status Codes
+from werkzeug.exceptions import ServiceUnavailable
+from service.models import DataValidationError, OrderItems, Orders, db
+from service.common import money, profiler, status, error_handlers  # HTTP Status Codes
+from service.common.events import broker
+from service.common.lifecycle import lifecycle
+from service.common.sales import product_sales
+from service.common.single_flight import single_flight
+from service.common.tracing import tracer
 
 # pylint: disable="broad-exception-caught
 
@@ -65,6 +73,14 @@ def health():
         )
 
 
+@app.route("/readyz")
+def readyz():
+    """Readiness probe, fails once the worker is shutting down"""
+    if lifecycle.draining:
+        return {"status": "draining"}, status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready"}, status.HTTP_200_OK
+
+
 @app.route("/ui")
 def admin_ui():
     """Root URL response"""
@@ -77,6 +93,7 @@ def admin_ui():
 
 
 @app.route("/orders", methods=["POST"])
+@profiler.profiled
 def create_order():
     """Create a new order.
 
@@ -164,6 +181,34 @@ def get_items_in_order(order_id):
     return response
 
 
+@app.route("/orders/<int:order_id>/items", methods=["PATCH"])
+def update_items_in_order(order_id):
+    """
+    Add, update and remove many items of an order at once.
+
+    Args:
+        order_id (int): The ID of the order.
+
+    Body:
+        list: Operations like {"op": "add", "product_id": 1, "quantity": 2, "price": 9.99},
+            {"op": "update", "order_item_id": 3, "quantity": 1} or {"op": "remove", "order_item_id": 4},
+            applied in one transaction.
+
+    Returns:
+        list: The serialized items of the order, or an error message if not found.
+
+    """
+    order = Orders.find(order_id)
+    if not order:
+        return error_handlers.not_found("Order not found")
+    if order.archived:
+        return error_handlers.resource_conflict("Archived orders cannot be changed")
+    items = OrderItems.apply_batch(order_id, request.get_json())
+    response = jsonify([item.serialize() for item in items])
+    response.status_code = status.HTTP_200_OK
+    return response
+
+
 @app.route("/orders/<int:order_id>", methods=["GET"])
 def get_order(order_id):
     """
@@ -176,34 +221,81 @@ def get_order(order_id):
         dict: A dictionary containing the serialized order if found, or an error message if not found.
 
     """
-    order = Orders.find(order_id)
-    if not order:
+
+    def load():
+        order = Orders.find(order_id)
+        return order.serialize() if order else None
+
+    # Clients that poll the same order at once share one query
+    result = single_flight.do(("order", order_id), load)
+    if result is None:
         return error_handlers.not_found("Order not found")
-    response = jsonify(order.serialize())
+    response = jsonify(result)
     response.status_code = 200
     return response
 
 
+def money_arg(name):
+    """Parses an amount of money from the query string"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return money.parse(value)
+    except ValueError as error:
+        raise DataValidationError(f"Invalid {name}: {error}") from error
+
+
+def datetime_arg(name):
+    """Parses a date and time from the query string"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError as error:
+        raise DataValidationError(f"Invalid {name}: {error}") from error
+
+
 @app.route("/orders", methods=["GET"])
+@profiler.profiled
 def list_orders():
-    """Returns all of the Orders"""
+    """Returns all of the Orders, or a page of them sorted with ?sort= and ?page_token="""
     app.logger.info("Request to list Orders...")
+    # Identical queries that arrive together share one query and its results
+    key = ("orders", tuple(sorted(request.args.items(multi=True))))
+    next_token = None
+    if {"sort", "page_token", "total_min", "total_max"} & request.args.keys():
+        results, next_token = single_flight.do(key, find_sorted_orders)
+    else:
+        results = single_flight.do(key, find_orders)
+    app.logger.info("[%s] Orders returned", len(results))
+    with tracer.span("jsonify"):
+        response = jsonify(results)
+    response.status_code = status.HTTP_200_OK
+    if next_token is not None:
+        next_url = url_for("list_orders", **{**request.args.to_dict(), "page_token": next_token})
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
 
+def find_orders() -> list:
+    """Returns the serialized Orders that match the query string"""
     orders = []
 
     # Parse any arguments from the query string
     customer_id = request.args.get("customer_id", type=int)
-    order_date = request.args.get("order_date")
+    order_date = datetime_arg("order_date")
     order_status = request.args.get("status")
     tracking_number = request.args.get("tracking_number")
-    discount_amount = request.args.get("discount_amount", type=float)
+    discount_amount = money_arg("discount_amount")
+    discount_min = money_arg("discount_min")
+    discount_max = money_arg("discount_max")
 
     if customer_id is not None:
-        app.logger.info("Find by customer_id: %s", customer_id)
-        orders = Orders.find_by_customer_id(customer_id)
-    elif order_date is not None:
+        return find_customer_orders(customer_id)
+    if order_date is not None:
         app.logger.info("Find by order_date: %s", order_date)
-        order_date: datetime = datetime.fromisoformat(order_date)
         orders = Orders.find_by_order_date(order_date)
     elif order_status is not None:
         app.logger.info("Find by status %s", order_status)
@@ -214,13 +306,73 @@ def list_orders():
     elif discount_amount is not None:
         app.logger.info("Find by discount_amount: %s", discount_amount)
         orders = Orders.find_by_discount_amount(discount_amount)
+    elif discount_min is not None or discount_max is not None:
+        app.logger.info("Find by discount_amount range: %s - %s", discount_min, discount_max)
+        orders = Orders.find_by_discount_range(discount_min, discount_max)
     else:
         app.logger.info("Find all")
         orders = Orders.list_all()
 
-    results = [order.serialize() for order in orders]
-    app.logger.info("[%s] Orders returned", len(results))
-    response = jsonify(results)
+    with tracer.span("Orders.serialize", count=len(orders)):
+        return [order.serialize() for order in orders]
+
+
+def find_sorted_orders() -> tuple:
+    """Returns a page of the serialized Orders in the order of ?sort= and the token of the next page"""
+    criteria = {
+        "customer_id": request.args.get("customer_id", type=int),
+        "order_date": datetime_arg("order_date"),
+        "status": request.args.get("status", type=str.lower),
+        "tracking_number": request.args.get("tracking_number"),
+        "discount_amount": money_arg("discount_amount"),
+    }
+    criteria = {name: value for name, value in criteria.items() if value is not None}
+    per_page = min(max(request.args.get("per_page", 20, type=int), 1), 100)
+    orders, next_token = Orders.find_sorted(
+        criteria,
+        request.args.get("sort"),
+        per_page,
+        request.args.get("page_token"),
+        (money_arg("total_min"), money_arg("total_max")),
+    )
+    with tracer.span("Orders.serialize", count=len(orders)):
+        return [order.serialize() for order in orders], next_token
+
+
+def find_customer_orders(customer_id: int) -> list:
+    """Returns the serialized Orders of a customer, a page of them with ?page=&per_page="""
+    app.logger.info("Find by customer_id: %s", customer_id)
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = request.args.get("per_page", type=int)
+    if per_page is not None:
+        per_page = min(max(per_page, 1), 100)
+    return Orders.find_serialized_by_customer_id(customer_id, page, per_page)
+
+
+@app.route("/orders/search", methods=["GET"])
+def search_orders():
+    """
+    Search orders by a full or partial tracking number.
+
+    Query Args:
+        tracking_number (str): The tracking number or a part of it.
+        mode (str): 'prefix' (default) to match the start, 'fuzzy' for substrings and typos.
+        page (int): The 1-based page of results, 1 by default.
+        per_page (int): The number of results in a page, 20 by default and at most 100.
+
+    Returns:
+        list: The serialized matching orders, best match first.
+
+    """
+    tracking_number = request.args.get("tracking_number")
+    mode = request.args.get("mode", "prefix")
+    page = request.args.get("page", 1, type=int)
+    per_page = min(request.args.get("per_page", 20, type=int), 100)
+    if not tracking_number:
+        return error_handlers.bad_request("tracking_number is required to search orders")
+    app.logger.info("Search %s tracking_number: %s", mode, tracking_number)
+    orders = Orders.search_by_tracking_number(tracking_number, mode, page, per_page)
+    response = jsonify([order.serialize() for order in orders])
     response.status_code = status.HTTP_200_OK
     return response
 
@@ -245,6 +397,35 @@ def update_order(order_id):
     return response
 
 
+@app.route("/orders/<int:order_id>", methods=["PATCH"])
+def patch_order(order_id):
+    """
+    Change some fields of an order with a JSON merge patch (RFC 7396).
+
+    Args:
+        order_id (int): The ID of the order.
+
+    Body:
+        dict: The fields to change, null removes an optional field.
+
+    Returns:
+        dict: A dictionary containing the serialized order if found, or an error message if not found.
+
+    """
+    if request.mimetype not in ("application/merge-patch+json", "application/json"):
+        return error_handlers.mediatype_not_supported(
+            "Content-Type must be application/merge-patch+json or application/json"
+        )
+    order = Orders.merge_patch(order_id, request.get_json())
+    if not order:
+        if Orders.find(order_id):
+            return error_handlers.resource_conflict("Archived orders cannot be changed")
+        return error_handlers.not_found("Order not found")
+    response = jsonify(order.serialize())
+    response.status_code = status.HTTP_200_OK
+    return response
+
+
 @app.route("/orders/<int:order_id>", methods=["DELETE"])
 def delete_order(order_id):
     """
@@ -319,13 +500,265 @@ def ship_order(order_id):
     order = Orders.find(order_id)
     if not order:
         return error_handlers.not_found("Order not found")
+    if order.archived:
+        return error_handlers.resource_conflict("Archived orders cannot be shipped")
     tracking_number = request.json.get("tracking_number", None)
     if tracking_number is None:
         return error_handlers.bad_request("Tracking number is required to ship an order")
+    # Only the shipping fields are written, the item totals stay as the items keep them
     order.status = "shipped"
     order.tracking_number = tracking_number
-    updated_json = order.serialize()
-    order = Orders.update_order(order_id, updated_json)
+    order.update()
     response = jsonify(order.serialize())
     response.status_code = 200
     return response
+
+
+@app.route("/orders/<int:order_id>/history", methods=["GET"])
+def get_order_status_history(order_id):
+    """
+    Retrieve the status changes of an order.
+
+    Args:
+        order_id (int): The ID of the order.
+
+    Returns:
+        list: The status changes of the order, oldest first, or an error message if not found.
+
+    """
+    order = Orders.find(order_id)
+    if not order:
+        return error_handlers.not_found("Order not found")
+    response = jsonify(Orders.find_status_history(order_id))
+    response.status_code = status.HTTP_200_OK
+    return response
+
+
+def bulk_tracking_numbers(tracking_numbers) -> dict:
+    """Parses the tracking numbers of a bulk status change by order ID"""
+    if not isinstance(tracking_numbers, dict) or not all(isinstance(value, str) for value in tracking_numbers.values()):
+        raise DataValidationError("tracking_numbers must map order IDs to tracking numbers")
+    try:
+        return {int(key): value for key, value in tracking_numbers.items()}
+    except ValueError as error:
+        raise DataValidationError(f"Invalid order ID in tracking_numbers: {error}") from error
+
+
+@app.route("/orders/bulk-status", methods=["POST"])
+def bulk_update_status():
+    """
+    Move many orders to a new status at once.
+
+    Body:
+        status (str): The status to move the orders to.
+        order_ids (list): The IDs of the orders, or
+        filter (dict): a customer_id and/or status the orders must have.
+        tracking_numbers (dict): Optional tracking numbers by order ID.
+
+    Returns:
+        dict: The IDs that were updated, rejected by the status rules and not found.
+
+    """
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return error_handlers.bad_request("The body must be a JSON object")
+    try:
+        order_ids = data.get("order_ids")
+        if order_ids is None:
+            order_ids = Orders.find_ids_by_filter(data.get("filter") or {})
+        if not isinstance(order_ids, list) or not all(isinstance(order_id, int) for order_id in order_ids):
+            raise DataValidationError("order_ids must be a list of order IDs")
+        tracking_numbers = bulk_tracking_numbers(data.get("tracking_numbers") or {})
+        result = Orders.bulk_update_status(order_ids, data.get("status"), tracking_numbers)
+    except (DataValidationError, ValueError) as e:
+        return error_handlers.bad_request(e)
+    app.logger.info("[%s] Orders moved to %s", len(result["updated"]), result["status"])
+    response = jsonify(result)
+    response.status_code = status.HTTP_200_OK
+    return response
+
+
+######################################################################
+#  P R O D U C T   S A L E S
+######################################################################
+
+
+def sales_range() -> tuple:
+    """Parses the days from ?since= until the day before ?until=, the last 7 days by default"""
+    today = datetime.utcnow().date()
+    try:
+        since = date.fromisoformat(request.args.get("since", (today - timedelta(days=6)).isoformat()))
+        until = date.fromisoformat(request.args.get("until", (today + timedelta(days=1)).isoformat()))
+    except ValueError as error:
+        raise DataValidationError(f"Invalid date: {error}") from error
+    if since >= until:
+        raise DataValidationError("since must be before until")
+    return since, until
+
+
+@app.route("/products/<int:product_id>/sales", methods=["GET"])
+def get_product_sales(product_id):
+    """
+    Retrieve the units sold and revenue of a product.
+
+    Args:
+        product_id (int): The ID of the product.
+
+    Query Args:
+        since (str): The first day, as YYYY-MM-DD, 6 days ago by default.
+        until (str): The day after the last day, tomorrow by default.
+
+    Returns:
+        dict: The totals of the product and its sales on each day it sold.
+
+    """
+    since, until = sales_range()
+    app.logger.info("Sales of product %s from %s until %s", product_id, since, until)
+    rows = product_sales.daily(product_id, since, until)
+    response = jsonify(
+        {
+            "product_id": product_id,
+            "since": since.isoformat(),
+            "until": until.isoformat(),
+            "quantity": sum(int(quantity) for _, quantity, _ in rows),
+            "revenue": money.serialize(sum((revenue for _, _, revenue in rows), Decimal(0))),
+            "days": [
+                {"day": day.isoformat(), "quantity": int(quantity), "revenue": money.serialize(revenue)}
+                for day, quantity, revenue in rows
+            ],
+        }
+    )
+    response.status_code = status.HTTP_200_OK
+    return response
+
+
+@app.route("/products/top", methods=["GET"])
+def list_top_products():
+    """
+    List the products that sold the most.
+
+    Query Args:
+        since (str): The first day, as YYYY-MM-DD, 6 days ago by default.
+        until (str): The day after the last day, tomorrow by default.
+        by (str): 'quantity' (default) to rank by units sold or 'revenue'.
+        limit (int): The number of products, 10 by default and at most 100.
+
+    Returns:
+        list: The product IDs with their units sold and revenue, best first.
+
+    """
+    since, until = sales_range()
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
+    by = request.args.get("by", "quantity")
+    app.logger.info("Top %s products by %s from %s until %s", limit, by, since, until)
+
+    def load():
+        try:
+            rows = product_sales.top(since, until, limit, by)
+        except ValueError as error:
+            raise DataValidationError(str(error)) from error
+        return [
+            {"product_id": product_id, "quantity": int(quantity), "revenue": money.serialize(revenue)}
+            for product_id, quantity, revenue in rows
+        ]
+
+    # Dashboards that refresh together share one aggregate query
+    response = jsonify(single_flight.do(("top products", since, until, limit, by), load))
+    response.status_code = status.HTTP_200_OK
+    return response
+
+
+######################################################################
+#  S E R V E R - S E N T   E V E N T S
+######################################################################
+
+
+def event_stream(order_id=None):
+    """Streams order status transitions to the client as Server-Sent Events
+
+    Each stream holds a worker thread, so a worker only serves
+    SSE_MAX_STREAMS of them and keeps its other threads for the API
+    """
+    subscription = broker.subscribe(db.engine, order_id, app.config["SSE_MAX_STREAMS"])
+    if subscription is None:
+        raise ServiceUnavailable("Too many event streams, retry later", retry_after=app.config["SSE_RETRY_AFTER"])
+    heartbeat = app.config["SSE_HEARTBEAT_SECONDS"]
+
+    def generate():
+        try:
+            yield ": connected\n\n"
+            # Clients reconnect to another worker when a stream ends
+            while not lifecycle.draining:
+                payload = subscription.get(heartbeat)
+                if payload is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(
+        generate(),
+        status=status.HTTP_200_OK,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/orders/events", methods=["GET"])
+def stream_order_events():
+    """
+    Stream status transitions of all orders.
+
+    Returns:
+        A text/event-stream response with one event per status transition.
+
+    """
+    return event_stream()
+
+
+@app.route("/orders/<int:order_id>/events", methods=["GET"])
+def stream_events_for_order(order_id):
+    """
+    Stream status transitions of a single order.
+
+    Args:
+        order_id (int): The ID of the order.
+
+    Returns:
+        A text/event-stream response, or an error message if the order is not found.
+
+    """
+    if not Orders.find(order_id):
+        return error_handlers.not_found("Order not found")
+    return event_stream(order_id)
+
+
+######################################################################
+#  A D M I N
+######################################################################
+
+
+@app.route("/admin/profile", methods=["GET"])
+def profile_worker():
+    """
+    Sample the stacks of the other threads of this worker.
+
+    Query Args:
+        seconds (float): How long to sample, 10 by default and at most 60.
+
+    Returns:
+        text: The sampled stacks in the collapsed format of flamegraph.pl.
+
+    """
+    allowed = profiler.authorized()
+    if allowed is None:
+        return error_handlers.not_found("Profiling is not enabled")
+    if not allowed:
+        return error_handlers.unauthorized("A valid admin token is required to profile the worker")
+    seconds = request.args.get("seconds", 10, type=float)
+    app.logger.info("Profiling worker for %s seconds", seconds)
+    stacks = profiler.profile_worker(seconds)
+    if stacks is None:
+        return error_handlers.resource_conflict("The worker is already being profiled")
+    return Response(stacks, mimetype="text/plain")
@@ -0,0 +1,47 @@
+"""
+Test cases for the Order Archive
+"""
+
+import os
+import gzip
+import tempfile
+from unittest import TestCase
+from service.common.archive import OrderArchive
+
+
+class TestOrderArchive(TestCase):
+    """TestOrderArchive"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.archive = OrderArchive(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_disabled(self):
+        """test_disabled"""
+        archive = OrderArchive()
+        self.assertFalse(archive.enabled)
+        self.assertIsNone(archive.find(1))
+
+    def test_write_and_find(self):
+        """test_write_and_find"""
+        self.assertIsNone(self.archive.find(1))
+        name = self.archive.write_batch([{"order_id": 1, "order_items": []}, {"order_id": 7, "order_items": []}])
+        self.assertEqual(name, "orders-0000000001-0000000007.ndjson.gz")
+        with gzip.open(os.path.join(self.folder.name, name), "rt") as batch:
+            self.assertEqual(len(batch.readlines()), 2)
+        self.assertEqual(self.archive.find(7), {"order_id": 7, "order_items": []})
+        self.assertIsNone(self.archive.find(2))
+        self.assertEqual(sorted(os.listdir(self.folder.name))[0], "index.sqlite")
+
+    def test_archive_again(self):
+        """test_archive_again"""
+        self.archive.write_batch([{"order_id": 1, "status": "cancelled"}])
+        self.archive.write_batch([{"order_id": 0, "status": "delivered"}, {"order_id": 1, "status": "delivered"}])
+        self.assertEqual(self.archive.find(1)["status"], "delivered")
+        # Another folder has another index
+        with tempfile.TemporaryDirectory() as folder:
+            self.archive.path = folder
+            self.assertIsNone(self.archive.find(1))
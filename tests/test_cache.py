@@ -0,0 +1,163 @@
+"""
+Test cases for the Versioned Cache
+"""
+
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from service.common.cache import CHANGED_SCOPES, LocalCache, RedisCache, VersionedCache
+
+
+class FakeRedis:
+    """The part of a redis.Redis client that RedisCache uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        """Returns the bytes of a key"""
+        return self.data.get(key)
+
+    def set(self, key, value, px=None):  # pylint: disable=unused-argument
+        """Sets a key"""
+        self.data[key] = value.encode()
+
+    def incr(self, key):
+        """Adds one to a key"""
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+
+class TestCache(TestCase):
+    """TestCache"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(ORDER_CACHE_TTL=10, ORDER_CACHE_STALE=20, ORDER_CACHE_SIZE=2)
+        # A LocalCache stands in for the shared cache
+        self.cache = VersionedCache(LocalCache())
+        self.cache.init_app(self.app)
+        self.loads = []
+
+    def loader(self, value):
+        """Returns a loader that records its calls"""
+
+        def load():
+            self.loads.append(value)
+            return value
+
+        return load
+
+    def test_local_cache(self):
+        """test_local_cache"""
+        cache = LocalCache(max_keys=2)
+        with patch("service.common.cache.time.time", return_value=100.0):
+            cache.set("a", 1, 10)
+            cache.set("b", 2)
+        self.assertEqual(cache.get("b"), 2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.incr("c"), cache.incr("c")), (1, 2))
+        # Expired keys make room for new ones
+        cache.set("d", 4)
+        self.assertEqual(sorted(cache._values), ["b", "c", "d"])  # pylint: disable=protected-access
+
+    def test_versions(self):
+        """test_versions"""
+        self.assertEqual(self.cache.get("customer:1", "page", self.loader("v0")), "v0")
+        self.assertEqual(self.cache.get("customer:1", "page", self.loader("v0 again")), "v0")
+        self.cache.bump(["customer:1"])
+        self.assertEqual(self.cache.get("customer:1", "page", self.loader("v1")), "v1")
+        self.assertEqual(self.loads, ["v0", "v1"])
+
+        # A process that lost its LRU entries finds them in the shared cache
+        self.cache._local.clear()  # pylint: disable=protected-access
+        self.assertEqual(self.cache.get("customer:1", "page", self.loader("v1 again")), "v1")
+        self.assertEqual(len(self.cache._local), 1)  # pylint: disable=protected-access
+
+        self.app.config["ORDER_CACHE_TTL"] = 0
+        self.cache.init_app(self.app)
+        self.assertFalse(self.cache.enabled)
+        self.assertEqual(self.cache.get("customer:1", "page", self.loader("off")), "off")
+
+    def test_process_only(self):
+        """test_process_only"""
+        cache = VersionedCache()
+        cache.init_app(self.app)
+        self.assertIsNone(cache.shared)
+        self.assertEqual(cache.get("customer:1", "page", self.loader("v0")), "v0")
+        self.assertEqual(cache.get("customer:1", "page", self.loader("v0 again")), "v0")
+        cache.bump(["customer:1"])
+        self.assertEqual(cache.get("customer:1", "page", self.loader("v1")), "v1")
+        # Nothing is kept outside of the LRU
+        cache._local.clear()  # pylint: disable=protected-access
+        self.assertEqual(cache.get("customer:1", "page", self.loader("v1 again")), "v1 again")
+
+    def test_redis_cache(self):
+        """test_redis_cache"""
+        shared = RedisCache(FakeRedis())
+        shared.set("key", (1.5, [{"order_id": 1}]), 10)
+        self.assertEqual(shared.get("key"), [1.5, [{"order_id": 1}]])
+        self.assertIsNone(shared.get("missing"))
+        self.assertEqual((shared.incr("customer:1:version"), shared.incr("customer:1:version")), (1, 2))
+        self.assertEqual(shared.get("customer:1:version"), 2)
+
+        cache = VersionedCache()
+        cache.init_app(self.app, shared)
+        self.assertEqual(cache.get("customer:1", "page", self.loader(["v2"])), ["v2"])
+        cache._local.clear()  # pylint: disable=protected-access
+        self.assertEqual(cache.get("customer:1", "page", self.loader(["v2 again"])), ["v2"])
+
+        # An outage of Redis only costs the cache
+        broken = RedisCache(MagicMock(**{"get.side_effect": OSError, "set.side_effect": OSError, "incr.side_effect": OSError}))
+        with self.assertLogs("flask.app", "WARNING"):
+            self.assertIsNone(broken.get("key"))
+            broken.set("key", 1)
+            self.assertIsNone(broken.incr("key"))
+
+    def test_cache_url(self):
+        """test_cache_url"""
+        self.app.config["CACHE_URL"] = "redis://cache:6379/0"
+        with patch("service.common.cache.redis") as redis_mock:
+            cache = VersionedCache()
+            cache.init_app(self.app)
+            self.assertIsInstance(cache.shared, RedisCache)
+            redis_mock.Redis.from_url.assert_called_once_with("redis://cache:6379/0")
+        with patch("service.common.cache.redis", None), self.assertLogs("flask.app", "ERROR"):
+            cache = VersionedCache()
+            cache.init_app(self.app)
+            self.assertIsNone(cache.shared)
+
+    def test_lru(self):
+        """test_lru"""
+        for name in ("a", "b", "a", "c"):
+            self.cache.get("customer:1", name, self.loader(name))
+        self.assertEqual(list(self.cache._local), ["customer:1:v0:a", "customer:1:v0:c"])  # pylint: disable=W0212
+
+    def test_stale_while_revalidate(self):
+        """test_stale_while_revalidate"""
+        with patch("service.common.cache.time.time", return_value=100.0):
+            self.cache.get("customer:1", "page", self.loader("old"))
+        with patch("service.common.cache.time.time", return_value=115.0):
+            self.assertEqual(self.cache.get("customer:1", "page", self.loader("new")), "old")
+            for thread in list(self.cache._refreshing.values()):  # pylint: disable=protected-access
+                thread.join()
+            self.assertEqual(self.cache.get("customer:1", "page", self.loader("newer")), "new")
+        # Too old to be served at all
+        with patch("service.common.cache.time.time", return_value=10**10):
+            self.assertEqual(self.cache.get("customer:1", "page", self.loader("newest")), "newest")
+
+        def fail():
+            raise ValueError("database is down")
+
+        with self.assertLogs("flask.app", "WARNING"):
+            self.cache._refresh("customer:1:v0:page", fail)  # pylint: disable=protected-access
+
+    def test_changed(self):
+        """test_changed"""
+        session = MagicMock(info={})
+        self.cache.changed(session, {"customer:1"})
+        self.cache.after_rollback(session)
+        self.assertNotIn(CHANGED_SCOPES, session.info)
+        self.cache.changed(session, {"customer:1", "customer:2"})
+        self.cache.after_commit(session)
+        self.assertEqual(self.cache.shared.get("customer:2:version"), 1)
@@ -7,7 +7,9 @@ from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.common.cli_commands import (  # noqa: E402
+    db_create, db_partition, db_upgrade, orders_archive, orders_recompute_totals, sales_rollup
+)
 
 
 class TestFlaskCLI(TestCase):
@@ -23,3 +25,72 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.migrations.upgrade')
+    def test_db_upgrade(self, upgrade_mock):
+        """test_db_upgrade"""
+        upgrade_mock.return_value = [(1, "Do something")]
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(db_upgrade)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Applied schema version 1: Do something", result.output)
+
+    @patch('service.common.cli_commands.db')
+    @patch('service.common.cli_commands.partitions.is_partitioned')
+    @patch('service.common.cli_commands.partitions.partition_tables')
+    @patch('service.common.cli_commands.partitions.create_partitions')
+    @patch('service.common.cli_commands.partitions.detach_partitions')
+    def test_db_partition(self, detach_mock, create_mock, partition_mock, is_partitioned_mock, _):
+        """test_db_partition"""
+        create_mock.return_value = ["orders_p2024_05"]
+        detach_mock.return_value = ["orders_p2022_04"]
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            is_partitioned_mock.return_value = False
+            result = self.runner.invoke(db_partition)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("not partitioned", result.output)
+
+            result = self.runner.invoke(db_partition, ["--init"])
+            self.assertEqual(result.exit_code, 0)
+            partition_mock.assert_called_once()
+            self.assertIn("Created partition orders_p2024_05", result.output)
+            detach_mock.assert_not_called()
+
+            is_partitioned_mock.return_value = True
+            result = self.runner.invoke(db_partition, ["--retain-months", "24"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Detached partition orders_p2022_04", result.output)
+
+    @patch('service.common.cli_commands.Orders.archive')
+    def test_orders_archive(self, archive_mock):
+        """test_orders_archive"""
+        archive_mock.return_value = 5
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            with patch('service.common.cli_commands.order_archive.path', None):
+                result = self.runner.invoke(orders_archive)
+                self.assertEqual(result.exit_code, 1)
+            with patch('service.common.cli_commands.order_archive.path', "/tmp/archive"):
+                result = self.runner.invoke(orders_archive, ["--days", "30", "--batch-size", "10"])
+                self.assertEqual(result.exit_code, 0)
+                self.assertIn("Archived 5 orders to /tmp/archive", result.output)
+                self.assertEqual(archive_mock.call_args.args[1], 10)
+
+    @patch('service.common.cli_commands.Orders.recompute_totals')
+    def test_orders_recompute_totals(self, recompute_mock):
+        """test_orders_recompute_totals"""
+        recompute_mock.return_value = 2
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(orders_recompute_totals, ["--batch-size", "10"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Repaired the totals of 2 orders", result.output)
+            recompute_mock.assert_called_once_with(10)
+
+    @patch('service.common.cli_commands.product_sales.refresh')
+    def test_sales_rollup(self, refresh_mock):
+        """test_sales_rollup"""
+        refresh_mock.return_value = 4
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(sales_rollup, ["--days", "2"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Rolled up the sales of 4 days", result.output)
+            refresh_mock.assert_called_once_with(2)
@@ -0,0 +1,54 @@
+"""
+Test cases for Response Compression
+"""
+
+import gzip
+from unittest import TestCase
+from flask import Flask, Response, jsonify
+from service.common.compression import Compressor
+
+
+class TestCompression(TestCase):
+    """TestCompression"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(COMPRESSION_MIN_SIZE=100, COMPRESSION_GZIP_LEVEL=6)
+        Compressor().init_app(self.app)
+
+        @self.app.route("/json/<int:size>")
+        def json_list(size):
+            return jsonify([{"order_id": number} for number in range(size)])
+
+        @self.app.route("/stream/<mimetype>")
+        def stream(mimetype):
+            return Response((f"line {number}\n" for number in range(100)), mimetype=mimetype.replace("-", "/"))
+
+        self.client = self.app.test_client()
+
+    def test_compress_large_json(self):
+        """test_compress_large_json"""
+        resp = self.client.get("/json/100", headers={"Accept-Encoding": "br;q=0.5, gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.data))
+        self.assertEqual(gzip.decompress(resp.data), self.client.get("/json/100").data)
+
+    def test_not_compressed(self):
+        """test_not_compressed"""
+        resp = self.client.get("/json/1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.headers["Vary"], "Accept-Encoding")
+        resp = self.client.get("/json/100")
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = self.client.get("/json/100", headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_streamed(self):
+        """test_streamed"""
+        resp = self.client.get("/stream/text-plain", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        self.assertEqual(gzip.decompress(resp.data).decode().count("\n"), 100)
+        resp = self.client.get("/stream/text-event-stream", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
@@ -0,0 +1,58 @@
+"""
+Test cases for the Order Events broker
+"""
+
+from unittest import TestCase
+from unittest.mock import MagicMock
+from service.common.events import EventBroker, Subscription, PENDING_EVENTS
+
+
+class TestEventBroker(TestCase):
+    """TestEventBroker"""
+
+    def setUp(self):
+        self.broker = EventBroker()
+        self.engine = MagicMock()
+        self.engine.dialect.name = "sqlite"
+        self.session = MagicMock()
+        self.session.info = {}
+        self.session.get_bind.return_value = self.engine
+
+    def test_publish_after_commit(self):
+        """test_publish_after_commit"""
+        subscription = self.broker.subscribe(self.engine)
+        self.broker.publish(self.session, [{"order_id": 1, "status": "shipped"}])
+        self.assertIsNone(subscription.get(0))
+        self.broker.after_commit(self.session)
+        self.assertEqual(subscription.get(0), {"order_id": 1, "status": "shipped"})
+        self.assertNotIn(PENDING_EVENTS, self.session.info)
+        self.session.execute.assert_not_called()
+
+    def test_publish_nothing(self):
+        """test_publish_nothing"""
+        self.broker.publish(self.session, [])
+        self.assertNotIn(PENDING_EVENTS, self.session.info)
+
+    def test_discard_after_rollback(self):
+        """test_discard_after_rollback"""
+        subscription = self.broker.subscribe(self.engine)
+        self.broker.publish(self.session, [{"order_id": 1, "status": "shipped"}])
+        self.broker.after_rollback(self.session)
+        self.broker.after_commit(self.session)
+        self.assertIsNone(subscription.get(0))
+
+    def test_unsubscribe(self):
+        """test_unsubscribe"""
+        subscription = self.broker.subscribe(self.engine)
+        self.broker.unsubscribe(subscription)
+        self.broker.dispatch({"order_id": 1, "status": "shipped"})
+        self.assertIsNone(subscription.get(0))
+
+    def test_slow_subscriber(self):
+        """test_slow_subscriber"""
+        subscription = Subscription(order_id=1, maxsize=1)
+        subscription.deliver({"order_id": 2, "status": "shipped"})
+        subscription.deliver({"order_id": 1, "status": "shipped"})
+        subscription.deliver({"order_id": 1, "status": "delivered"})
+        self.assertEqual(subscription.get(0)["status"], "shipped")
+        self.assertIsNone(subscription.get(0))
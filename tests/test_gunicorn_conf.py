@@ -0,0 +1,67 @@
+"""
+Test cases for the Gunicorn Configuration
+"""
+
+import os
+import runpy
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from wsgi import app
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+class TestGunicornConf(TestCase):
+    """TestGunicornConf"""
+
+    def setUp(self):
+        self.config = runpy.run_path(CONFIG_FILE)
+        self.cgroup = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.cgroup.cleanup)
+
+    def write(self, name: str, value: str):
+        """Writes a file of the fake cgroup folder"""
+        path = os.path.join(self.cgroup.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="ascii") as cgroup_file:
+            cgroup_file.write(value)
+
+    def test_cpu_limit(self):
+        """test_cpu_limit"""
+        cpu_limit = self.config["cpu_limit"]
+        with patch("os.sched_getaffinity", return_value={0, 1, 2, 3}):
+            self.assertEqual(cpu_limit(self.cgroup.name), 4)
+            # cgroup v1
+            self.write("cpu/cpu.cfs_quota_us", "150000")
+            self.write("cpu/cpu.cfs_period_us", "100000")
+            self.assertEqual(cpu_limit(self.cgroup.name), 1.5)
+            # cgroup v2 without and with a quota
+            self.write("cpu.max", "max 100000")
+            self.assertEqual(cpu_limit(self.cgroup.name), 4)
+            self.write("cpu.max", "50000 100000")
+            self.assertEqual(cpu_limit(self.cgroup.name), 0.5)
+        self.assertEqual(self.config["default_workers"](0.5), 1)
+        self.assertEqual(self.config["default_workers"](1.5), 3)
+
+    def test_settings(self):
+        """test_settings"""
+        self.assertEqual(self.config["worker_class"], "gthread")
+        self.assertGreaterEqual(self.config["workers"], 1)
+        self.assertFalse(self.config["preload_app"])
+        with patch.dict(os.environ, {"GUNICORN_WORKERS": "3", "GUNICORN_WORKER_CLASS": "gevent"}):
+            config = runpy.run_path(CONFIG_FILE)
+        self.assertEqual((config["workers"], config["worker_class"]), (3, "gevent"))
+
+    def test_post_fork(self):
+        """test_post_fork"""
+        server, worker = MagicMock(), MagicMock()
+        worker.app.wsgi.return_value = app
+        server.cfg.preload_app = False
+        self.config["post_fork"](server, worker)
+        worker.app.wsgi.assert_not_called()
+
+        server.cfg.preload_app = True
+        with patch("service.models.db") as db_mock:
+            self.config["post_fork"](server, worker)
+        db_mock.engine.dispose.assert_called_once_with(close=False)
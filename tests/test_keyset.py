@@ -0,0 +1,90 @@
+"""
+Test cases for Keyset Pagination
+"""
+
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase
+from sqlalchemy import Column, DateTime, Integer, MetaData, Numeric, Table
+from sqlalchemy.dialects import postgresql
+from service.common import keyset
+
+orders = Table(
+    "orders",
+    MetaData(),
+    Column("order_id", Integer, primary_key=True),
+    Column("order_date", DateTime),
+    Column("discount_amount", Numeric(12, 2)),
+)
+COLUMNS = {name: orders.c[name] for name in ("order_id", "order_date", "discount_amount")}
+
+
+def sql(clause) -> str:
+    """Returns the SQL of a clause with its values inlined"""
+    return str(clause.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+class TestKeyset(TestCase):
+    """TestKeyset"""
+
+    def test_parse_sort(self):
+        """test_parse_sort"""
+        order = keyset.parse_sort("-order_date", COLUMNS, "order_id")
+        self.assertEqual(keyset.sort_string(order), "-order_date,-order_id")
+        order = keyset.parse_sort(" order_date , -discount_amount,order_date", COLUMNS, "order_id")
+        self.assertEqual(keyset.sort_string(order), "order_date,-discount_amount,-order_id")
+        order = keyset.parse_sort("order_id,order_date", COLUMNS, "order_id")
+        self.assertEqual(keyset.sort_string(order), "order_id,order_date")
+        self.assertEqual(keyset.sort_string(keyset.parse_sort(None, COLUMNS, "order_id")), "order_id")
+        self.assertEqual(
+            [sql(clause) for clause in keyset.order_by(order)], ["orders.order_id ASC", "orders.order_date ASC NULLS LAST"]
+        )
+        for value in ("tracking_number", "order_date,", "-"):
+            self.assertRaises(ValueError, keyset.parse_sort, value, COLUMNS, "order_id")
+
+    def test_after(self):
+        """test_after"""
+        order = keyset.parse_sort("-order_date", COLUMNS, "order_id")
+        self.assertEqual(
+            sql(keyset.after(order, [datetime(2024, 1, 2), 7])),
+            "(orders.order_date, orders.order_id) < ('2024-01-02 00:00:00', 7)",
+        )
+        order = keyset.parse_sort("order_date,-discount_amount", COLUMNS, "order_id")
+        self.assertEqual(
+            sql(keyset.after(order, [datetime(2024, 1, 2), Decimal("1.50"), 7])),
+            "orders.order_date > '2024-01-02 00:00:00' OR orders.order_date IS NULL "
+            "OR orders.order_date = '2024-01-02 00:00:00' AND orders.discount_amount < 1.50 "
+            "OR orders.order_date = '2024-01-02 00:00:00' AND orders.discount_amount = 1.50 AND orders.order_id < 7",
+        )
+
+    def test_after_nulls(self):
+        """test_after_nulls"""
+        order = keyset.parse_sort("order_date", COLUMNS, "order_id")
+        self.assertEqual(
+            sql(keyset.after(order, [datetime(2024, 1, 2), 7])),
+            "orders.order_date > '2024-01-02 00:00:00' OR orders.order_date IS NULL "
+            "OR orders.order_date = '2024-01-02 00:00:00' AND orders.order_id > 7",
+        )
+        self.assertEqual(sql(keyset.after(order, [None, 7])), "orders.order_date IS NULL AND orders.order_id > 7")
+        order = keyset.parse_sort("-order_date", COLUMNS, "order_id")
+        self.assertEqual(
+            sql(keyset.after(order, [None, 7])),
+            "orders.order_date IS NOT NULL OR orders.order_date IS NULL AND orders.order_id < 7",
+        )
+
+    def test_tokens(self):
+        """test_tokens"""
+        order = keyset.parse_sort("order_date,-discount_amount", COLUMNS, "order_id")
+        values = [datetime(2024, 1, 2, 3, 4, 5), Decimal("1.50"), 7]
+        token = keyset.encode_token(order, values)
+        self.assertNotIn("=", token)
+        self.assertEqual(keyset.decode_token(token, order), values)
+        token = keyset.encode_token(order, [None, None, 7])
+        self.assertEqual(keyset.decode_token(token, order), [None, None, 7])
+
+        other = keyset.parse_sort("order_date", COLUMNS, "order_id")
+        with self.assertRaisesRegex(ValueError, "another sort"):
+            keyset.decode_token(token, other)
+        for bad in ("not a token", keyset.encode_token(order, ["yesterday", "1.50", 7])):
+            with self.assertRaisesRegex(ValueError, "Invalid page token"):
+                keyset.decode_token(bad, order)
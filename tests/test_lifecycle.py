@@ -0,0 +1,78 @@
+"""
+Test cases for the Worker Lifecycle
+"""
+
+import os
+import signal
+import tempfile
+import threading
+from unittest import TestCase
+from flask import Flask
+from wsgi import app
+from service.common.lifecycle import Lifecycle
+
+
+class TestLifecycle(TestCase):
+    """TestLifecycle"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(DRAIN_FILE="", DRAIN_TIMEOUT=1)
+        self.lifecycle = Lifecycle()
+        self.lifecycle.init_app(self.app)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+        @self.app.route("/slow")
+        def slow():
+            self.started.set()
+            self.release.wait(5)
+            return "done"
+
+        self.client = self.app.test_client()
+
+    def test_in_flight(self):
+        """test_in_flight"""
+        thread = threading.Thread(target=self.client.get, args=("/slow",))
+        thread.start()
+        self.started.wait(5)
+        self.assertEqual(self.lifecycle.in_flight, 1)
+        self.assertFalse(self.lifecycle.wait_for_requests(0.01))
+        self.release.set()
+        self.assertTrue(self.lifecycle.wait_for_requests(5))
+        thread.join()
+        self.assertEqual(self.lifecycle.in_flight, 0)
+
+    def test_draining(self):
+        """test_draining"""
+        self.assertFalse(self.lifecycle.draining)
+        with tempfile.TemporaryDirectory() as folder:
+            self.app.config["DRAIN_FILE"] = os.path.join(folder, "draining")
+            self.assertFalse(self.lifecycle.draining)
+            with open(self.app.config["DRAIN_FILE"], "w", encoding="utf-8"):
+                pass
+            self.assertTrue(self.lifecycle.draining)
+
+    def test_signal(self):
+        """test_signal"""
+        received = []
+        original = signal.signal(signal.SIGUSR1, lambda signum, frame: received.append(signum))
+        try:
+            self.lifecycle.handle_signal(signal.SIGUSR1)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.assertTrue(self.lifecycle.draining)
+            # The server still gets the signal
+            self.assertEqual(received, [signal.SIGUSR1])
+        finally:
+            signal.signal(signal.SIGUSR1, original)
+
+    def test_shutdown(self):
+        """test_shutdown"""
+        lifecycle = Lifecycle()
+        lifecycle.app = app
+        lifecycle.in_flight = 1
+        with self.assertLogs("flask.app", "INFO") as logs:
+            lifecycle.shutdown(0.01)
+        self.assertTrue(lifecycle.draining)
+        self.assertIn("1 requests still in flight", logs.output[0])
+        self.assertIn("Worker shut down", logs.output[1])
@@ -0,0 +1,106 @@
+"""
+Test cases for the Log Handlers
+"""
+
+import io
+import json
+import logging
+from unittest import TestCase
+from flask import Flask
+from service.common import log_handlers
+from service.common.log_handlers import (
+    JsonFormatter,
+    RequestContextFilter,
+    SamplingFilter,
+    parse_sample_rates,
+)
+
+
+def make_record(name="flask.app", level=logging.INFO, msg="hello %s", args=("world",), exc_info=None):
+    """Creates a log record"""
+    return logging.LogRecord(name, level, __file__, 1, msg, args, exc_info)
+
+
+class TestLogHandlers(TestCase):
+    """TestLogHandlers"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(LOG_FORMAT="json", LOG_SAMPLE_RATES="")
+
+        @self.app.route("/items/<int:item_id>")
+        def get_item(item_id):
+            logging.getLogger("flask.app").info("Getting %s", item_id)
+            return "ok"
+
+        self.stream = io.StringIO()
+        self.gunicorn_logger = logging.getLogger("test.gunicorn")
+        self.gunicorn_logger.handlers = [logging.StreamHandler(self.stream)]
+        self.gunicorn_logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        log_handlers.stop_logging()
+
+    def test_json_formatter(self):
+        """test_json_formatter"""
+        record = make_record()
+        record.request_id = "abc"
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "hello world")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["request_id"], "abc")
+        self.assertNotIn("route", entry)
+        try:
+            raise ValueError("bad")
+        except ValueError as error:
+            record = make_record(level=logging.ERROR, exc_info=(ValueError, error, error.__traceback__))
+        self.assertIn("ValueError: bad", json.loads(JsonFormatter().format(record))["exception"])
+
+    def test_sampling_filter(self):
+        """test_sampling_filter"""
+        self.assertEqual(parse_sample_rates(" flask.app.models=0, other=0.5,"), {"flask.app.models": 0.0, "other": 0.5})
+        sampling = SamplingFilter({"flask.app.models": 0.0})
+        self.assertFalse(sampling.filter(make_record("flask.app.models")))
+        self.assertTrue(sampling.filter(make_record("flask.app.models", logging.WARNING)))
+        self.assertTrue(sampling.filter(make_record("flask.app")))
+
+    def test_request_context_filter(self):
+        """test_request_context_filter"""
+        record = make_record()
+        with self.app.test_request_context("/items/1"):
+            self.assertTrue(RequestContextFilter().filter(record))
+        self.assertEqual(record.route, "/items/<int:item_id>")
+
+    def test_queued_logging(self):
+        """test_queued_logging"""
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        log_handlers.init_request_logging(self.app)
+        client = self.app.test_client()
+        resp = client.get("/items/7", headers={"X-Request-ID": "req-1"})
+        self.assertEqual(resp.headers["X-Request-ID"], "req-1")
+        self.assertEqual(len(client.get("/items/8").headers["X-Request-ID"]), 32)
+        log_handlers.stop_logging()
+        entries = [json.loads(line) for line in self.stream.getvalue().splitlines()]
+        self.assertEqual(entries[0]["message"], "Logging handler established")
+        self.assertEqual((entries[1]["message"], entries[1]["route"]), ("Getting 7", "/items/<int:item_id>"))
+        self.assertEqual(entries[2]["logger"], "flask.app.requests")
+        self.assertEqual((entries[2]["request_id"], entries[2]["status"]), ("req-1", 200))
+        self.assertIn("latency_ms", entries[2])
+
+    def test_text_format(self):
+        """test_text_format"""
+        self.app.config["LOG_FORMAT"] = "text"
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        log_handlers.stop_logging()
+        self.assertIn("[INFO] [log_handlers] Logging handler established", self.stream.getvalue())
+
+    def test_restart_logging(self):
+        """test_restart_logging"""
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        # A forked worker has the queue but not the thread that writes it
+        log_handlers._listener.stop()  # pylint: disable=protected-access
+        log_handlers.restart_logging()
+        logging.getLogger("flask.app").info("Logging in a worker")
+        log_handlers.stop_logging()
+        self.assertIn("Logging in a worker", self.stream.getvalue())
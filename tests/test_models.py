@@ -4,9 +4,19 @@ Test cases for Pet Model
 
 import os
 import logging
+import tempfile
+from datetime import datetime
+from decimal import Decimal
 from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 from wsgi import app
-from service.models import DataValidationError, Orders, OrderItems, db
+from service.models import (
+    ORDER_TOTALS, DataValidationError, StatusTransitionError, Orders, OrderItems, db, order_status_history
+)
+from service.common import money
+from service.common.archive import order_archive
 from tests.factories import OrdersFactory, OrderItemsFactory
 
 DATABASE_URI = os.getenv(
@@ -192,6 +202,14 @@ class TestOrdersModel(TestCase):
         found = Orders.find_by_status(status)
         self.assertEqual(len(found), count)
 
+    def test_prepared_statements(self):
+        """test_prepared_statements"""
+        OrdersFactory(status="shipped").create()
+        for _ in range(3):
+            self.assertEqual(len(Orders.find_by_status("shipped")), 1)
+        prepared = db.session.scalars(text("SELECT statement FROM pg_prepared_statements")).all()
+        self.assertTrue(any("WHERE orders.status = " in statement for statement in prepared))
+
     def test_find_by_tracking_number(self):
         """test_find_by_tracking_number"""
         test_orders = OrdersFactory.create_batch(10)
@@ -202,6 +220,53 @@ class TestOrdersModel(TestCase):
         found = Orders.find_by_tracking_number(tracking_number)
         self.assertEqual(len(found), count)
 
+    def test_search_by_tracking_number(self):
+        """test_search_by_tracking_number"""
+        for tracking_number in ["1Z999AA10123", "1Z999AA10456", "1Z888BB10999", "9400_100"]:
+            OrdersFactory(tracking_number=tracking_number).create()
+        OrdersFactory(tracking_number=None).create()
+        found = Orders.search_by_tracking_number("1Z999")
+        self.assertEqual([order.tracking_number for order in found], ["1Z999AA10123", "1Z999AA10456"])
+        found = Orders.search_by_tracking_number("1Z", page=2, per_page=2)
+        self.assertEqual([order.tracking_number for order in found], ["1Z999AA10456"])
+        # LIKE wildcards in the query are matched literally
+        self.assertEqual(len(Orders.search_by_tracking_number("9400_")), 1)
+        self.assertEqual(len(Orders.search_by_tracking_number("9400%")), 0)
+        found = Orders.search_by_tracking_number("AA10", mode="fuzzy")
+        self.assertEqual(
+            sorted(order.tracking_number for order in found), ["1Z999AA10123", "1Z999AA10456"]
+        )
+        with self.assertRaises(DataValidationError):
+            Orders.search_by_tracking_number("1Z", mode="regex")
+        with self.assertRaises(DataValidationError):
+            Orders.search_by_tracking_number("1Z", page=0)
+
+    @patch("service.models.has_trigram_index", return_value=False)
+    def test_search_by_tracking_number_without_trigrams(self, _):
+        """test_search_by_tracking_number_without_trigrams"""
+        for tracking_number in ["1Z999AA10123", "1z999aa10456", "9400100"]:
+            OrdersFactory(tracking_number=tracking_number).create()
+        found = Orders.search_by_tracking_number("AA10", mode="fuzzy")
+        self.assertEqual([order.tracking_number for order in found], ["1Z999AA10123", "1z999aa10456"])
+        self.assertEqual(len(Orders.search_by_tracking_number("AA10", mode="fuzzy", page=2, per_page=1)), 1)
+        # Near misses need pg_trgm
+        self.assertEqual(Orders.search_by_tracking_number("1Z999AA1O123", mode="fuzzy"), [])
+        self.assertEqual(Orders.search_by_tracking_number("%", mode="fuzzy"), [])
+
+    @patch("service.models.searches_in_database", return_value=False)
+    @patch("service.models.has_trigram_index", return_value=False)
+    def test_search_by_tracking_number_in_memory(self, *_):
+        """test_search_by_tracking_number_in_memory"""
+        order = OrdersFactory(tracking_number="1Z999AA10123")
+        order.create()
+        found = Orders.search_by_tracking_number("1Z999AA1O123", mode="fuzzy")
+        self.assertEqual([order.order_id for order in found], [order.order_id])
+        # The index follows changes to the orders
+        order.tracking_number = "9400100"
+        order.update()
+        self.assertEqual(Orders.search_by_tracking_number("1Z999AA1O123", mode="fuzzy"), [])
+        self.assertEqual(len(Orders.search_by_tracking_number("94001", mode="fuzzy")), 1)
+
     def test_find_by_discount_amount(self):
         """test_find_by_discount_amount"""
         test_orders = OrdersFactory.create_batch(10)
@@ -212,6 +277,117 @@ class TestOrdersModel(TestCase):
         found = Orders.find_by_discount_amount(discount_amount)
         self.assertEqual(len(found), count)
 
+    def test_find_by_discount_range(self):
+        """test_find_by_discount_range"""
+        for discount_amount in ["0.10", "0.20", "0.30", "10.00"]:
+            OrdersFactory(discount_amount=Decimal(discount_amount)).create()
+        found = Orders.find_by_discount_range(Decimal("0.20"), Decimal("0.30"))
+        self.assertEqual([order.discount_amount for order in found], [Decimal("0.20"), Decimal("0.30")])
+        found = Orders.find_by_discount_range(discount_min=Decimal("0.30"))
+        self.assertEqual([order.discount_amount for order in found], [Decimal("0.30"), Decimal("10.00")])
+        found = Orders.find_by_discount_range(discount_max=Decimal("0.10"))
+        self.assertEqual(len(found), 1)
+        self.assertEqual(len(Orders.find_by_discount_range()), 4)
+
+    def test_money_is_exact(self):
+        """test_money_is_exact"""
+        order = Orders.create_new({"customer_id": 1, "discount_amount": 0.1})
+        order.discount_amount += money.parse(0.2)
+        order.update()
+        self.assertEqual(Orders.find_by_discount_amount(Decimal("0.3"))[0].order_id, order.order_id)
+        self.assertEqual(order.serialize()["discount_amount"], 0.3)
+        with self.assertRaises(DataValidationError):
+            Orders.create_new({"customer_id": 1, "discount_amount": 0.125})
+
+    def test_bulk_update_status(self):
+        """test_bulk_update_status"""
+        orders = [OrdersFactory(status=order_status) for order_status in ["pending", "processing", "delivered"]]
+        for order in orders:
+            order.create()
+        order_ids = [order.order_id for order in orders]
+        result = Orders.bulk_update_status(
+            order_ids + [order_ids[0], 0], "shipped", {order_ids[0]: "1Z999"}, chunk_size=2
+        )
+        self.assertEqual(result["updated"], order_ids[:2])
+        self.assertEqual(result["rejected"], [order_ids[2]])
+        self.assertEqual(result["not_found"], [0])
+        self.assertEqual(Orders.find(order_ids[0]).tracking_number, "1Z999")
+        self.assertEqual(Orders.find(order_ids[1]).tracking_number, orders[1].tracking_number)
+        self.assertEqual([order.status for order in Orders.find_by_status("shipped")], ["shipped", "shipped"])
+        self.assertEqual(Orders.find_ids_by_filter({"status": "shipped"}), order_ids[:2])
+        with self.assertRaises(DataValidationError):
+            Orders.bulk_update_status(order_ids, "lost")
+        for criteria in ({"order_date": "2024-01-01"}, {"status": "bogus"}, {"customer_id": "7"}, [], {}):
+            with self.assertRaises(DataValidationError):
+                Orders.find_ids_by_filter(criteria)
+
+        # A chunk that fails leaves every order of the change alone
+        orders = [OrdersFactory(status="pending") for _ in range(2)]
+        for order in orders:
+            order.create()
+        order_ids = [order.order_id for order in orders]
+        with self.assertRaises(DataValidationError):
+            Orders.bulk_update_status(order_ids, "processing", {order_ids[1]: "1Z\x00"}, chunk_size=1)
+        self.assertEqual([Orders.find(order_id).status for order_id in order_ids], ["pending", "pending"])
+
+    def test_status_transitions(self):
+        """test_status_transitions"""
+        order = OrdersFactory(status="pending")
+        order.create()
+        order.status = "delivered"
+        self.assertRaises(StatusTransitionError, order.update)
+        order.status = "lost"
+        self.assertRaises(DataValidationError, order.update)
+        order.status = "processing"
+        order.update()
+        order.status = "cancelled"
+        order.update()
+
+        # The database checks orders whose old status was never loaded
+        db.session.expire(order)
+        order.status = "shipped"
+        self.assertRaises(StatusTransitionError, order.update)
+
+        history = Orders.find_status_history(order.order_id)
+        self.assertEqual(
+            [(change["from_status"], change["to_status"]) for change in history],
+            [(None, "pending"), ("pending", "processing"), ("processing", "cancelled")],
+        )
+        with self.assertRaises(DBAPIError):
+            db.session.execute(db.delete(order_status_history))
+        db.session.rollback()
+
+    def test_merge_patch(self):
+        """test_merge_patch"""
+        order = OrdersFactory(status="pending", tracking_number="1Z1", discount_amount=Decimal("1.00"))
+        order.create()
+        order_id = order.order_id
+
+        def row_version():
+            return db.session.execute(text("SELECT xmin FROM orders WHERE order_id = :id"), {"id": order_id}).scalar()
+
+        version = row_version()
+        patched = Orders.merge_patch(order_id, {"discount_amount": "1.00", "status": "pending"})
+        self.assertEqual(patched.discount_amount, Decimal("1.00"))
+        self.assertEqual(row_version(), version)
+        self.assertEqual(Orders.merge_patch(order_id, {}).order_id, order_id)
+
+        patched = Orders.merge_patch(order_id, {"status": "processing", "tracking_number": None})
+        self.assertEqual((patched.status, patched.tracking_number), ("processing", None))
+        self.assertEqual(patched.customer_id, order.customer_id)
+        self.assertNotEqual(row_version(), version)
+        patched = Orders.merge_patch(order_id, {"customer_id": 5, "order_date": "2024-01-02T03:04:05"})
+        self.assertEqual((patched.customer_id, patched.order_date), (5, datetime(2024, 1, 2, 3, 4, 5)))
+        self.assertEqual(len(Orders.find_status_history(order_id)), 2)
+
+        self.assertRaises(StatusTransitionError, Orders.merge_patch, order_id, {"status": "pending"})
+        for invalid in [
+            [], {"order_id": 1}, {"customer_id": None}, {"customer_id": "5"}, {"status": "lost"},
+            {"tracking_number": 5}, {"order_date": "yesterday"}, {"discount_amount": 0.001},
+        ]:
+            self.assertRaises(DataValidationError, Orders.merge_patch, order_id, invalid)
+        self.assertIsNone(Orders.merge_patch(0, {"customer_id": 5}))
+
 
 class TestOrderItemsModel(TestCase):
     """TestOrderItemsModel"""
@@ -347,6 +523,10 @@ class TestOrderItemsModel(TestCase):
             item.order_id, item.order_item_id, item_data
         )
         self.assertEqual(updated_item.quantity, 2)
+        updated_item = OrderItems.update_item_in_order(item.order_id, item.order_item_id, {"price": "9.50"})
+        self.assertEqual(updated_item.price, Decimal("9.50"))
+        with self.assertRaises(DataValidationError):
+            OrderItems.update_item_in_order(item.order_id, item.order_item_id, {"price": 0.125})
         item = OrderItems.update_item_in_order(
             updated_item.order_id + 1, updated_item.order_item_id, item_data
         )
@@ -386,6 +566,147 @@ class TestOrderItemsModel(TestCase):
         )
         assert item_test is None
 
+    def test_apply_batch(self):
+        """test_apply_batch"""
+        order = OrdersFactory()
+        order.create()
+        items = [OrderItemsFactory(order_id=order.order_id) for _ in range(3)]
+        for item in items:
+            item.create()
+        item_ids = [item.order_item_id for item in items]
+        result = OrderItems.apply_batch(
+            order.order_id,
+            [
+                {"op": "remove", "order_item_id": item_ids[0]},
+                {"op": "update", "order_item_id": item_ids[1], "quantity": 5, "price": "1.10"},
+                {"op": "update", "order_item_id": item_ids[2], "product_id": 42},
+                {"op": "add", "product_id": 7, "quantity": 1, "price": 2.5},
+            ],
+        )
+        self.assertEqual([item.order_item_id for item in result[:2]], item_ids[1:])
+        self.assertEqual((result[0].quantity, result[0].price), (5, Decimal("1.10")))
+        self.assertEqual((result[1].product_id, result[1].quantity), (42, items[2].quantity))
+        self.assertEqual((result[2].product_id, result[2].price), (7, Decimal("2.50")))
+        self.assertEqual(result[2].order_date, order.order_date)
+
+        # Nothing is written if any operation fails
+        for operations in [
+            [{"op": "add", "product_id": 1, "quantity": 1, "price": 1}, {"op": "remove", "order_item_id": item_ids[0]}],
+            [{"op": "update", "order_item_id": item_ids[1]}, {"op": "update", "order_item_id": item_ids[1]}],
+            [{"op": "add", "product_id": 1, "quantity": 1}],
+            [{"op": "add", "product_id": "1", "quantity": 1, "price": 1}],
+            [{"op": "add", "product_id": 1, "quantity": 1, "price": 0.001}],
+            [{"op": "move"}],
+            {"op": "add"},
+        ]:
+            with self.assertRaises(DataValidationError):
+                OrderItems.apply_batch(order.order_id, operations)
+        self.assertEqual(len(OrderItems.find_by_order(order.order_id)), 3)
+        with self.assertRaises(DataValidationError):
+            OrderItems.apply_batch(0, [{"op": "add", "product_id": 1, "quantity": 1, "price": 1}])
+
+    def test_items_follow_order_date(self):
+        """test_items_follow_order_date"""
+        order = OrdersFactory(order_date=datetime(2024, 3, 4, 12))
+        order.create()
+        order_id = order.order_id
+        OrderItems.create_item(order_id, {"product_id": 1, "quantity": 1, "price": "1.00"})
+        OrderItems.create_item(order_id, {"product_id": 2, "quantity": 1, "price": "1.00"})
+
+        def item_dates():
+            return db.session.scalars(db.select(OrderItems.order_date).where(OrderItems.order_id == order_id)).all()
+
+        Orders.update_order(order_id, {"order_date": datetime(2024, 5, 1, 9)})
+        self.assertEqual(item_dates(), [datetime(2024, 5, 1, 9)] * 2)
+        Orders.merge_patch(order_id, {"order_date": "2024-06-02T10:00:00"})
+        self.assertEqual(item_dates(), [datetime(2024, 6, 2, 10)] * 2)
+        # Other changes leave the items alone
+        Orders.merge_patch(order_id, {"tracking_number": "1Z1"})
+        self.assertEqual(item_dates(), [datetime(2024, 6, 2, 10)] * 2)
+
+    def test_item_totals(self):
+        """test_item_totals"""
+        order = OrdersFactory()
+        order.create()
+        order_id = order.order_id
+
+        def totals():
+            db.session.expire_all()
+            found = Orders.find(order_id)
+            return found.item_count, found.total_amount
+
+        self.assertEqual(totals(), (0, Decimal(0)))
+        first = OrderItems.create_item(order_id, {"product_id": 1, "quantity": 2, "price": "1.25"}).order_item_id
+        second = OrderItems.create_item(order_id, {"product_id": 2, "quantity": 1, "price": "10.00"}).order_item_id
+        self.assertEqual(totals(), (2, Decimal("12.50")))
+        OrderItems.update_item_in_order(order_id, first, {"quantity": 4})
+        self.assertEqual(totals(), (2, Decimal("15.00")))
+        OrderItems.update_item_in_order(order_id, first, {"product_id": 3})
+        self.assertEqual(totals(), (2, Decimal("15.00")))
+        OrderItems.delete_item_from_order(order_id, second)
+        self.assertEqual(totals(), (1, Decimal("5.00")))
+        OrderItems.apply_batch(
+            order_id,
+            [
+                {"op": "add", "product_id": 3, "quantity": 3, "price": "1.00"},
+                {"op": "update", "order_item_id": first, "price": "2.00"},
+            ],
+        )
+        self.assertEqual(totals(), (2, Decimal("11.00")))
+
+        # A value changed before it was loaded makes the order count its items again
+        item = OrderItems.find_item_in_order(order_id, first)
+        db.session.expire(item, ["quantity"])
+        item.quantity = 1
+        item.update()
+        self.assertEqual(totals(), (2, Decimal("5.00")))
+
+        # Drift is repaired in batches
+        db.session.execute(db.update(Orders).where(Orders.order_id == order_id).values(item_count=7))
+        db.session.commit()
+        OrdersFactory().create()
+        self.assertEqual(Orders.recompute_totals(batch_size=1), 1)
+        self.assertEqual(totals(), (2, Decimal("5.00")))
+        self.assertEqual(Orders.recompute_totals(), 0)
+
+        # The changes of a transaction that failed are forgotten
+        db.session.info[ORDER_TOTALS] = {order_id: None}
+        db.session.rollback()
+        self.assertNotIn(ORDER_TOTALS, db.session.info)
+
+        # Deleting the order deletes its items and not the totals of a gone order
+        Orders.find(order_id).delete()
+        self.assertEqual(OrderItems.query.filter_by(order_id=order_id).count(), 0)
+
+    def test_archive_orders(self):
+        """test_archive_orders"""
+        old, recent, pending = (
+            OrdersFactory(status="delivered", order_date=datetime(2020, 1, 1)),
+            OrdersFactory(status="cancelled", order_date=datetime.utcnow()),
+            OrdersFactory(status="pending", order_date=datetime(2020, 1, 1)),
+        )
+        old_refunded = OrdersFactory(status="refunded", order_date=datetime(2020, 2, 1))
+        for order in [old, recent, pending, old_refunded]:
+            order.create()
+        OrderItemsFactory(order_id=old.order_id, price=Decimal("9.99")).create()
+        OrderItemsFactory(order_id=old.order_id).create()
+        old_id, pending_id = old.order_id, pending.order_id
+        with tempfile.TemporaryDirectory() as folder, patch.object(order_archive, "path", folder):
+            self.assertEqual(Orders.archive(datetime(2024, 1, 1), batch_size=1), 2)
+            self.assertEqual(len([name for name in os.listdir(folder) if name.endswith(".ndjson.gz")]), 2)
+            self.assertEqual(Orders.get_all_orders_amount(), 2)
+            self.assertEqual(OrderItems.query.count(), 0)
+            found = Orders.find(old_id)
+            self.assertTrue(found.archived)
+            self.assertEqual(found.status, "delivered")
+            self.assertEqual(len(found.order_items), 2)
+            self.assertEqual(found.item_count, 2)
+            self.assertEqual(found.order_items[0].price, Decimal("9.99"))
+            self.assertFalse(Orders.find(pending_id).archived)
+            self.assertIsNone(Orders.find(pending_id + 1000))
+            self.assertEqual(Orders.archive(datetime(2024, 1, 1)), 0)
+        self.assertIsNone(Orders.find(old_id))
+
     def test_item_repr(self):
         """test_item_repr"""
         order = OrdersFactory()
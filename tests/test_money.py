@@ -0,0 +1,32 @@
+"""
+Test cases for the Money helpers
+"""
+
+from decimal import Decimal
+from unittest import TestCase
+from service.common import money
+
+
+class TestMoney(TestCase):
+    """TestMoney"""
+
+    def test_parse(self):
+        """test_parse"""
+        self.assertEqual(money.parse(10), Decimal("10.00"))
+        self.assertEqual(money.parse(0.1), Decimal("0.10"))
+        self.assertEqual(money.parse(19.99), Decimal("19.99"))
+        self.assertEqual(money.parse(" 5.5 "), Decimal("5.50"))
+        self.assertEqual(money.parse(Decimal("1.50")), Decimal("1.50"))
+        self.assertEqual(str(money.parse(3)), "3.00")
+
+    def test_parse_invalid(self):
+        """test_parse_invalid"""
+        for value in ["invalid", "NaN", float("inf"), True, None, [], 1.005, "1e20"]:
+            with self.assertRaises(ValueError, msg=repr(value)):
+                money.parse(value)
+
+    def test_serialize(self):
+        """test_serialize"""
+        self.assertEqual(money.serialize(Decimal("19.99")), 19.99)
+        self.assertEqual(repr(money.serialize(Decimal("9999999999.99"))), "9999999999.99")
+        self.assertIsNone(money.serialize(None))
@@ -0,0 +1,42 @@
+"""
+Test cases for the Profiler
+"""
+
+import threading
+from unittest import TestCase
+from collections import Counter
+from service.common import profiler
+
+
+class TestProfiler(TestCase):
+    """TestProfiler"""
+
+    def test_sample_stacks(self):
+        """test_sample_stacks"""
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait, name="waiter")
+        thread.start()
+        try:
+            stacks = profiler.sample_stacks(0.05, 0.01)
+        finally:
+            stop.set()
+            thread.join()
+        waiting = [stack for stack in stacks if stack.startswith("waiter;")]
+        self.assertEqual(len(waiting), 1)
+        self.assertIn(";wait (threading.py:", waiting[0])
+        self.assertFalse(any("sample_stacks" in stack for stack in stacks))
+
+    def test_collapse(self):
+        """test_collapse"""
+        stacks = Counter({"main;run;work": 3, "main;run": 5})
+        self.assertEqual(profiler.collapse(stacks), "main;run 5\nmain;run;work 3\n")
+
+    def test_profile_worker(self):
+        """test_profile_worker"""
+        self.assertIsInstance(profiler.profile_worker(0.01), str)
+        with profiler._sampling:  # pylint: disable=protected-access
+            self.assertIsNone(profiler.profile_worker(0.01))
+
+    def test_resident_memory(self):
+        """test_resident_memory"""
+        self.assertGreater(profiler.resident_memory(), 0)
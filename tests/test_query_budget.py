@@ -0,0 +1,53 @@
+"""
+Test cases for the SQL Query Budget
+"""
+
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import create_engine, text
+from service.common.query_budget import QueryBudget, QueryBudgetExceeded, RequestQueries, fingerprint
+
+
+class TestQueryBudget(TestCase):
+    """TestQueryBudget"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.app = Flask(__name__)
+        self.app.config.update(SQL_QUERY_BUDGET=3, SQL_REPEAT_LIMIT=2, SQL_BUDGET_STRICT=False)
+        QueryBudget().init_app(self.app)
+
+        @self.app.route("/queries/<int:count>")
+        def run_queries(count):
+            with self.engine.connect() as conn:
+                for number in range(count):
+                    conn.execute(text(f"SELECT {number}"))
+            return "ok"
+
+        self.client = self.app.test_client()
+
+    def test_fingerprint(self):
+        """test_fingerprint"""
+        self.assertEqual(
+            fingerprint("SELECT *\n  FROM orders WHERE order_id IN (1, 2, 3) AND status = 'it''s' LIMIT 20"),
+            "SELECT * FROM orders WHERE order_id IN (...) AND status = ? LIMIT ?",
+        )
+        self.assertEqual(RequestQueries().most_repeated(), (None, 0))
+
+    def test_server_timing(self):
+        """test_server_timing"""
+        resp = self.client.get("/queries/1")
+        self.assertRegex(resp.headers["Server-Timing"], r'^db;dur=[\d.]+;desc="1 queries"$')
+
+    def test_over_budget(self):
+        """test_over_budget"""
+        with self.assertLogs("flask.app", "WARNING") as logs:
+            resp = self.client.get("/queries/4")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("4 SQL statements, the budget is 3", logs.output[0])
+        self.assertIn("repeated 4 times: SELECT ?", logs.output[1])
+
+        self.app.config["SQL_BUDGET_STRICT"] = True
+        self.app.config["TESTING"] = True
+        self.assertRaises(QueryBudgetExceeded, self.client.get, "/queries/4")
+        self.assertEqual(self.client.get("/queries/1").status_code, 200)
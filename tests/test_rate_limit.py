@@ -0,0 +1,137 @@
+"""
+Test cases for Rate Limiting and Load Shedding
+"""
+
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from service.common.rate_limit import (
+    LocalStore,
+    MemoryBackend,
+    RateLimiter,
+    SharedBackend,
+    TokenBucket,
+    parse_costs,
+)
+
+
+class TestRateLimit(TestCase):
+    """TestRateLimit"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(
+            RATE_LIMIT_RATE=1.0,
+            RATE_LIMIT_BURST=3.0,
+            RATE_LIMIT_COSTS="list_orders=2",
+            LOAD_SHED_MAX_IN_FLIGHT=2,
+            LOAD_SHED_RETRY_AFTER=1,
+        )
+        self.limiter = RateLimiter()
+        self.limiter.init_app(self.app)
+
+        @self.app.route("/orders")
+        def list_orders():
+            return "orders"
+
+        @self.app.route("/orders/<int:order_id>")
+        def get_order(order_id):
+            return str(order_id)
+
+        @self.app.route("/health")
+        def health():
+            return "ok"
+
+        self.client = self.app.test_client()
+
+    def test_token_bucket(self):
+        """test_token_bucket"""
+        bucket = TokenBucket(3.0, 0.0)
+        self.assertEqual(bucket.take(2, 1.0, 3.0, 0.0), 0.0)
+        self.assertEqual(bucket.take(2, 1.0, 3.0, 0.0), 1.0)
+        self.assertEqual(bucket.take(2, 1.0, 3.0, 1.0), 0.0)
+        # Tokens never go over the burst and a cost over it is capped
+        self.assertEqual(bucket.take(5, 1.0, 3.0, 100.0), 0.0)
+        self.assertEqual(bucket.tokens, 0.0)
+        self.assertEqual(parse_costs(" list_orders=5, ,search_orders = 2.5"), {"list_orders": 5, "search_orders": 2.5})
+
+    def test_rate_limited(self):
+        """test_rate_limited"""
+        self.assertEqual(self.client.get("/orders").status_code, 200)
+        self.assertEqual(self.client.get("/orders/1").status_code, 200)
+        resp = self.client.get("/orders")
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["Retry-After"], "2")
+        # Other clients have their own bucket and probes are never limited
+        self.assertEqual(self.client.get("/orders", headers={"X-Api-Key": "other"}).status_code, 200)
+        self.assertEqual(self.client.get("/health").status_code, 200)
+
+        self.app.config["RATE_LIMIT_RATE"] = 0
+        self.assertEqual(self.client.get("/orders").status_code, 200)
+
+    def test_trusted_proxy(self):
+        """test_trusted_proxy"""
+        app = Flask(__name__)
+        app.config.update(RATE_LIMIT_RATE=1.0, RATE_LIMIT_BURST=1.0, LOAD_SHED_MAX_IN_FLIGHT=0, TRUSTED_PROXY_HOPS=1)
+        RateLimiter().init_app(app)
+
+        @app.route("/orders")
+        def list_orders():
+            return "orders"
+
+        client = app.test_client()
+        # Clients behind the same proxy have their own buckets
+        for address in ("203.0.113.1", "203.0.113.2"):
+            headers = {"X-Forwarded-For": address}
+            self.assertEqual(client.get("/orders", headers=headers).status_code, 200)
+            self.assertEqual(client.get("/orders", headers=headers).status_code, 429)
+        # Only the address the trusted proxy added counts
+        headers = {"X-Forwarded-For": "198.51.100.7, 203.0.113.1"}
+        self.assertEqual(client.get("/orders", headers=headers).status_code, 429)
+
+        # Without trusted proxies the header is ignored
+        headers = {"X-Forwarded-For": "203.0.113.3"}
+        self.assertEqual(self.client.get("/orders/1", headers=headers).status_code, 200)
+        self.assertEqual(self.client.get("/orders", headers={"X-Forwarded-For": "203.0.113.4"}).status_code, 200)
+        self.assertEqual(self.client.get("/orders", headers={"X-Forwarded-For": "203.0.113.5"}).status_code, 429)
+
+    def test_memory_backend_prune(self):
+        """test_memory_backend_prune"""
+        backend = MemoryBackend(max_keys=2)
+        with patch("service.common.rate_limit.time.monotonic", side_effect=[0.0, 1.0, 10.0]):
+            backend.take("a", 1, 1.0, 3.0)
+            backend.take("b", 1, 1.0, 3.0)
+            backend.take("c", 1, 1.0, 3.0)
+        self.assertEqual(list(backend._buckets), ["c"])  # pylint: disable=protected-access
+
+    def test_shared_backend(self):
+        """test_shared_backend"""
+        self.limiter.backend = SharedBackend(LocalStore())
+        self.assertEqual(self.client.get("/orders").status_code, 200)
+        self.assertEqual(self.client.get("/orders").status_code, 429)
+
+        # A replica that changed the bucket first makes the other one retry
+        store = LocalStore()
+        store.compare_and_set("key", None, (3.0, 0.0), 60)
+        self.assertFalse(store.compare_and_set("key", None, (1.0, 0.0), 60))
+        with patch.object(LocalStore, "compare_and_set", return_value=False):
+            with self.assertLogs("flask.app", "WARNING"):
+                self.assertEqual(SharedBackend(store).take("key", 1, 1.0, 3.0), 0.0)
+
+        # Requests go through when the store is down
+        with patch.object(LocalStore, "get", side_effect=ConnectionError("down")):
+            with self.assertLogs("flask.app", "ERROR"):
+                self.assertEqual(SharedBackend(store).take("key", 1, 1.0, 3.0), 0.0)
+
+    def test_load_shedding(self):
+        """test_load_shedding"""
+        self.app.config["RATE_LIMIT_RATE"] = 0
+        self.assertEqual(self.client.get("/orders/1").status_code, 200)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+        self.limiter.in_flight = 2
+        resp = self.client.get("/orders/1")
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "1")
+        self.assertEqual(self.client.get("/health").status_code, 200)
+        self.assertEqual(self.limiter.in_flight, 2)
@@ -0,0 +1,39 @@
+"""
+Test cases for the Sorted Search Index
+"""
+
+from unittest import TestCase
+from service.common.search import SortedIndex
+
+
+class TestSortedIndex(TestCase):
+    """TestSortedIndex"""
+
+    def setUp(self):
+        self.index = SortedIndex()
+        self.index.rebuild(
+            [("1Z999AA10456", 2), ("1Z999AA10123", 1), ("9400100", 3), (None, 4), ("1Z888BB10999", 5)]
+        )
+
+    def test_stale(self):
+        """test_stale"""
+        self.assertTrue(SortedIndex().stale)
+        self.assertFalse(self.index.stale)
+        self.index.invalidate()
+        self.assertTrue(self.index.stale)
+
+    def test_prefix(self):
+        """test_prefix"""
+        self.assertEqual(self.index.prefix("1Z999"), [1, 2])
+        self.assertEqual(self.index.prefix("1Z", offset=1, limit=1), [1])
+        self.assertEqual(self.index.prefix("1Z", limit=10), [5, 1, 2])
+        self.assertEqual(self.index.prefix("2"), [])
+
+    def test_fuzzy(self):
+        """test_fuzzy"""
+        # Substrings first, shorter keys first
+        self.assertEqual(self.index.fuzzy("10"), [3, 5, 1, 2])
+        # A typo still finds the tracking number
+        self.assertEqual(self.index.fuzzy("1Z999AA1O123"), [1, 2])
+        self.assertEqual(self.index.fuzzy("1Z999AA1O123", offset=1), [2])
+        self.assertEqual(self.index.fuzzy("XXXXXXXXXXXX"), [])
@@ -0,0 +1,91 @@
+"""
+Test cases for Single Flight
+"""
+
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock
+from flask import Flask
+from service.common.single_flight import SingleFlight
+
+
+class TestSingleFlight(TestCase):
+    """TestSingleFlight"""
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self, result=None, error=None):
+        """Returns a call that blocks until the test releases it"""
+
+        def call():
+            self.calls += 1
+            self.started.set()
+            self.release.wait(5)
+            if error is not None:
+                raise error
+            return result
+
+        return call
+
+    def run_together(self, call, followers=3):
+        """Runs call in a leader and followers, returns their results or errors"""
+        results = []
+
+        def run():
+            try:
+                results.append(self.flights.do("order:1", call))
+            except ValueError as error:
+                results.append(error)
+
+        leader = threading.Thread(target=run)
+        leader.start()
+        self.started.wait(5)
+        threads = [threading.Thread(target=run) for _ in range(followers)]
+        for thread in threads:
+            thread.start()
+        # Followers are counted before they wait
+        while self.flights._flights["order:1"].followers < followers:  # pylint: disable=protected-access
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in [leader] + threads:
+            thread.join(5)
+        return results
+
+    def test_shared_result(self):
+        """test_shared_result"""
+        results = self.run_together(self.slow({"id": 1}))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{"id": 1}] * 4)
+        # The next call runs again
+        self.assertEqual(self.flights.do("order:1", lambda: "again"), "again")
+
+    def test_shared_error(self):
+        """test_shared_error"""
+        error = ValueError("database is down")
+        results = self.run_together(self.slow(error=error), followers=2)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [error] * 3)
+
+    def test_forget(self):
+        """test_forget"""
+        thread = threading.Thread(target=self.flights.do, args=("order:1", self.slow("old")))
+        thread.start()
+        self.started.wait(5)
+        # A commit happened, a new request does not join the old flight
+        self.flights.forget(MagicMock())
+        self.assertEqual(self.flights.do("order:1", lambda: "new"), "new")
+        self.release.set()
+        thread.join(5)
+        self.assertEqual(self.flights._flights, {})  # pylint: disable=protected-access
+
+    def test_disabled(self):
+        """test_disabled"""
+        app = Flask(__name__)
+        app.config["SINGLE_FLIGHT"] = False
+        self.flights.init_app(app)
+        self.assertEqual(self.flights.do("order:1", lambda: "direct"), "direct")
+        self.assertEqual(self.flights._flights, {})  # pylint: disable=protected-access
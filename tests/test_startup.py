@@ -0,0 +1,61 @@
+"""
+Test cases for the startup of a worker
+"""
+
+import os
+import sys
+import subprocess
+from unittest import TestCase
+
+# Modules only the flask command or a rare request needs
+DEFERRED_MODULES = ("cProfile", "pstats", "sqlite3", "service.common.cli_commands", "service.common.partitions")
+
+# Most milliseconds the modules of the service and all they import may take
+# to import when a worker starts, about twice what they take on a laptop.
+# Slow CI runners can raise it, 0 skips the check.
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+
+def import_times(top_level: bool = False) -> dict:
+    """Creates the app in a new interpreter and returns the cumulative import time of each module
+
+    Times are in microseconds. With top_level, only the modules the app imported
+    itself are returned, whose times add up without counting a module twice.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "from service import create_app; create_app()"],
+        env={**os.environ, "DB_SCHEMA_MODE": "none"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            # Each level of nesting indents the name by two more spaces
+            if cumulative.strip().isdigit() and not (top_level and name.startswith("   ")):
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartup(TestCase):
+    """TestStartup"""
+
+    def test_deferred_imports(self):
+        """test_deferred_imports"""
+        times = import_times()
+        self.assertIn("service.routes", times)
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_import_time_budget(self):
+        """test_import_time_budget"""
+        if not IMPORT_TIME_BUDGET_MS:
+            self.skipTest("IMPORT_TIME_BUDGET_MS is 0")
+        times = import_times(top_level=True)
+        service = sum(cumulative for name, cumulative in times.items() if name.split(".")[0] == "service")
+        self.assertGreater(service, 0)
+        self.assertLessEqual(
+            service / 1000, IMPORT_TIME_BUDGET_MS, f"The service took {service / 1000:.0f} ms to import"
+        )
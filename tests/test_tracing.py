@@ -0,0 +1,83 @@
+"""
+Test cases for Request Tracing
+"""
+
+import io
+import json
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import create_engine, text
+from service.common.tracing import Tracer, current_span
+
+
+class TestTracing(TestCase):
+    """TestTracing"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.app = Flask(__name__)
+        self.app.config["TRACING_EXPORTER"] = "console"
+        self.tracer = Tracer()
+        self.tracer.init_app(self.app)
+        self.tracer.exporter = io.StringIO()
+
+        @self.app.route("/orders/<int:order_id>")
+        def get_order(order_id):
+            with self.tracer.span("serialize", order_id=order_id):
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+            if order_id == 0:
+                raise ValueError("no order")
+            return "ok"
+
+        self.client = self.app.test_client()
+
+    def spans(self):
+        """Returns the exported spans by name"""
+        lines = self.tracer.exporter.getvalue().splitlines()
+        return {span["name"]: span for span in map(json.loads, lines)}
+
+    def test_trace_request(self):
+        """test_trace_request"""
+        parent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+        resp = self.client.get("/orders/5", headers={"traceparent": parent})
+        spans = self.spans()
+        root, step, sql = spans["GET /orders/<int:order_id>"], spans["serialize"], spans["SELECT"]
+        self.assertEqual(root["traceId"], "0af7651916cd43dd8448eb211c80319c")
+        self.assertEqual(root["parentSpanId"], "b7ad6b7169203331")
+        self.assertEqual(step["parentSpanId"], root["spanId"])
+        self.assertEqual(sql["parentSpanId"], step["spanId"])
+        self.assertIn({"key": "db.statement", "value": {"stringValue": "SELECT 1"}}, sql["attributes"])
+        self.assertIn({"key": "http.status_code", "value": {"stringValue": "200"}}, root["attributes"])
+        self.assertEqual(resp.headers["traceparent"], f"00-{root['traceId']}-{root['spanId']}-01")
+        self.assertIsNone(current_span.get())
+
+    def test_new_trace(self):
+        """test_new_trace"""
+        resp = self.client.get("/orders/5", headers={"traceparent": "garbage"})
+        self.assertRegex(resp.headers["traceparent"], r"^00-[0-9a-f]{32}-[0-9a-f]{16}-01$")
+        self.assertEqual(self.spans()["GET /orders/<int:order_id>"]["parentSpanId"], "")
+
+    def test_failed_request(self):
+        """test_failed_request"""
+        resp = self.client.get("/orders/0")
+        self.assertEqual(resp.status_code, 500)
+        spans = self.spans()
+        self.assertEqual(spans["GET /orders/<int:order_id>"]["status"]["code"], 2)
+        self.assertEqual(spans["serialize"]["status"]["code"], 0)
+
+        with self.assertRaises(ValueError):
+            with self.app.test_request_context("/orders/1"):
+                self.tracer.start_request()
+                with self.tracer.span("failing"):
+                    raise ValueError("boom")
+        self.assertIn("boom", self.spans()["failing"]["status"]["message"])
+
+    def test_disabled(self):
+        """test_disabled"""
+        tracer = Tracer()
+        tracer.init_app(Flask(__name__))
+        self.assertFalse(tracer.enabled)
+        with tracer.span("nothing") as span:
+            self.assertIsNone(span)
+        self.assertTrue(self.tracer.enabled)